@@ -1,27 +1,89 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from . import instrumentation
+
 # Comment out SQLite configuration
 # SQLALCHEMY_DATABASE_URL = "sqlite:///./lms.db"
 
 # MySQL configuration with XAMPP
 # Default XAMPP MySQL credentials (username: root, password: empty)
-# You can change these as needed
-SQLALCHEMY_DATABASE_URL = "mysql+pymysql://root:@localhost/lms_db"
+# You can change these as needed, or override with the DATABASE_URL environment variable
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "mysql+pymysql://root:@localhost/lms_db")
+
+# Connection pool tuning (per worker process)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # recycle before MySQL wait_timeout drops it
 
-# Remove SQLite-specific connect_args for MySQL
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
-)
+if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    # SQLite connections are shared between the threadpool workers
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        connect_args={"check_same_thread": False}
+    )
+
+    @event.listens_for(engine, "connect")
+    def _enable_foreign_keys(dbapi_connection, connection_record):
+        # SQLite only enforces foreign keys, and so ON DELETE CASCADE, when asked to on each connection
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+else:
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True
+    )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 # Dependency to get DB session
 def get_db():
+    instrumentation.note_thread()
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+def create_tables():
+    """
+    Create any missing tables. Kept out of module import so workers don't hit the DB while booting.
+    """
+    # Import the models so they are registered on Base.metadata
+    from ..models import users, exams, finance, files, idempotency  # noqa: F401
+    Base.metadata.create_all(bind=engine)
+
+def reset_pool_after_fork():
+    """
+    Drop pooled connections inherited from a parent process (e.g. a preloading master)
+    without closing them, so the child opens its own sockets.
+    """
+    engine.dispose(close=False)
+
+def warm_pool(size: int = None):
+    """
+    Open `size` pooled connections up front so the first requests of a worker
+    don't pay for the TCP/auth handshake.
+    """
+    size = size or getattr(engine.pool, "size", lambda: 1)()
+    connections = []
+    try:
+        for _ in range(size):
+            connection = engine.connect()
+            connection.execute(text("SELECT 1"))
+            connections.append(connection)
+    finally:
+        # Returning them to the pool keeps them open for reuse
+        for connection in connections:
+            connection.close()
+    return len(connections)
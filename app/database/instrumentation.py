@@ -0,0 +1,81 @@
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+class QueryStats:
+    """
+    SQL activity of one request. The object is shared with the threadpool
+    workers that run sync handlers, since they inherit the request context.
+    """
+
+    __slots__ = ("query_count", "db_time", "timeline", "threads", "started")
+
+    def __init__(self, record_timeline: bool = False):
+        self.query_count = 0
+        self.db_time = 0.0
+        # (offset from request start, duration, statement), kept only when asked for
+        self.timeline = [] if record_timeline else None
+        # Threads that ran code for this request, tracked along with the timeline for the profiler
+        self.threads = set() if record_timeline else None
+        self.started = time.perf_counter()
+
+    def record(self, statement: str, started: float, duration: float):
+        self.query_count += 1
+        self.db_time += duration
+        if self.timeline is not None:
+            self.timeline.append((started - self.started, duration, statement))
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("lms_query_stats", default=None)
+
+def start_request(record_timeline: bool = False) -> QueryStats:
+    """
+    Return the stats of the current request, creating them if this is the first
+    middleware to ask. Outer middlewares read what the inner ones collected.
+    """
+    stats = _current_stats.get()
+    if stats is None:
+        stats = QueryStats(record_timeline)
+        _current_stats.set(stats)
+    elif record_timeline and stats.timeline is None:
+        stats.timeline = []
+        stats.threads = set()
+    return stats
+
+def current_stats() -> Optional[QueryStats]:
+    return _current_stats.get()
+
+def note_thread():
+    """
+    Remember that the calling thread is working for the current request, if it is being profiled.
+    """
+    stats = _current_stats.get()
+    if stats is not None and stats.threads is not None:
+        stats.threads.add(threading.get_ident())
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats.get()
+    if stats is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+        if stats.threads is not None:
+            stats.threads.add(threading.get_ident())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats.get()
+    if stats is None:
+        return
+    started_stack = conn.info.get("query_started")
+    if not started_stack:
+        return
+    started = started_stack.pop()
+    stats.record(statement, started, time.perf_counter() - started)
+
+def install(engine):
+    """
+    Attach the query counters to an engine. Queries outside a request cost one contextvar lookup.
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,74 @@
+"""
+Single-statement inserts that respect unique constraints.
+
+`insert_ignore` and `upsert` compile to the native form of the connected
+database (`INSERT IGNORE` / `ON DUPLICATE KEY UPDATE` on MySQL, `ON CONFLICT`
+on SQLite and PostgreSQL), so a row is written or skipped in one round trip
+and two concurrent requests can't both pass a "does it exist yet?" check.
+All rows go in one multi-row statement; the caller commits.
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy.orm import Session
+
+def _insert(db: Session, model):
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        raise NotImplementedError(f"No upsert support for {dialect}")
+    return dialect, insert(model.__table__)
+
+def insert_ignore(db: Session, model, rows: List[Dict[str, Any]], conflict_columns: Sequence[str]) -> int:
+    """
+    Insert `rows`, skipping any that would violate a unique constraint on
+    `conflict_columns`. Returns the number of rows actually inserted.
+    MySQL's IGNORE also skips rows that fail other checks (foreign keys,
+    NOT NULL), so validate references before calling this.
+    """
+    if not rows:
+        return 0
+    dialect, stmt = _insert(db, model)
+    stmt = stmt.values(rows)
+    if dialect == "mysql":
+        stmt = stmt.prefix_with("IGNORE")
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=list(conflict_columns))
+    return db.execute(stmt).rowcount
+
+def upsert(
+    db: Session,
+    model,
+    rows: List[Dict[str, Any]],
+    conflict_columns: Sequence[str],
+    update_columns: Sequence[str],
+    set_: Optional[Dict[str, Any]] = None,
+    add_columns: Sequence[str] = ()
+) -> int:
+    """
+    Insert `rows`; where a row with the same `conflict_columns` exists, copy
+    `update_columns` from the new row onto it, add the new row's
+    `add_columns` to the existing values, and apply `set_` (e.g.
+    `{"updated_at": func.now()}`). Rows must not repeat a key within one call.
+    Returns the driver's affected row count.
+    """
+    if not rows:
+        return 0
+    table = model.__table__
+    dialect, stmt = _insert(db, model)
+    stmt = stmt.values(rows)
+    if dialect == "mysql":
+        values = {column: stmt.inserted[column] for column in update_columns}
+        values.update({column: table.c[column] + stmt.inserted[column] for column in add_columns})
+        values.update(set_ or {})
+        stmt = stmt.on_duplicate_key_update(**values)
+    else:
+        values = {column: stmt.excluded[column] for column in update_columns}
+        values.update({column: table.c[column] + stmt.excluded[column] for column in add_columns})
+        values.update(set_ or {})
+        stmt = stmt.on_conflict_do_update(index_elements=list(conflict_columns), set_=values)
+    return db.execute(stmt).rowcount
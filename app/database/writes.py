@@ -0,0 +1,96 @@
+"""
+Single-statement writes that hand back the written row.
+
+`insert_row` and `update_row` issue one INSERT or UPDATE and return the row
+as a dict, ready for a response model, instead of loading an ORM object,
+setting attributes, committing and refreshing it. Where the dialect has
+RETURNING (SQLite 3.35+, PostgreSQL, MariaDB for INSERT) the row comes back
+with the statement; elsewhere (MySQL) it is read back by primary key with
+one more SELECT.
+`update_many` applies per-row values to many rows with one executemany.
+Versioned models get `version = version + 1` on every update, the same as
+the ORM's version_id_col does. The caller commits.
+"""
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.orm import Session
+
+def insert_row(db: Session, model, values: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    INSERT one row of `model` and return all of its columns.
+    """
+    table = model.__table__
+    stmt = insert(table).values(**values)
+    if db.get_bind().dialect.insert_returning:
+        return dict(db.execute(stmt.returning(*table.c)).one()._mapping)
+    primary_key = db.execute(stmt).inserted_primary_key
+    where = [column == value for column, value in zip(table.primary_key.columns, primary_key)]
+    return dict(db.execute(select(table).where(*where)).one()._mapping)
+
+def update_row(
+    db: Session,
+    model,
+    key: Any,
+    values: Dict[str, Any],
+    where: Iterable = (),
+    versions: Optional[Iterable[int]] = None,
+    expect: Iterable = ()
+) -> Optional[Dict[str, Any]]:
+    """
+    UPDATE the row of `model` whose primary key is `key` and return all of
+    its columns, or None when no row matched. `where` holds further
+    conditions (e.g. ownership); with `versions` (from If-Match) the row must
+    also be at one of those versions. `expect` holds conditions the row must
+    meet before the write, typically on columns the UPDATE changes.
+    """
+    table = model.__table__
+    (primary_key,) = table.primary_key.columns
+    by_key = primary_key == key
+    conditions = [by_key, *where, *expect]
+    stmt = update(table).values(**values)
+    if "version" in table.c:
+        stmt = stmt.values(version=table.c.version + 1)
+        if versions is not None:
+            conditions.append(table.c.version.in_(list(versions)))
+    if db.get_bind().dialect.update_returning:
+        row = db.execute(stmt.where(*conditions).returning(*table.c)).first()
+        return dict(row._mapping) if row is not None else None
+    # The UPDATE may change the columns the other conditions filter on, so read the row back by its key alone
+    if db.execute(stmt.where(*conditions)).rowcount == 0:
+        return None
+    return dict(db.execute(select(table).where(by_key)).one()._mapping)
+
+def update_many(
+    db: Session,
+    model,
+    rows: List[Dict[str, Any]],
+    columns: Iterable[str],
+    set_: Optional[Dict[str, Any]] = None
+) -> Optional[int]:
+    """
+    UPDATE many rows of `model` by id with one executemany and return how
+    many matched (None where the driver can't tell). Each dict in `rows`
+    holds `id` and a value for each of `columns`; None leaves that column
+    as it is. `set_` values apply to every row and can use any other value
+    of the row as `bindparam("new_<key>")`. For versioned models each dict
+    also holds the `version` the row must still be at.
+    """
+    table = model.__table__
+    # Bound names must differ from the column names of the SET clause
+    values = {
+        name: func.coalesce(bindparam(f"new_{name}", type_=table.c[name].type), table.c[name])
+        for name in columns
+    }
+    values.update(set_ or {})
+    stmt = update(table).where(table.c.id == bindparam("match_id")).values(**values)
+    params = [
+        {"match_id": row["id"], **{f"new_{key}": value for key, value in row.items() if key not in ("id", "version")}}
+        for row in rows
+    ]
+    if "version" in table.c:
+        stmt = stmt.where(table.c.version == bindparam("match_version")).values(version=table.c.version + 1)
+        for param, row in zip(params, rows):
+            param["match_version"] = row["version"]
+    result = db.execute(stmt, params)
+    return result.rowcount if db.get_bind().dialect.supports_sane_multi_rowcount else None
@@ -1,8 +1,9 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index, JSON, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
 from ..database.database import Base
+from . import files  # noqa: F401  (defines the blobs table referenced below)
 
 class Exam(Base):
     __tablename__ = "exams"
@@ -12,30 +13,46 @@ class Exam(Base):
     title = Column(String, nullable=False)
     description = Column(String)
     exam_url = Column(String)
+    file_sha256 = Column(String(64), ForeignKey("blobs.sha256"), nullable=True)  # uploaded exam file, if any
     due_date = Column(DateTime, nullable=False)
     status = Column(String, default="active")
-    created_by = Column(Integer, ForeignKey("users.id"))
+    submission_count = Column(Integer, nullable=False, default=0, server_default="0")
+    graded_count = Column(Integer, nullable=False, default=0, server_default="0")
+    created_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
     # Relationships
     creator = relationship("User", foreign_keys=[created_by])
-    submissions = relationship("ExamSubmission", back_populates="exam")
+    submissions = relationship("ExamSubmission", back_populates="exam", passive_deletes="all")
 
 class ExamSubmission(Base):
     __tablename__ = "exam_submissions"
+    # A student submits an exam once
+    __table_args__ = (
+        UniqueConstraint("exam_id", "student_id", name="uq_exam_submissions_exam_student"),
+        Index("ix_exam_submissions_status_exam", "status", "exam_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    exam_id = Column(Integer, ForeignKey("exams.id"), nullable=False)
-    student_id = Column(Integer, ForeignKey("student_profiles.id"), nullable=False)
+    exam_id = Column(Integer, ForeignKey("exams.id", ondelete="CASCADE"), nullable=False)
+    student_id = Column(Integer, ForeignKey("student_profiles.id", ondelete="CASCADE"), nullable=False)
     submission_url = Column(String, nullable=False)  # Google Drive URL for the submission
+    submission_sha256 = Column(String(64), ForeignKey("blobs.sha256"), nullable=True)  # uploaded file, if any
     status = Column(String, default="submitted")
     grade = Column(String, nullable=True)
+    score = Column(Float, nullable=True)
     feedback = Column(String, nullable=True)
     submitted_at = Column(DateTime, default=datetime.utcnow)
     graded_at = Column(DateTime, nullable=True)
+    claimed_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    claim_expires_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
     # Relationships
     exam = relationship("Exam", back_populates="submissions")
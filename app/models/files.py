@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime
+from datetime import datetime
+
+from ..database.database import Base
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True)  # hex digest, also the storage key
+    size = Column(BigInteger, nullable=False)
+    content_type = Column(String(100), nullable=True)
+    ref_count = Column(Integer, nullable=False, default=0)  # rows pointing at this blob
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # last acquire/release, for the GC grace period
@@ -1,8 +1,9 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
 from ..database.database import Base
+from . import files  # noqa: F401  (defines the blobs table referenced below)
 
 class PaymentAnnouncement(Base):
     __tablename__ = "payment_announcements"
@@ -13,21 +14,28 @@ class PaymentAnnouncement(Base):
     amount = Column(String(50), nullable=False)  # Amount to be paid
     payment_details = Column(Text, nullable=False)  # Bank details or payment instructions
     due_date = Column(DateTime, nullable=False)
-    created_by = Column(Integer, ForeignKey("users.id"))
+    submission_count = Column(Integer, nullable=False, default=0, server_default="0")
+    verified_count = Column(Integer, nullable=False, default=0, server_default="0")
+    created_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
     # Relationships
     creator = relationship("User", foreign_keys=[created_by])
-    submissions = relationship("PaymentSubmission", back_populates="announcement")
+    submissions = relationship("PaymentSubmission", back_populates="announcement", passive_deletes="all")
 
 class PaymentSubmission(Base):
     __tablename__ = "payment_submissions"
+    # One payment submission per student and announcement
+    __table_args__ = (UniqueConstraint("announcement_id", "student_id", name="uq_payment_submissions_announcement_student"),)
 
     id = Column(Integer, primary_key=True, index=True)
-    announcement_id = Column(Integer, ForeignKey("payment_announcements.id"), nullable=False)
-    student_id = Column(Integer, ForeignKey("student_profiles.id"), nullable=False)
+    announcement_id = Column(Integer, ForeignKey("payment_announcements.id", ondelete="CASCADE"), nullable=False)
+    student_id = Column(Integer, ForeignKey("student_profiles.id", ondelete="CASCADE"), nullable=False)
     payment_slip_url = Column(String(500), nullable=False)  # Google Drive URL for the payment slip
+    payment_slip_sha256 = Column(String(64), ForeignKey("blobs.sha256"), nullable=True)  # uploaded slip, if any
     amount_paid = Column(String(50), nullable=False)
     payment_date = Column(DateTime, nullable=False)
     status = Column(String(50), default="pending")  # pending, verified, rejected
@@ -37,6 +45,8 @@ class PaymentSubmission(Base):
     verified_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
     # Relationships
     announcement = relationship("PaymentAnnouncement", back_populates="submissions")
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, String, DateTime, LargeBinary, Text, UniqueConstraint
+from datetime import datetime
+
+from ..database.database import Base
+
+class IdempotencyRecord(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (UniqueConstraint("username", "key", name="uq_idempotency_keys_username_key"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String(100), nullable=False)
+    key = Column(String(255), nullable=False)  # the client's Idempotency-Key header
+    method = Column(String(10), nullable=False)
+    path = Column(String(500), nullable=False)
+    request_hash = Column(String(64), nullable=True)  # SHA-256 of method, path, query and body; set with the response
+    status_code = Column(Integer, nullable=True)  # None while the first request is still running
+    response_headers = Column(Text, nullable=True)  # JSON list of [name, value]
+    response_body = Column(LargeBinary(length=16 * 1024 * 1024), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -1,7 +1,8 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Table, DateTime, Text
+from sqlalchemy import Boolean, Column, Float, Integer, String, ForeignKey, Index, Table, DateTime, Text, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from ..database.database import Base
+from . import files  # noqa: F401  (defines the blobs table referenced below)
 
 # Define user roles
 class UserRole:
@@ -28,16 +29,19 @@ class User(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    deleted_at = Column(DateTime, nullable=True, index=True)  # set while the purger removes a large account, see utils/purge.py
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # checked and bumped by every update, see utils/versioning.py
+    __mapper_args__ = {"version_id_col": version}
 
-    # Relationship with profile based on role
-    lecturer_profile = relationship("LecturerProfile", back_populates="user", uselist=False)
-    student_profile = relationship("StudentProfile", back_populates="user", uselist=False)
+    # Relationship with profile based on role; the database deletes profiles with their user
+    lecturer_profile = relationship("LecturerProfile", back_populates="user", uselist=False, passive_deletes="all")
+    student_profile = relationship("StudentProfile", back_populates="user", uselist=False, passive_deletes="all")
 
 class LecturerProfile(Base):
     __tablename__ = "lecturer_profiles"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     department = Column(String(100))
     bio = Column(String(500))
     qualification = Column(String(255))
@@ -46,13 +50,13 @@ class LecturerProfile(Base):
 
     # Relationships
     user = relationship("User", back_populates="lecturer_profile")
-    courses = relationship("Course", back_populates="lecturer")
+    courses = relationship("Course", back_populates="lecturer", passive_deletes="all")
 
 class StudentProfile(Base):
     __tablename__ = "student_profiles"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     enrollment_number = Column(String(50), unique=True, index=True)
     semester = Column(Integer)
     program = Column(String(100))
@@ -62,9 +66,9 @@ class StudentProfile(Base):
     # Relationships
     user = relationship("User", back_populates="student_profile")
     # Add relationship to assignment submissions
-    submissions = relationship("AssignmentSubmission", back_populates="student")
-    exam_submissions = relationship("ExamSubmission", back_populates="student")
-    payment_submissions = relationship("PaymentSubmission", back_populates="student")
+    submissions = relationship("AssignmentSubmission", back_populates="student", passive_deletes="all")
+    exam_submissions = relationship("ExamSubmission", back_populates="student", passive_deletes="all")
+    payment_submissions = relationship("PaymentSubmission", back_populates="student", passive_deletes="all")
 
 # Course model to be used with lecturer
 class Course(Base):
@@ -73,62 +77,99 @@ class Course(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(200), index=True)
     description = Column(String(500))
-    lecturer_id = Column(Integer, ForeignKey("lecturer_profiles.id"))
+    lecturer_id = Column(Integer, ForeignKey("lecturer_profiles.id", ondelete="CASCADE"))
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    deleted_at = Column(DateTime, nullable=True, index=True)  # hidden and waiting for the purger
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
     
     # Relationships
     lecturer = relationship("LecturerProfile", back_populates="courses")
-    weeks = relationship("CourseWeek", back_populates="course", cascade="all, delete-orphan")
+    weeks = relationship("CourseWeek", back_populates="course", cascade="all, delete-orphan", passive_deletes=True)
 
 # CourseWeek model to organize materials by week
 class CourseWeek(Base):
     __tablename__ = "course_weeks"
     
     id = Column(Integer, primary_key=True, index=True)
-    course_id = Column(Integer, ForeignKey("courses.id"))
+    course_id = Column(Integer, ForeignKey("courses.id", ondelete="CASCADE"))
     title = Column(String(200))
     description = Column(String(500))
     week_number = Column(Integer)
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
     
     # Relationships
     course = relationship("Course", back_populates="weeks")
-    materials = relationship("CourseMaterial", back_populates="week", cascade="all, delete-orphan")
+    materials = relationship("CourseMaterial", back_populates="week", cascade="all, delete-orphan", passive_deletes=True)
 
 # CourseMaterial model for individual materials (links, docs, etc.)
 class CourseMaterial(Base):
     __tablename__ = "course_materials"
     
     id = Column(Integer, primary_key=True, index=True)
-    week_id = Column(Integer, ForeignKey("course_weeks.id"))
+    week_id = Column(Integer, ForeignKey("course_weeks.id", ondelete="CASCADE"))
     title = Column(String(200))
     description = Column(String(500))
     material_type = Column(String(50))  # e.g., "drive_url", "file", "link", "assignment"
     content = Column(Text)  # Text type doesn't need length specification
+    # Kept up to date by the submit and grade paths, see utils/counters.py
+    submission_count = Column(Integer, nullable=False, default=0, server_default="0")
+    graded_count = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
     
     # Relationships
     week = relationship("CourseWeek", back_populates="materials")
     # Add relationship to submissions if this is an assignment
-    submissions = relationship("AssignmentSubmission", back_populates="assignment", cascade="all, delete-orphan")
+    submissions = relationship("AssignmentSubmission", back_populates="assignment", cascade="all, delete-orphan", passive_deletes=True)
 
 # New AssignmentSubmission model for student submissions
 class AssignmentSubmission(Base):
     __tablename__ = "assignment_submissions"
+    # Resubmitting replaces the row (see submit_assignment)
+    __table_args__ = (
+        UniqueConstraint("assignment_id", "student_id", name="uq_assignment_submissions_assignment_student"),
+        # Graders claim the next ungraded submissions of an assignment through this index
+        Index("ix_assignment_submissions_status_assignment", "status", "assignment_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    assignment_id = Column(Integer, ForeignKey("course_materials.id"))
-    student_id = Column(Integer, ForeignKey("student_profiles.id"))
+    assignment_id = Column(Integer, ForeignKey("course_materials.id", ondelete="CASCADE"))
+    student_id = Column(Integer, ForeignKey("student_profiles.id", ondelete="CASCADE"))
     submission_url = Column(Text)  # Google Drive URL for the submitted document
+    submission_sha256 = Column(String(64), ForeignKey("blobs.sha256"), nullable=True)  # uploaded file, if any
     submitted_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
     status = Column(String(50), default="submitted")  # e.g., "submitted", "graded"
     grade = Column(String(50), nullable=True)  # Optional grade
+    score = Column(Float, nullable=True)  # the grade as a number, see utils/grading.parse_score
     feedback = Column(Text, nullable=True)  # Optional feedback
+    claimed_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)  # grader holding the claim
+    claim_expires_at = Column(DateTime, nullable=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
     
     # Relationships
     assignment = relationship("CourseMaterial", back_populates="submissions")
-    student = relationship("StudentProfile", back_populates="submissions") 
\ No newline at end of file
+    student = relationship("StudentProfile", back_populates="submissions") 
+
+# One row per student and course, maintained by the grading paths (see utils/transcript.py)
+class StudentGradeSummary(Base):
+    __tablename__ = "student_grade_summary"
+    # A student's transcript is read through this index
+    __table_args__ = (UniqueConstraint("student_id", "course_id", name="uq_student_grade_summary_student_course"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("student_profiles.id", ondelete="CASCADE"), nullable=False)
+    course_id = Column(Integer, ForeignKey("courses.id", ondelete="CASCADE"), nullable=False)
+    assignments_graded = Column(Integer, nullable=False, default=0, server_default="0")
+    exams_graded = Column(Integer, nullable=False, default=0, server_default="0")
+    scored_count = Column(Integer, nullable=False, default=0, server_default="0")  # graded submissions with a numeric score
+    score_total = Column(Float, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Header, Response, status
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from typing import List, Optional
 
@@ -6,6 +7,10 @@ from ..database.database import get_db
 from ..models.users import User, UserRole, LecturerProfile, StudentProfile
 from ..schemas.users import User as UserSchema, UserCreate, UserUpdate
 from ..utils.auth import get_current_admin, get_password_hash
+from ..utils.profiling import list_profiles, load_profile
+from ..utils.purge import purge_deleted, remove_user
+from ..utils.versioning import if_match_versions, raise_conflict, set_etag
+from .users import insert_user, update_user_row
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -19,7 +24,7 @@ async def get_all_users(
     Get all users (requires admin privileges)
     Optional query parameter 'role' to filter by role (lecturer, student, admin)
     """
-    query = db.query(User)
+    query = db.query(User).filter(User.deleted_at.is_(None))
     
     if role:
         if role not in [UserRole.LECTURER, UserRole.STUDENT, UserRole.ADMIN]:
@@ -56,86 +61,53 @@ async def create_user(
             detail="Username already taken"
         )
     
-    # Create new user
+    # Create the user and their profile in one transaction
     hashed_password = get_password_hash(user_data.password)
-    db_user = User(
-        email=user_data.email,
-        username=user_data.username,
-        hashed_password=hashed_password,
-        role=user_data.role,
-        first_name=user_data.first_name,
-        last_name=user_data.last_name,
-        is_active=True
-    )
-    
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    
-    # Create profile based on role
-    if user_data.role == UserRole.LECTURER and user_data.lecturer_profile:
-        lecturer_profile = LecturerProfile(
-            user_id=db_user.id,
-            department=user_data.lecturer_profile.department,
-            bio=user_data.lecturer_profile.bio,
-            qualification=user_data.lecturer_profile.qualification
-        )
-        db.add(lecturer_profile)
+    try:
+        db_user = insert_user(db, user_data, hashed_password)
         db.commit()
-    
-    elif user_data.role == UserRole.STUDENT and user_data.student_profile:
-        student_profile = StudentProfile(
-            user_id=db_user.id,
-            enrollment_number=user_data.student_profile.enrollment_number,
-            semester=user_data.student_profile.semester,
-            program=user_data.student_profile.program
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email, username or enrollment number already registered"
         )
-        db.add(student_profile)
-        db.commit()
-    
-    db.refresh(db_user)
     return db_user
 
 @router.get("/users/{user_id}", response_model=UserSchema)
 async def get_user(
     user_id: int,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_admin)
 ):
     """
     Get a specific user by ID (requires admin privileges)
     """
-    user = db.query(User).filter(User.id == user_id).first()
+    user = db.query(User).filter(User.id == user_id, User.deleted_at.is_(None)).first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
+    set_etag(response, user)
     return user
 
 @router.put("/users/{user_id}", response_model=UserSchema)
 async def update_user(
     user_id: int,
     user_data: UserUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_admin)
 ):
     """
     Update a user (requires admin privileges)
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    
-    # Update user fields
-    user_data_dict = user_data.dict(exclude_unset=True)
-    
     # Handle email uniqueness check
-    if user_data.email and user_data.email != user.email:
-        existing_email = db.query(User).filter(User.email == user_data.email).first()
+    if user_data.email:
+        existing_email = db.query(User.id).filter(User.email == user_data.email, User.id != user_id).first()
         if existing_email:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -143,40 +115,33 @@ async def update_user(
             )
     
     # Handle username uniqueness check
-    if user_data.username and user_data.username != user.username:
-        existing_username = db.query(User).filter(User.username == user_data.username).first()
+    if user_data.username:
+        existing_username = db.query(User.id).filter(User.username == user_data.username, User.id != user_id).first()
         if existing_username:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Username already taken"
             )
     
-    for key, value in user_data_dict.items():
-        # Skip nested objects (profiles)
-        if key not in ["lecturer_profile", "student_profile"]:
-            setattr(user, key, value)
-    
-    # Update lecturer profile if present
-    if user.role == UserRole.LECTURER and user_data.lecturer_profile:
-        lecturer_profile = db.query(LecturerProfile).filter(LecturerProfile.user_id == user.id).first()
-        if lecturer_profile:
-            for key, value in user_data.lecturer_profile.dict(exclude_unset=True).items():
-                setattr(lecturer_profile, key, value)
-    
-    # Update student profile if present
-    if user.role == UserRole.STUDENT and user_data.student_profile:
-        student_profile = db.query(StudentProfile).filter(StudentProfile.user_id == user.id).first()
-        if student_profile:
-            for key, value in user_data.student_profile.dict(exclude_unset=True).items():
-                setattr(student_profile, key, value)
+    user = update_user_row(db, user_id, user_data, if_match_versions(if_match))
+    if user is None:
+        # Nothing was updated; find out why
+        existing = db.query(User).filter(User.id == user_id, User.deleted_at.is_(None)).first()
+        if not existing:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found"
+            )
+        raise_conflict(existing)
     
     db.commit()
-    db.refresh(user)
+    set_etag(response, user)
     return user
 
 @router.delete("/users/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_user(
     user_id: int,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_admin)
 ):
@@ -190,25 +155,40 @@ async def delete_user(
             detail="Cannot delete your own account"
         )
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user = db.query(User).filter(User.id == user_id, User.deleted_at.is_(None)).first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     
-    # Delete lecturer profile if exists
-    if user.role == UserRole.LECTURER:
-        lecturer_profile = db.query(LecturerProfile).filter(LecturerProfile.user_id == user.id).first()
-        if lecturer_profile:
-            db.delete(lecturer_profile)
-    
-    # Delete student profile if exists
-    if user.role == UserRole.STUDENT:
-        student_profile = db.query(StudentProfile).filter(StudentProfile.user_id == user.id).first()
-        if student_profile:
-            db.delete(student_profile)
-    
-    db.delete(user)
-    db.commit()
-    return None 
\ No newline at end of file
+    # Profiles, a lecturer's courses and a student's submissions go with the user (ON DELETE CASCADE)
+    if remove_user(db, user.id):
+        background_tasks.add_task(purge_deleted)
+    return None 
+
+@router.get("/profiles", response_model=List[dict])
+async def get_profiles(
+    limit: int = 50,
+    current_user: User = Depends(get_current_admin)
+):
+    """
+    List the most recent request profiles (requires admin privileges)
+    """
+    return list_profiles(limit)
+
+@router.get("/profiles/{profile_id}", response_model=dict)
+async def get_profile(
+    profile_id: str,
+    current_user: User = Depends(get_current_admin)
+):
+    """
+    Get a request profile with its folded stacks and SQL timeline (requires admin privileges)
+    """
+    profile = load_profile(profile_id)
+    if profile is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+    return profile
@@ -1,77 +1,162 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from collections import Counter
+
+from fastapi import APIRouter, Depends, HTTPException, Header, Response, status
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+
+from starlette.concurrency import run_in_threadpool
 
 from ..database.database import get_db
+from ..database.upsert import upsert
+from ..database.writes import update_row
 from ..models.users import User, CourseMaterial, AssignmentSubmission, StudentProfile, CourseWeek, Course, MaterialType, LecturerProfile
 from ..schemas.users import AssignmentSubmission as AssignmentSubmissionSchema
-from ..schemas.users import AssignmentSubmissionCreate, AssignmentSubmissionUpdate
-from ..utils.auth import get_current_active_user, get_current_lecturer, get_current_student
+from ..schemas.users import AssignmentSubmissionClaim, AssignmentSubmissionCreate, AssignmentSubmissionUpdate, GradeBatch
+from ..utils.auth import get_current_active_user, get_current_lecturer, get_current_student, get_lecturer_profile_id, get_student_profile_id
+from ..utils.blobstore import release_blob
+from ..utils.cache import TTLCache
+from ..utils.counters import add_counts, status_change
+from ..utils.dashboard import student_changed
+from ..utils.gradebook import grade_stats
+from ..utils.grading import apply_grades, claim_submissions, parse_score, release_claims
+from ..utils.intake import GroupCommitQueue
+from ..utils.transcript import record_grade_changes
+from ..utils.versioning import if_match_versions, raise_conflict, set_etag
 
 router = APIRouter(prefix="/assignments", tags=["assignments"])
 
+# material id -> material type, so submissions are validated without a query
+material_types = TTLCache("material_type", ttl=60)
+
+def _load_material_type(db: Session, material_id: int):
+    row = db.query(CourseMaterial.material_type).filter(CourseMaterial.id == material_id).first()
+    return row[0] if row else None
+
+def _own_assignments(lecturer_profile_id: int):
+    """
+    Ids of the assignments in the lecturer's own courses.
+    """
+    return select(CourseMaterial.id).join(
+        CourseWeek, CourseWeek.id == CourseMaterial.week_id
+    ).join(
+        Course, Course.id == CourseWeek.course_id
+    ).where(Course.lecturer_id == lecturer_profile_id)
+
+def _check_grader(db: Session, material_id: int, lecturer_profile_id: int):
+    """
+    404 unless the assignment exists, 403 unless it is in the lecturer's own course.
+    """
+    if db.query(_own_assignments(lecturer_profile_id).where(CourseMaterial.id == material_id).exists()).scalar():
+        return
+    if not db.query(CourseMaterial.id).filter(CourseMaterial.id == material_id).first():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Assignment not found"
+        )
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Not authorized to grade submissions for this assignment"
+    )
+
+def _write_assignment_submissions(db: Session, items: List[dict]) -> list:
+    """
+    Apply a batch of assignment submissions with one upsert: resubmissions
+    replace the URL (and drop any uploaded file) of the existing row. When a
+    student submits twice within a batch, the later submission wins.
+    """
+    latest = {}
+    for item in items:
+        latest[(item["assignment_id"], item["student_id"])] = item
+    
+    # New submissions add to the assignment's count; resubmitting a graded one makes it ungraded again
+    previous = {
+        (row.assignment_id, row.student_id): row
+        for row in db.query(
+            AssignmentSubmission.assignment_id, AssignmentSubmission.student_id, AssignmentSubmission.status,
+            AssignmentSubmission.score, AssignmentSubmission.submission_sha256
+        ).filter(
+            AssignmentSubmission.assignment_id.in_({key[0] for key in latest}),
+            AssignmentSubmission.student_id.in_({key[1] for key in latest})
+        )
+    }
+    submitted, ungraded = Counter(), Counter()
+    regraded = []
+    for key in latest:
+        if key not in previous:
+            submitted[key[0]] += 1
+        elif previous[key].status == "graded":
+            ungraded[key[0]] -= 1
+            regraded.append((key[1], key[0], ("graded", previous[key].score), ("submitted", previous[key].score)))
+    # A URL replaces the uploaded file, if there was one
+    for key in latest:
+        if key in previous:
+            release_blob(db, previous[key].submission_sha256)
+    
+    upsert(
+        db,
+        AssignmentSubmission,
+        [{**item, "status": "submitted", "submission_sha256": None} for item in latest.values()],
+        conflict_columns=("assignment_id", "student_id"),
+        update_columns=("submission_url", "status", "submission_sha256"),
+        set_={"updated_at": func.now(), "version": AssignmentSubmission.__table__.c.version + 1}
+    )
+    add_counts(db, CourseMaterial, "submission_count", submitted)
+    add_counts(db, CourseMaterial, "graded_count", ungraded)
+    record_grade_changes(db, AssignmentSubmission, regraded)
+    db.commit()
+    student_changed(*{key[1] for key in latest})
+    
+    stored = {
+        (row.assignment_id, row.student_id): AssignmentSubmissionSchema.model_validate(row)
+        for row in db.query(AssignmentSubmission).filter(
+            AssignmentSubmission.assignment_id.in_({key[0] for key in latest}),
+            AssignmentSubmission.student_id.in_({key[1] for key in latest})
+        )
+    }
+    return [stored[(item["assignment_id"], item["student_id"])] for item in items]
+
+assignment_submission_intake = GroupCommitQueue("assignment_submissions", _write_assignment_submissions)
+
 # Submit assignment (student)
 @router.post("/submit", response_model=AssignmentSubmissionSchema, status_code=status.HTTP_201_CREATED)
-def submit_assignment(
+async def submit_assignment(
     submission: AssignmentSubmissionCreate,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_student)  # Only students can submit assignments
 ):
     """
-    Submit an assignment (requires student privileges)
+    Submit an assignment (requires student privileges). Submissions are
+    written in batches; the response is sent once the submission is committed.
     """
-    # Get student profile
-    student_profile = db.query(StudentProfile).filter(
-        StudentProfile.user_id == current_user.id
-    ).first()
-    
-    if not student_profile:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Student profile not found"
-        )
+    student_profile_id = await run_in_threadpool(get_student_profile_id, db, current_user.id)
     
     # Check if assignment exists
-    assignment = db.query(CourseMaterial).filter(CourseMaterial.id == submission.assignment_id).first()
-    if not assignment:
+    material_type = material_types.get(submission.assignment_id)
+    if material_type is None:
+        material_type = await run_in_threadpool(_load_material_type, db, submission.assignment_id)
+        if material_type is not None:
+            material_types.set(submission.assignment_id, material_type)
+    # Hand the connection back while the request waits for its batch
+    db.close()
+    if material_type is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Assignment not found"
         )
     
     # Check if assignment is of type "assignment"
-    if assignment.material_type != MaterialType.ASSIGNMENT:
+    if material_type != MaterialType.ASSIGNMENT:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="This material is not an assignment"
         )
     
-    # Check if student already submitted this assignment
-    existing_submission = db.query(AssignmentSubmission).filter(
-        AssignmentSubmission.assignment_id == submission.assignment_id,
-        AssignmentSubmission.student_id == student_profile.id
-    ).first()
-    
-    if existing_submission:
-        # Update existing submission
-        existing_submission.submission_url = submission.submission_url
-        existing_submission.status = "submitted"  # Reset status to submitted
-        db.commit()
-        db.refresh(existing_submission)
-        return existing_submission
-    
-    # Create new submission
-    db_submission = AssignmentSubmission(
-        assignment_id=submission.assignment_id,
-        student_id=student_profile.id,
-        submission_url=submission.submission_url,
-        status="submitted"
-    )
-    
-    db.add(db_submission)
-    db.commit()
-    db.refresh(db_submission)
-    return db_submission
+    return await assignment_submission_intake.submit({
+        "assignment_id": submission.assignment_id,
+        "student_id": student_profile_id,
+        "submission_url": submission.submission_url,
+    })
 
 # Get all submissions for an assignment (lecturer)
 @router.get("/material/{material_id}/submissions", response_model=List[AssignmentSubmissionSchema])
@@ -111,7 +196,7 @@ def get_assignment_submissions(
             detail="Course week not found"
         )
     
-    course = db.query(Course).filter(Course.id == week.course_id).first()
+    course = db.query(Course).filter(Course.id == week.course_id, Course.deleted_at.is_(None)).first()
     if not course or course.lecturer_id != lecturer_profile.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -187,52 +272,124 @@ def get_student_submission(
 def update_submission(
     submission_id: int,
     submission_data: AssignmentSubmissionUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_lecturer)  # Only lecturers can update submissions
 ):
     """
     Update an assignment submission (grade, feedback) - requires lecturer privileges
     """
-    # Get lecturer profile
-    lecturer_profile = db.query(LecturerProfile).filter(
-        LecturerProfile.user_id == current_user.id
-    ).first()
-    
-    # Find the submission
-    submission = db.query(AssignmentSubmission).filter(
-        AssignmentSubmission.id == submission_id
-    ).first()
-    
-    if not submission:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Submission not found"
-        )
-    
-    # Get the assignment
-    assignment = db.query(CourseMaterial).filter(
-        CourseMaterial.id == submission.assignment_id
-    ).first()
-    
-    # Check if lecturer owns this course
-    week = db.query(CourseWeek).filter(CourseWeek.id == assignment.week_id).first()
-    course = db.query(Course).filter(Course.id == week.course_id).first()
-    
-    if not course or course.lecturer_id != lecturer_profile.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to update submissions for this assignment"
-        )
+    lecturer_profile_id = get_lecturer_profile_id(db, current_user.id)
+    own_assignments = _own_assignments(lecturer_profile_id)
     
     # Update submission
     submission_data_dict = submission_data.dict(exclude_unset=True)
-    for key, value in submission_data_dict.items():
-        setattr(submission, key, value)
-    
     # If grade or feedback is provided, set status to "graded"
     if submission_data.grade or submission_data.feedback:
-        submission.status = "graded"
+        submission_data_dict["status"] = "graded"
+    if "grade" in submission_data_dict:
+        submission_data_dict["score"] = parse_score(submission_data_dict["grade"])
     
+    expect = []
+    grading = "status" in submission_data_dict or "score" in submission_data_dict
+    if grading:
+        # The graded count and the grade summary move with the status and score, so the row must still be the one read here
+        previous = db.query(
+            AssignmentSubmission.status, AssignmentSubmission.score, AssignmentSubmission.version
+        ).filter(AssignmentSubmission.id == submission_id).first()
+        if previous is not None:
+            expect.append(AssignmentSubmission.version == previous.version)
+    submission = update_row(
+        db,
+        AssignmentSubmission,
+        submission_id,
+        submission_data_dict,
+        where=[AssignmentSubmission.assignment_id.in_(own_assignments)],
+        versions=if_match_versions(if_match),
+        expect=expect
+    )
+    if submission is None:
+        # Nothing was updated; find out why
+        existing = db.query(AssignmentSubmission).filter(
+            AssignmentSubmission.id == submission_id
+        ).first()
+        if not existing:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Submission not found"
+            )
+        if not db.query(own_assignments.where(CourseMaterial.id == existing.assignment_id).exists()).scalar():
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Not authorized to update submissions for this assignment"
+            )
+        raise_conflict(existing)
+    
+    if grading:
+        add_counts(db, CourseMaterial, "graded_count", {
+            submission["assignment_id"]: status_change(previous.status, submission["status"], "graded")
+        })
+        record_grade_changes(db, AssignmentSubmission, [(
+            submission["student_id"], submission["assignment_id"],
+            (previous.status, previous.score), (submission["status"], submission["score"])
+        )])
     db.commit()
-    db.refresh(submission)
-    return submission 
\ No newline at end of file
+    if "grade" in submission_data_dict:
+        grade_stats.clear()
+    student_changed(submission["student_id"])
+    set_etag(response, submission)
+    return submission
+
+# Grade many submissions at once (lecturer)
+@router.patch("/submissions", response_model=List[AssignmentSubmissionSchema])
+def grade_submissions(
+    batch: GradeBatch,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_lecturer)  # Only lecturers can grade submissions
+):
+    """
+    Grade a batch of assignment submissions in one transaction - requires lecturer privileges
+    """
+    lecturer_profile_id = get_lecturer_profile_id(db, current_user.id)
+    return apply_grades(
+        db,
+        AssignmentSubmission,
+        AssignmentSubmission.assignment_id,
+        CourseMaterial,
+        batch.grades,
+        AssignmentSubmission.assignment_id.in_(_own_assignments(lecturer_profile_id)),
+        set_={"status": "graded", "updated_at": func.now()}
+    )
+
+# Claim the next ungraded submissions of an assignment (lecturer)
+@router.post("/material/{material_id}/claims", response_model=AssignmentSubmissionClaim)
+def claim_assignment_submissions(
+    material_id: int,
+    limit: int = 10,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_lecturer)
+):
+    """
+    Claim up to `limit` ungraded submissions of an assignment so that other
+    graders get different ones - requires lecturer privileges
+    """
+    _check_grader(db, material_id, get_lecturer_profile_id(db, current_user.id))
+    submissions, claim_expires_at = claim_submissions(
+        db, AssignmentSubmission, AssignmentSubmission.assignment_id, material_id, current_user.id, limit
+    )
+    return {"claim_expires_at": claim_expires_at, "submissions": submissions}
+
+# Give back unfinished claims on an assignment (lecturer)
+@router.delete("/material/{material_id}/claims", status_code=status.HTTP_204_NO_CONTENT)
+def release_assignment_claims(
+    material_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_lecturer)
+):
+    """
+    Release the current user's claims on an assignment's ungraded submissions - requires lecturer privileges
+    """
+    _check_grader(db, material_id, get_lecturer_profile_id(db, current_user.id))
+    release_claims(db, AssignmentSubmission, AssignmentSubmission.assignment_id, material_id, current_user.id)
+    return None
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from datetime import timedelta
 
 from ..database.database import get_db
@@ -14,7 +15,8 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     """
     Endpoint for user login and token generation
     """
-    user = authenticate_user(db, form_data.username, form_data.password)
+    # bcrypt takes ~100ms of CPU, so keep it off the event loop
+    user = await run_in_threadpool(authenticate_user, db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Header, Response, status
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 from ..database.database import get_db
-from ..models.users import User, Course, CourseWeek, CourseMaterial, LecturerProfile
+from ..models.users import User, Course, CourseWeek, CourseMaterial, LecturerProfile, AssignmentSubmission
 from ..schemas.users import CourseMaterial as CourseMaterialSchema, CourseMaterialCreate, CourseMaterialUpdate
 from ..utils.auth import get_current_active_user, get_current_lecturer
+from ..utils.blobstore import release_blobs
+from ..utils.dashboard import coursework_changed
+from ..utils.versioning import check_if_match, commit_versioned, set_etag
+from .assignments import material_types
 
 router = APIRouter(prefix="/course-materials", tags=["course materials"])
 
@@ -33,7 +37,7 @@ def create_course_material(
         )
     
     # Check if course exists and belongs to lecturer
-    course = db.query(Course).filter(Course.id == week.course_id).first()
+    course = db.query(Course).filter(Course.id == week.course_id, Course.deleted_at.is_(None)).first()
     if not course:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -58,6 +62,7 @@ def create_course_material(
     db.add(db_material)
     db.commit()
     db.refresh(db_material)
+    coursework_changed()
     return db_material
 
 # Get materials for a specific week by week_id
@@ -85,6 +90,7 @@ def read_materials_by_week(
 @router.get("/{material_id}", response_model=CourseMaterialSchema)
 def read_material_by_id(
     material_id: int,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
@@ -98,6 +104,7 @@ def read_material_by_id(
             detail="Material not found"
         )
     
+    set_etag(response, material)
     return material
 
 # Update a course material
@@ -105,6 +112,8 @@ def read_material_by_id(
 def update_material(
     material_id: int,
     material_data: CourseMaterialUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_lecturer)  # Only lecturers can update materials
 ):
@@ -133,20 +142,25 @@ def update_material(
         )
     
     # Check if course exists and belongs to lecturer
-    course = db.query(Course).filter(Course.id == week.course_id).first()
+    course = db.query(Course).filter(Course.id == week.course_id, Course.deleted_at.is_(None)).first()
     if not course or course.lecturer_id != lecturer_profile.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to update materials for this course"
         )
     
+    check_if_match(if_match, material)
+    
     # Update material fields
     material_data_dict = material_data.dict(exclude_unset=True)
     for key, value in material_data_dict.items():
         setattr(material, key, value)
     
-    db.commit()
+    commit_versioned(db)
     db.refresh(material)
+    set_etag(response, material)
+    material_types.invalidate(material_id)
+    coursework_changed()
     return material
 
 # Delete a course material
@@ -181,13 +195,17 @@ def delete_material(
         )
     
     # Check if course exists and belongs to lecturer
-    course = db.query(Course).filter(Course.id == week.course_id).first()
+    course = db.query(Course).filter(Course.id == week.course_id, Course.deleted_at.is_(None)).first()
     if not course or course.lecturer_id != lecturer_profile.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to delete materials for this course"
         )
     
+    # Its submissions go with it (ON DELETE CASCADE); let go of their files first
+    release_blobs(db, AssignmentSubmission.submission_sha256, AssignmentSubmission.assignment_id == material_id)
     db.delete(material)
     db.commit()
+    material_types.invalidate(material_id)
+    coursework_changed()
     return None 
\ No newline at end of file
@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Header, Response, status
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 from ..database.database import get_db
-from ..models.users import User, Course, CourseWeek, LecturerProfile
+from ..models.users import User, Course, CourseWeek, CourseMaterial, LecturerProfile, AssignmentSubmission
 from ..schemas.users import CourseWeek as CourseWeekSchema, CourseWeekCreate, CourseWeekUpdate
 from ..utils.auth import get_current_active_user, get_current_lecturer
+from ..utils.blobstore import release_blobs
+from ..utils.dashboard import coursework_changed
+from ..utils.versioning import check_if_match, commit_versioned, set_etag
 
 router = APIRouter(prefix="/course-weeks", tags=["course weeks"])
 
@@ -20,7 +24,7 @@ def create_course_week(
     Create a new course week (requires lecturer privileges)
     """
     # Check if course exists
-    course = db.query(Course).filter(Course.id == week.course_id).first()
+    course = db.query(Course).filter(Course.id == week.course_id, Course.deleted_at.is_(None)).first()
     if not course:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -63,7 +67,7 @@ def read_course_weeks_by_course(
     Get all weeks for a specific course (requires authentication)
     """
     # Check if course exists
-    course = db.query(Course).filter(Course.id == course_id).first()
+    course = db.query(Course).filter(Course.id == course_id, Course.deleted_at.is_(None)).first()
     if not course:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -78,6 +82,7 @@ def read_course_weeks_by_course(
 def read_course_week(
     course_id: int,
     week_id: int,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
@@ -95,6 +100,7 @@ def read_course_week(
             detail="Course week not found"
         )
     
+    set_etag(response, week)
     return week
 
 # Update a course week by ID
@@ -102,6 +108,8 @@ def read_course_week(
 def update_course_week_by_id(
     week_id: int,
     week_data: CourseWeekUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_lecturer)  # Only lecturers can update weeks
 ):
@@ -128,20 +136,24 @@ def update_course_week_by_id(
         )
     
     # Check if course exists and belongs to lecturer
-    course = db.query(Course).filter(Course.id == week.course_id).first()
+    course = db.query(Course).filter(Course.id == week.course_id, Course.deleted_at.is_(None)).first()
     if not course or course.lecturer_id != lecturer_profile.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to update this week"
         )
     
+    check_if_match(if_match, week)
+    
     # Update week fields
     week_data_dict = week_data.dict(exclude_unset=True)
     for key, value in week_data_dict.items():
         setattr(week, key, value)
     
-    db.commit()
+    commit_versioned(db)
     db.refresh(week)
+    set_etag(response, week)
+    coursework_changed()
     return week
 
 # Delete a course week
@@ -174,13 +186,20 @@ def delete_course_week_by_id(
         )
     
     # Check if course exists and belongs to lecturer
-    course = db.query(Course).filter(Course.id == week.course_id).first()
+    course = db.query(Course).filter(Course.id == week.course_id, Course.deleted_at.is_(None)).first()
     if not course or course.lecturer_id != lecturer_profile.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to delete this week"
         )
     
+    # Materials and submissions go with it (ON DELETE CASCADE); let go of the submitted files first
+    release_blobs(
+        db,
+        AssignmentSubmission.submission_sha256,
+        AssignmentSubmission.assignment_id.in_(select(CourseMaterial.id).where(CourseMaterial.week_id == week_id))
+    )
     db.delete(week)
     db.commit()
+    coursework_changed()
     return None 
\ No newline at end of file
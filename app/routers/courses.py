@@ -1,11 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Header, Response, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 from ..database.database import get_db
 from ..models.users import User, Course, LecturerProfile
 from ..schemas.users import Course as CourseSchema, CourseCreate, CourseUpdate
-from ..utils.auth import get_current_active_user, get_current_lecturer
+from ..utils.auth import get_current_active_user, get_current_lecturer, get_lecturer_profile_id
+from ..utils.dashboard import coursework_changed
+from ..utils.gradebook import GRADEBOOK_FORMATS, grade_statistics, grade_stats, load_gradebook, stream_csv, stream_json, to_parquet
+from ..utils.purge import purge_deleted, remove_course
+from ..utils.versioning import check_if_match, commit_versioned, set_etag
 
 router = APIRouter(prefix="/courses", tags=["courses"])
 
@@ -52,7 +57,7 @@ def read_courses(
     """
     Get all courses (requires authentication)
     """
-    courses = db.query(Course).offset(skip).limit(limit).all()
+    courses = db.query(Course).filter(Course.deleted_at.is_(None)).offset(skip).limit(limit).all()
     return courses
 
 # Get courses by lecturer
@@ -75,29 +80,98 @@ def read_my_courses(
             detail="Lecturer profile not found"
         )
     
-    courses = db.query(Course).filter(Course.lecturer_id == lecturer_profile.id).all()
+    courses = db.query(Course).filter(Course.lecturer_id == lecturer_profile.id, Course.deleted_at.is_(None)).all()
     return courses
 
 # Get a specific course
 @router.get("/{course_id}", response_model=CourseSchema)
 def read_course(
     course_id: int, 
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Get a specific course by ID (requires authentication)
     """
-    course = db.query(Course).filter(Course.id == course_id).first()
+    course = db.query(Course).filter(Course.id == course_id, Course.deleted_at.is_(None)).first()
     if course is None:
         raise HTTPException(status_code=404, detail="Course not found")
+    set_etag(response, course)
     return course
 
+def _get_own_course(db: Session, course_id: int, current_user: User) -> Course:
+    course = db.query(Course).filter(Course.id == course_id, Course.deleted_at.is_(None)).first()
+    if course is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+    if course.lecturer_id != get_lecturer_profile_id(db, current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to view the grades of this course"
+        )
+    return course
+
+# Gradebook of a course (lecturer only)
+@router.get("/{course_id}/gradebook")
+def get_gradebook(
+    course_id: int,
+    format: str = "json",
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_lecturer)
+):
+    """
+    Get the student x assignment/exam grade matrix of a course as JSON, CSV
+    or Parquet (requires lecturer privileges and only own courses)
+    """
+    if format not in GRADEBOOK_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid format. Must be one of: {', '.join(GRADEBOOK_FORMATS)}"
+        )
+    
+    course = _get_own_course(db, course_id, current_user)
+    items, frame = load_gradebook(db, course)
+    filename = f"gradebook-course-{course.id}.{format}"
+    if format == "json":
+        return StreamingResponse(stream_json(course, items, frame), media_type="application/json")
+    if format == "csv":
+        return StreamingResponse(
+            stream_csv(frame),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+    try:
+        body = to_parquet(frame)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail=str(e))
+    return Response(
+        body,
+        media_type="application/vnd.apache.parquet",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# Grade statistics of a course (lecturer only)
+@router.get("/{course_id}/grade-stats", response_model=dict)
+def get_grade_stats(
+    course_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_lecturer)
+):
+    """
+    Get score statistics and grading progress for each assignment and exam
+    of a course (requires lecturer privileges and only own courses)
+    """
+    course = _get_own_course(db, course_id, current_user)
+    items = grade_stats.get_or_load(course.id, lambda: grade_statistics(db, course))
+    return {"course_id": course.id, "items": items}
+
 # Update a course (lecturer only)
 @router.put("/{course_id}", response_model=CourseSchema)
 def update_course(
     course_id: int,
     course: CourseUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_lecturer)
 ):
@@ -116,7 +190,7 @@ def update_course(
         )
     
     # Find course
-    db_course = db.query(Course).filter(Course.id == course_id).first()
+    db_course = db.query(Course).filter(Course.id == course_id, Course.deleted_at.is_(None)).first()
     if not db_course:
         raise HTTPException(status_code=404, detail="Course not found")
     
@@ -127,19 +201,24 @@ def update_course(
             detail="Not authorized to update this course"
         )
     
+    check_if_match(if_match, db_course)
+    
     # Update course fields
     course_data = course.dict(exclude_unset=True)
     for key, value in course_data.items():
         setattr(db_course, key, value)
     
-    db.commit()
+    commit_versioned(db)
     db.refresh(db_course)
+    set_etag(response, db_course)
+    coursework_changed()
     return db_course
 
 # Delete a course (lecturer only)
 @router.delete("/{course_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_course(
     course_id: int,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_lecturer)
 ):
@@ -158,7 +237,7 @@ def delete_course(
         )
     
     # Find course
-    db_course = db.query(Course).filter(Course.id == course_id).first()
+    db_course = db.query(Course).filter(Course.id == course_id, Course.deleted_at.is_(None)).first()
     if not db_course:
         raise HTTPException(status_code=404, detail="Course not found")
     
@@ -169,6 +248,8 @@ def delete_course(
             detail="Not authorized to delete this course"
         )
     
-    db.delete(db_course)
-    db.commit()
+    # Weeks, materials and submissions go with it (ON DELETE CASCADE); large courses are purged in batches
+    if remove_course(db, db_course.id):
+        background_tasks.add_task(purge_deleted)
+    coursework_changed()
     return None 
\ No newline at end of file
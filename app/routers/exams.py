@@ -1,16 +1,58 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Header, Response, status, UploadFile, File
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import datetime
+import logging
+from collections import Counter
+
+from starlette.concurrency import run_in_threadpool
 
 from ..database.database import get_db
+from ..database.upsert import insert_ignore
+from ..database.writes import update_row
 from ..models.users import User, Course, LecturerProfile, StudentProfile
 from ..models.exams import Exam, ExamSubmission as ExamSubmissionModel
-from ..schemas.exams import Exam as ExamSchema, ExamCreate, ExamUpdate, ExamSubmission, ExamSubmissionBase
-from ..utils.auth import get_current_active_user, get_current_lecturer, get_current_student
+from ..models.files import Blob
+from ..schemas.exams import Exam as ExamSchema, ExamCreate, ExamUpdate, ExamSubmission, ExamSubmissionBase, ExamSubmissionClaim
+from ..schemas.users import GradeBatch
+from ..utils.auth import get_current_active_user, get_current_lecturer, get_current_student, get_lecturer_profile_id, get_student_profile_id
+from ..utils.blobstore import acquire_blob, blob_url, release_blob, release_blobs, store_upload
+from ..utils.cache import TTLCache
+from ..utils.counters import add_counts
+from ..utils.dashboard import coursework_changed, student_changed
+from ..utils.grading import apply_grades, claim_submissions, release_claims
+from ..utils.intake import GroupCommitQueue
+from ..utils.signing import sign_blob_url
+from ..utils.versioning import if_match_versions, raise_conflict, set_etag
 
 router = APIRouter(prefix="/exams", tags=["exams"])
 
+logger = logging.getLogger("lms.exams")
+
+# exam id -> due date, so late submissions are turned away without a query
+exam_due_dates = TTLCache("exam_due_date", ttl=30)
+
+def _own_course_titles(lecturer_profile_id: int):
+    """
+    Titles of the lecturer's courses; exams belong to a lecturer through the title.
+    """
+    return select(Course.title).where(Course.lecturer_id == lecturer_profile_id, Course.deleted_at.is_(None))
+
+def _check_grader(db: Session, exam_id: int, lecturer_profile_id: Optional[int]):
+    """
+    404 unless the exam exists, 403 unless it belongs to one of the lecturer's courses.
+    """
+    exam = db.query(Exam.course_name).filter(Exam.id == exam_id).first()
+    if not exam:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    if not db.query(_own_course_titles(lecturer_profile_id).where(Course.title == exam.course_name).exists()).scalar():
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to grade submissions for this exam"
+        )
+
 # Create a new exam (lecturer only)
 @router.post("/", response_model=ExamSchema, status_code=status.HTTP_201_CREATED)
 def create_exam(
@@ -45,6 +87,7 @@ def create_exam(
     db.add(db_exam)
     db.commit()
     db.refresh(db_exam)
+    coursework_changed()
     return db_exam
 
 # Get all exams for a course
@@ -58,7 +101,7 @@ def read_course_exams(
     Get all exams for a specific course (requires authentication)
     """
     # Verify course exists
-    course = db.query(Course).filter(Course.id == course_id).first()
+    course = db.query(Course).filter(Course.id == course_id, Course.deleted_at.is_(None)).first()
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
     
@@ -70,6 +113,7 @@ def read_course_exams(
 @router.get("/{exam_id}", response_model=ExamSchema)
 def read_exam(
     exam_id: int,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
@@ -79,78 +123,149 @@ def read_exam(
     exam = db.query(Exam).filter(Exam.id == exam_id).first()
     if exam is None:
         raise HTTPException(status_code=404, detail="Exam not found")
+    set_etag(response, exam)
     return exam
 
+# Get a signed, expiring download URL for the exam file
+@router.get("/{exam_id}/file-url", response_model=dict)
+def get_exam_file_url(
+    exam_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Get a signed download URL for the uploaded exam file (requires authentication).
+    The URL works without a token until it expires.
+    """
+    row = db.query(Exam.file_sha256, Blob.content_type).outerjoin(
+        Blob, Blob.sha256 == Exam.file_sha256
+    ).filter(Exam.id == exam_id).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    
+    file_sha256, content_type = row
+    if not file_sha256:
+        raise HTTPException(status_code=404, detail="Exam has no uploaded file")
+    
+    url, expires = sign_blob_url(file_sha256, content_type)
+    return {"url": url, "expires_at": datetime.utcfromtimestamp(expires)}
+
+def _load_exam_due_date(db: Session, exam_id: int):
+    row = db.query(Exam.due_date).filter(Exam.id == exam_id).first()
+    return row[0] if row else None
+
+async def _exam_due_date(db: Session, exam_id: int):
+    due_date = exam_due_dates.get(exam_id)
+    if due_date is None:
+        due_date = await run_in_threadpool(_load_exam_due_date, db, exam_id)
+        if due_date is not None:
+            exam_due_dates.set(exam_id, due_date)
+    return due_date
+
+def _write_exam_submissions(db: Session, items: List[dict]) -> list:
+    """
+    Insert a batch of exam submissions with one INSERT IGNORE. Students who
+    already submitted (earlier, or twice within the batch) or submitted after
+    the deadline get a 400 instead.
+    """
+    already_submitted = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="You have already submitted this exam"
+    )
+    results = [None] * len(items)
+    new_rows = {}
+    for index, item in enumerate(items):
+        key = (item["exam_id"], item["student_id"])
+        if key in new_rows:
+            results[index] = already_submitted
+        else:
+            new_rows[key] = (index, item)
+    
+    # The handler only checked a cached due date. Lock the exam rows, which add_counts
+    # updates anyway, so the deadline can't move before this batch commits
+    due_dates = dict(db.query(Exam.id, Exam.due_date).filter(
+        Exam.id.in_({key[0] for key in new_rows})
+    ).order_by(Exam.id).with_for_update().all())
+    for key, (index, item) in list(new_rows.items()):
+        due_date = due_dates.get(key[0])
+        if due_date is None:
+            results[index] = HTTPException(status_code=404, detail="Exam not found")
+        elif item["submitted_at"] > due_date:
+            results[index] = HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Exam submission deadline has passed"
+            )
+        else:
+            continue
+        del new_rows[key]
+    if not new_rows:
+        db.rollback()
+        return results
+    
+    rows = [{**item, "status": "submitted"} for _, item in new_rows.values()]
+    inserted = insert_ignore(db, ExamSubmissionModel, rows, ("exam_id", "student_id"))
+    if inserted < len(rows):
+        db.rollback()
+        if len(rows) == 1:
+            index, _ = next(iter(new_rows.values()))
+            results[index] = already_submitted
+            return results
+        # Some student had already submitted, but a multi-row insert doesn't say who; the queue retries row by row
+        raise IntegrityError("INSERT IGNORE", None, Exception("exam already submitted"))
+    add_counts(db, Exam, "submission_count", Counter(row["exam_id"] for row in rows))
+    db.commit()
+    student_changed(*{row["student_id"] for row in rows})
+    
+    created = {
+        (row.exam_id, row.student_id): row
+        for row in db.query(ExamSubmissionModel).filter(
+            ExamSubmissionModel.exam_id.in_({key[0] for key in new_rows}),
+            ExamSubmissionModel.student_id.in_({key[1] for key in new_rows})
+        )
+    }
+    for key, (index, _) in new_rows.items():
+        results[index] = ExamSubmission.model_validate(created[key])
+    return results
+
+exam_submission_intake = GroupCommitQueue("exam_submissions", _write_exam_submissions)
+
 # Submit exam answers (student only)
 @router.post("/{exam_id}/submit", response_model=ExamSubmission)
-def submit_exam(
+async def submit_exam(
     exam_id: int,
     submission: ExamSubmissionBase,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_student)
 ):
     """
-    Submit exam (requires student privileges)
+    Submit exam (requires student privileges). Submissions are written in
+    batches; the response is sent once the submission is committed.
     """
-    # Get student profile
-    student_profile = db.query(StudentProfile).filter(
-        StudentProfile.user_id == current_user.id
-    ).first()
-    
-    if not student_profile:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Student profile not found"
-        )
+    # The submission time is the arrival time, however long the batch takes
+    current_time = datetime.utcnow()
+    student_profile_id = await run_in_threadpool(get_student_profile_id, db, current_user.id)
     
-    # Verify exam exists and is active
-    exam = db.query(Exam).filter(Exam.id == exam_id).first()
-    if not exam:
+    # Reject late submissions early; the deadline is checked again on the exam row when the batch is written
+    due_date = await _exam_due_date(db, exam_id)
+    # Hand the connection back while the request waits for its batch
+    db.close()
+    if due_date is None:
         raise HTTPException(status_code=404, detail="Exam not found")
     
-    # Check if student has already submitted this exam
-    existing_submission = db.query(ExamSubmissionModel).filter(
-        ExamSubmissionModel.exam_id == exam_id,
-        ExamSubmissionModel.student_id == student_profile.id
-    ).first()
-    
-    if existing_submission:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="You have already submitted this exam"
-        )
-    
-    current_time = datetime.utcnow()
-    if current_time > exam.due_date:
+    if current_time > due_date:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Exam submission deadline has passed"
         )
     
-    # Create submission
-    db_submission = ExamSubmissionModel(
-        exam_id=exam_id,
-        student_id=student_profile.id,
-        submission_url=submission.submission_url,
-        status="submitted",
-        submitted_at=current_time
-    )
-    db.add(db_submission)
-    db.commit()
-    db.refresh(db_submission)
-    return db_submission
+    return await exam_submission_intake.submit({
+        "exam_id": exam_id,
+        "student_id": student_profile_id,
+        "submission_url": submission.submission_url,
+        "submitted_at": current_time,
+    })
 
-# Upload exam file (lecturer only)
-@router.post("/{exam_id}/upload", status_code=status.HTTP_201_CREATED)
-def upload_exam_file(
-    exam_id: int,
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_lecturer)
-):
-    """
-    Upload exam file (requires lecturer privileges)
-    """
+def _get_uploadable_exam(db: Session, current_user: User, exam_id: int) -> Exam:
     # Get lecturer profile
     lecturer_profile = db.query(LecturerProfile).filter(
         LecturerProfile.user_id == current_user.id
@@ -168,7 +283,7 @@ def upload_exam_file(
         raise HTTPException(status_code=404, detail="Exam not found")
     
     # Find lecturer's courses
-    lecturer_courses = db.query(Course).filter(Course.lecturer_id == lecturer_profile.id).all()
+    lecturer_courses = db.query(Course).filter(Course.lecturer_id == lecturer_profile.id, Course.deleted_at.is_(None)).all()
     course_titles = [course.title for course in lecturer_courses]
     
     # Check if exam course belongs to lecturer
@@ -177,17 +292,37 @@ def upload_exam_file(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to upload file for this exam"
         )
+    return exam
+
+def _attach_exam_file(db: Session, exam: Exam, stored, content_type: str):
+    # Swap the blob reference and the exam row in one transaction
+    acquire_blob(db, stored, content_type)
+    release_blob(db, exam.file_sha256)
+    exam.file_sha256 = stored.sha256
+    exam.exam_url = blob_url(stored.sha256)
+    db.commit()
+
+# Upload exam file (lecturer only)
+@router.post("/{exam_id}/upload", status_code=status.HTTP_201_CREATED)
+async def upload_exam_file(
+    exam_id: int,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_lecturer)
+):
+    """
+    Upload exam file (requires lecturer privileges). The file is streamed into
+    the blob store, limited to MAX_UPLOAD_BYTES and stored once however often it is uploaded.
+    """
+    exam = await run_in_threadpool(_get_uploadable_exam, db, current_user, exam_id)
     
     # Save file
-    file_location = f"exam_files/{exam_id}_{file.filename}"
-    with open(file_location, "wb+") as file_object:
-        file_object.write(file.file.read())
+    stored = await store_upload(file, kind="exam")
     
     # Update exam with file URL
-    exam.exam_url = file_location
-    db.commit()
+    await run_in_threadpool(_attach_exam_file, db, exam, stored, file.content_type)
     
-    return {"message": "File uploaded successfully"}
+    return {"message": "File uploaded successfully", "size": stored.size, "sha256": stored.sha256}
 
 # Check if student has already submitted an exam
 @router.get("/{exam_id}/submission-status", response_model=dict)
@@ -250,7 +385,7 @@ def get_exam_submissions(
         raise HTTPException(status_code=404, detail="Exam not found")
     
     # Find lecturer's courses
-    lecturer_courses = db.query(Course).filter(Course.lecturer_id == lecturer_profile.id).all()
+    lecturer_courses = db.query(Course).filter(Course.lecturer_id == lecturer_profile.id, Course.deleted_at.is_(None)).all()
     course_titles = [course.title for course in lecturer_courses]
     
     # Check if exam course belongs to lecturer
@@ -260,13 +395,6 @@ def get_exam_submissions(
             detail="Not authorized to view submissions for this exam"
         )
     
-    # First try a simple query to get the count
-    count = db.query(ExamSubmissionModel).filter(ExamSubmissionModel.exam_id == exam_id).count()
-    print(f"DEBUG: Found {count} submissions for exam {exam_id}")
-
-    if count == 0:
-        return []
-
     # Get submissions with student information
     try:
         query = db.query(
@@ -283,9 +411,7 @@ def get_exam_submissions(
             ExamSubmissionModel.exam_id == exam_id
         )
         
-        print(f"DEBUG: Query SQL: {str(query)}")
         submissions = query.all()
-        print(f"DEBUG: Found {len(submissions)} submissions with join")
         
         # Format the response
         result = []
@@ -305,10 +431,9 @@ def get_exam_submissions(
                 "graded_at": submission.graded_at
             })
         
-        print(f"DEBUG: Returning {len(result)} formatted submissions")
         return result
-    except Exception as e:
-        print(f"ERROR in get_exam_submissions: {str(e)}")
+    except Exception:
+        logger.exception("Joined submissions query failed for exam %d", exam_id)
         # In case of error, return a simple list of submissions
         submissions = db.query(ExamSubmissionModel).filter(
             ExamSubmissionModel.exam_id == exam_id
@@ -332,60 +457,124 @@ def get_exam_submissions(
             for submission in submissions
         ]
 
+# Claim the next ungraded submissions of an exam (lecturer only)
+@router.post("/{exam_id}/claims", response_model=ExamSubmissionClaim)
+def claim_exam_submissions(
+    exam_id: int,
+    limit: int = 10,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_lecturer)
+):
+    """
+    Claim up to `limit` ungraded submissions of an exam so that other graders
+    get different ones (requires lecturer privileges)
+    """
+    _check_grader(db, exam_id, get_lecturer_profile_id(db, current_user.id))
+    submissions, claim_expires_at = claim_submissions(
+        db, ExamSubmissionModel, ExamSubmissionModel.exam_id, exam_id, current_user.id, limit
+    )
+    return {"claim_expires_at": claim_expires_at, "submissions": submissions}
+
+# Give back unfinished claims on an exam (lecturer only)
+@router.delete("/{exam_id}/claims", status_code=status.HTTP_204_NO_CONTENT)
+def release_exam_claims(
+    exam_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_lecturer)
+):
+    """
+    Release the current user's claims on an exam's ungraded submissions (requires lecturer privileges)
+    """
+    _check_grader(db, exam_id, get_lecturer_profile_id(db, current_user.id))
+    release_claims(db, ExamSubmissionModel, ExamSubmissionModel.exam_id, exam_id, current_user.id)
+    return None
+
+# Grade many exam submissions at once (lecturer only)
+@router.patch("/submissions", response_model=List[ExamSubmission])
+def grade_exam_submissions(
+    batch: GradeBatch,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_lecturer)
+):
+    """
+    Grade a batch of exam submissions in one transaction (requires lecturer privileges)
+    """
+    lecturer_profile_id = get_lecturer_profile_id(db, current_user.id)
+    if lecturer_profile_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Lecturer profile not found"
+        )
+    own_exams = select(Exam.id).where(Exam.course_name.in_(_own_course_titles(lecturer_profile_id)))
+    now = datetime.utcnow()
+    return apply_grades(
+        db,
+        ExamSubmissionModel,
+        ExamSubmissionModel.exam_id,
+        Exam,
+        batch.grades,
+        ExamSubmissionModel.exam_id.in_(own_exams),
+        set_={"status": "graded", "graded_at": now, "updated_at": now}
+    )
+
 # Update an exam (lecturer only)
 @router.put("/{exam_id}", response_model=ExamSchema)
 def update_exam(
     exam_id: int,
     exam_update: ExamUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_lecturer)
 ):
     """
     Update an exam (requires lecturer privileges)
     """
-    # Get lecturer profile
-    lecturer_profile = db.query(LecturerProfile).filter(
-        LecturerProfile.user_id == current_user.id
-    ).first()
-    
-    if not lecturer_profile:
+    lecturer_profile_id = get_lecturer_profile_id(db, current_user.id)
+    if lecturer_profile_id is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Lecturer profile not found"
         )
-    
-    # Verify exam exists
-    exam = db.query(Exam).filter(Exam.id == exam_id).first()
-    if not exam:
-        raise HTTPException(status_code=404, detail="Exam not found")
-    
-    # Find lecturer's courses
-    lecturer_courses = db.query(Course).filter(Course.lecturer_id == lecturer_profile.id).all()
-    course_titles = [course.title for course in lecturer_courses]
-    
-    # Check if exam course belongs to lecturer
-    if exam.course_name not in course_titles:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to update this exam"
-        )
-    
-    # Update exam fields
-    if exam_update.title is not None:
-        exam.title = exam_update.title
-    if exam_update.description is not None:
-        exam.description = exam_update.description
-    if exam_update.course_name is not None:
-        exam.course_name = exam_update.course_name
-    if exam_update.exam_url is not None:
-        exam.exam_url = exam_update.exam_url
-    if exam_update.due_date is not None:
-        exam.due_date = exam_update.due_date
-    if exam_update.status is not None:
-        exam.status = exam_update.status
-    
+    own_course_titles = _own_course_titles(lecturer_profile_id)
+    
+    # Update the fields that were given
+    exam_data = {key: value for key, value in exam_update.dict().items() if value is not None}
+    expect = []
+    replaced_file = None
+    if "exam_url" in exam_data:
+        # A new URL replaces an uploaded file; the file must still be the one read here
+        previous_file = db.query(Exam.file_sha256).filter(Exam.id == exam_id).scalar()
+        if previous_file and exam_data["exam_url"] != blob_url(previous_file):
+            exam_data["file_sha256"] = None
+            expect.append(Exam.file_sha256 == previous_file)
+            replaced_file = previous_file
+    exam = update_row(
+        db,
+        Exam,
+        exam_id,
+        exam_data,
+        where=[Exam.course_name.in_(own_course_titles)],
+        versions=if_match_versions(if_match),
+        expect=expect
+    )
+    if exam is None:
+        # Nothing was updated; find out why
+        existing = db.query(Exam).filter(Exam.id == exam_id).first()
+        if not existing:
+            raise HTTPException(status_code=404, detail="Exam not found")
+        if not db.query(own_course_titles.where(Course.title == existing.course_name).exists()).scalar():
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Not authorized to update this exam"
+            )
+        raise_conflict(existing)
+    
+    release_blob(db, replaced_file)
     db.commit()
-    db.refresh(exam)
+    set_etag(response, exam)
+    exam_due_dates.invalidate(exam_id)
+    coursework_changed()
     return exam
 
 # Delete an exam (lecturer only)
@@ -415,7 +604,7 @@ def delete_exam(
         raise HTTPException(status_code=404, detail="Exam not found")
     
     # Find lecturer's courses
-    lecturer_courses = db.query(Course).filter(Course.lecturer_id == lecturer_profile.id).all()
+    lecturer_courses = db.query(Course).filter(Course.lecturer_id == lecturer_profile.id, Course.deleted_at.is_(None)).all()
     course_titles = [course.title for course in lecturer_courses]
     
     # Check if exam course belongs to lecturer
@@ -426,14 +615,13 @@ def delete_exam(
         )
     
     try:
-        # First delete all submissions associated with this exam
-        db.query(ExamSubmissionModel).filter(
-            ExamSubmissionModel.exam_id == exam_id
-        ).delete(synchronize_session=False)
-        
-        # Then delete the exam
+        # Its submissions go with it (ON DELETE CASCADE); let go of its and their files first
+        release_blob(db, exam.file_sha256)
+        release_blobs(db, ExamSubmissionModel.submission_sha256, ExamSubmissionModel.exam_id == exam_id)
         db.delete(exam)
         db.commit()
+        exam_due_dates.invalidate(exam_id)
+        coursework_changed()
         
         return None
     except Exception as e:
@@ -455,7 +643,7 @@ def debug_all_submissions(
     try:
         # First try with a simpler query to just count
         count = db.query(ExamSubmissionModel).count()
-        print(f"DEBUG: Total submissions in system: {count}")
+        logger.debug("Total submissions in system: %d", count)
         
         if count == 0:
             return []
@@ -489,8 +677,8 @@ def debug_all_submissions(
             })
         
         return result
-    except Exception as e:
-        print(f"ERROR in debug_all_submissions: {str(e)}")
+    except Exception:
+        logger.exception("Joined query failed in debug_all_submissions")
         # In case of error, return basic submission info
         submissions = db.query(ExamSubmissionModel).all()
         return [
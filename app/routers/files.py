@@ -0,0 +1,99 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+from ..database.database import get_db
+from ..models.exams import Exam, ExamSubmission
+from ..models.files import Blob
+from ..models.finance import PaymentSubmission
+from ..models.users import (
+    AssignmentSubmission, Course, CourseMaterial, CourseWeek, LecturerProfile, StudentProfile, User, UserRole
+)
+from ..utils.auth import get_current_active_user
+from ..utils.blobstore import is_sha256
+from ..utils.downloads import blob_response
+from ..utils.signing import verify_blob_signature
+
+router = APIRouter(prefix="/files", tags=["files"])
+
+def _can_read(db: Session, user: User, sha256: str) -> bool:
+    """
+    Whether a row referencing the blob is visible to the user: an exam file
+    (open to everyone, like the exams), their own submission or slip, a
+    submission to one of their courses for lecturers, or anything for admins.
+    """
+    if user.role == UserRole.ADMIN:
+        return True
+    readable = [select(Exam.id).where(Exam.file_sha256 == sha256)]
+    if user.role == UserRole.STUDENT:
+        own = select(StudentProfile.id).where(StudentProfile.user_id == user.id)
+        readable += [
+            select(ExamSubmission.id).where(ExamSubmission.submission_sha256 == sha256, ExamSubmission.student_id.in_(own)),
+            select(AssignmentSubmission.id).where(
+                AssignmentSubmission.submission_sha256 == sha256, AssignmentSubmission.student_id.in_(own)
+            ),
+            select(PaymentSubmission.id).where(
+                PaymentSubmission.payment_slip_sha256 == sha256, PaymentSubmission.student_id.in_(own)
+            ),
+        ]
+    elif user.role == UserRole.LECTURER:
+        courses = select(Course.id, Course.title).where(
+            Course.lecturer_id.in_(select(LecturerProfile.id).where(LecturerProfile.user_id == user.id)),
+            Course.deleted_at.is_(None)
+        ).subquery()
+        readable += [
+            select(ExamSubmission.id).join(Exam, Exam.id == ExamSubmission.exam_id).where(
+                ExamSubmission.submission_sha256 == sha256, Exam.course_name.in_(select(courses.c.title))
+            ),
+            select(AssignmentSubmission.id).join(
+                CourseMaterial, CourseMaterial.id == AssignmentSubmission.assignment_id
+            ).join(CourseWeek, CourseWeek.id == CourseMaterial.week_id).where(
+                AssignmentSubmission.submission_sha256 == sha256, CourseWeek.course_id.in_(select(courses.c.id))
+            ),
+            # Lecturers verify payments (see finance.verify_payment_submission)
+            select(PaymentSubmission.id).where(PaymentSubmission.payment_slip_sha256 == sha256),
+        ]
+    return bool(db.scalar(select(or_(*(query.exists() for query in readable)))))
+
+# Download a stored file (exam files, payment slips) by its content hash
+@router.api_route("/{sha256}", methods=["GET", "HEAD"])
+def download_file(
+    sha256: str,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Download a stored file the user may see (see _can_read). Supports Range
+    requests and If-None-Match; the content never changes, so clients may
+    cache it indefinitely.
+    """
+    if not is_sha256(sha256):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    
+    blob = db.query(Blob).filter(Blob.sha256 == sha256, Blob.ref_count > 0).first()
+    # 404 rather than 403, so hashes of other people's files can't be probed
+    if not blob or not _can_read(db, current_user, sha256):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    
+    return blob_response(request, sha256, blob.content_type)
+
+# Download through a signed URL (see /exams/{exam_id}/file-url); no token or database needed
+@router.api_route("/signed/{sha256}", methods=["GET", "HEAD"])
+async def download_signed_file(
+    sha256: str,
+    request: Request,
+    expires: int,
+    sig: str,
+    content_type: str = Query(..., alias="type")
+):
+    """
+    Download a stored file through an HMAC-signed, expiring URL
+    """
+    if not is_sha256(sha256) or not verify_blob_signature(sha256, expires, content_type, sig):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid or expired download link"
+        )
+    
+    return blob_response(request, sha256, content_type)
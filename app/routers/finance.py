@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Header, Response, status, UploadFile, File
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime
 from typing import List, Optional
 from ..database.database import get_db
+from ..database.upsert import insert_ignore
+from ..database.writes import update_row
 from ..models.finance import PaymentAnnouncement, PaymentSubmission
 from ..models.users import User, StudentProfile, UserRole
 from ..schemas.finance import (
@@ -18,6 +20,11 @@ from ..schemas.finance import (
     StudentInfo
 )
 from ..utils.auth import get_current_user
+from ..utils.blobstore import acquire_blob, blob_url, release_blob, release_blobs, store_upload
+from ..utils.counters import add_counts, status_change
+from ..utils.dashboard import coursework_changed, student_changed
+from ..utils.versioning import check_if_match, commit_versioned, if_match_versions, raise_conflict, set_etag
+from starlette.concurrency import run_in_threadpool
 
 router = APIRouter(
     prefix="/finance",
@@ -49,6 +56,7 @@ def create_payment_announcement(
         db.add(db_announcement)
         db.commit()
         db.refresh(db_announcement)
+        coursework_changed()
         return db_announcement
     except SQLAlchemyError as e:
         db.rollback()
@@ -74,6 +82,7 @@ def get_all_payment_announcements(
 @router.get("/announcements/{announcement_id}", response_model=PaymentAnnouncementResponse)
 def get_payment_announcement(
     announcement_id: int,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -84,6 +93,7 @@ def get_payment_announcement(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Payment announcement not found"
             )
+        set_etag(response, announcement)
         return announcement
     except SQLAlchemyError as e:
         raise HTTPException(
@@ -95,6 +105,8 @@ def get_payment_announcement(
 def update_payment_announcement(
     announcement_id: int,
     announcement: PaymentAnnouncementUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -106,21 +118,26 @@ def update_payment_announcement(
         )
     
     try:
-        db_announcement = db.query(PaymentAnnouncement).filter(PaymentAnnouncement.id == announcement_id).first()
-        if not db_announcement:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Payment announcement not found"
-            )
-        
         # Update only provided fields
-        update_data = announcement.dict(exclude_unset=True)
-        for key, value in update_data.items():
-            setattr(db_announcement, key, value)
+        db_announcement = update_row(
+            db,
+            PaymentAnnouncement,
+            announcement_id,
+            announcement.dict(exclude_unset=True),
+            versions=if_match_versions(if_match)
+        )
+        if db_announcement is None:
+            existing = db.query(PaymentAnnouncement).filter(PaymentAnnouncement.id == announcement_id).first()
+            if not existing:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Payment announcement not found"
+                )
+            raise_conflict(existing)
         
-        db_announcement.updated_at = datetime.utcnow()
         db.commit()
-        db.refresh(db_announcement)
+        coursework_changed()
+        set_etag(response, db_announcement)
         return db_announcement
     except SQLAlchemyError as e:
         db.rollback()
@@ -150,8 +167,11 @@ def delete_payment_announcement(
                 detail="Payment announcement not found"
             )
         
+        # Its submissions go with it (ON DELETE CASCADE); let go of their slips first
+        release_blobs(db, PaymentSubmission.payment_slip_sha256, PaymentSubmission.announcement_id == announcement_id)
         db.delete(db_announcement)
         db.commit()
+        coursework_changed()
         return None
     except SQLAlchemyError as e:
         db.rollback()
@@ -191,36 +211,36 @@ def submit_payment(
             detail="Payment announcement not found"
         )
     
-    # Check if student has already submitted for this announcement
-    existing_submission = db.query(PaymentSubmission).filter(
-        PaymentSubmission.announcement_id == submission.announcement_id,
-        PaymentSubmission.student_id == student_profile.id
-    ).first()
-    
-    if existing_submission:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="You have already submitted a payment for this announcement. Please update your existing submission instead."
-        )
-    
-    # Create new submission
+    # Create the submission unless the student already has one for this announcement
     try:
-        new_submission = PaymentSubmission(
+        row = {
             **submission.dict(),
-            student_id=student_profile.id,
-            submitted_at=datetime.utcnow()
-        )
-        
-        db.add(new_submission)
+            "student_id": student_profile.id,
+            "status": "pending",
+            "submitted_at": datetime.utcnow()
+        }
+        inserted = insert_ignore(db, PaymentSubmission, [row], ("announcement_id", "student_id"))
+        if inserted:
+            add_counts(db, PaymentAnnouncement, "submission_count", {submission.announcement_id: 1})
         db.commit()
-        db.refresh(new_submission)
-        return new_submission
+        student_changed(student_profile.id)
     except SQLAlchemyError as e:
         db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Database error: {str(e)}"
         )
+    
+    if not inserted:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You have already submitted a payment for this announcement. Please update your existing submission instead."
+        )
+    
+    return db.query(PaymentSubmission).filter(
+        PaymentSubmission.announcement_id == submission.announcement_id,
+        PaymentSubmission.student_id == student_profile.id
+    ).first()
 
 @router.get("/submissions/my", response_model=List[PaymentSubmissionResponse])
 def get_my_payment_submissions(
@@ -319,6 +339,8 @@ def get_submissions_for_announcement(
 def update_payment_submission(
     submission_id: int,
     submission_update: PaymentSubmissionUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -350,6 +372,8 @@ def update_payment_submission(
                 detail="Payment submission not found or you don't have permission to update it"
             )
         
+        check_if_match(if_match, db_submission)
+        
         # Only allow updates if the submission is still pending
         if db_submission.status != "pending":
             raise HTTPException(
@@ -359,9 +383,60 @@ def update_payment_submission(
         
         # Update fields
         update_data = submission_update.dict(exclude_unset=True)
+        if "payment_slip_url" in update_data and db_submission.payment_slip_sha256:
+            # The slip now lives elsewhere; let go of the uploaded copy
+            release_blob(db, db_submission.payment_slip_sha256)
+            db_submission.payment_slip_sha256 = None
         for key, value in update_data.items():
             setattr(db_submission, key, value)
         
+        db_submission.updated_at = datetime.utcnow()
+        commit_versioned(db)
+        student_changed(db_submission.student_id)
+        db.refresh(db_submission)
+        set_etag(response, db_submission)
+        return db_submission
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Database error: {str(e)}"
+        )
+
+def _get_pending_own_submission(db: Session, current_user: User, submission_id: int) -> PaymentSubmission:
+    # Only students can upload slips for their own submissions
+    if current_user.role != UserRole.STUDENT:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only students can upload payment slips"
+        )
+    
+    db_submission = db.query(PaymentSubmission).join(
+        StudentProfile, PaymentSubmission.student_id == StudentProfile.id
+    ).filter(
+        PaymentSubmission.id == submission_id,
+        StudentProfile.user_id == current_user.id
+    ).first()
+    
+    if not db_submission:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Payment submission not found or you don't have permission to update it"
+        )
+    
+    if db_submission.status != "pending":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Cannot update submission with status '{db_submission.status}'. Only pending submissions can be updated."
+        )
+    return db_submission
+
+def _attach_payment_slip(db: Session, db_submission: PaymentSubmission, stored, content_type: str) -> PaymentSubmission:
+    try:
+        acquire_blob(db, stored, content_type)
+        release_blob(db, db_submission.payment_slip_sha256)
+        db_submission.payment_slip_sha256 = stored.sha256
+        db_submission.payment_slip_url = blob_url(stored.sha256)
         db_submission.updated_at = datetime.utcnow()
         db.commit()
         db.refresh(db_submission)
@@ -373,10 +448,27 @@ def update_payment_submission(
             detail=f"Database error: {str(e)}"
         )
 
+@router.post("/submissions/{submission_id}/slip", response_model=PaymentSubmissionResponse)
+async def upload_payment_slip(
+    submission_id: int,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Upload the payment slip file of a pending submission, replacing its slip URL.
+    Files are kept in the content-addressed blob store.
+    """
+    db_submission = await run_in_threadpool(_get_pending_own_submission, db, current_user, submission_id)
+    stored = await store_upload(file, kind="payment_slip")
+    return await run_in_threadpool(_attach_payment_slip, db, db_submission, stored, file.content_type)
+
 @router.put("/submissions/{submission_id}/verify", response_model=PaymentSubmissionResponse)
 def verify_payment_submission(
     submission_id: int,
     verification: PaymentVerificationUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -395,28 +487,40 @@ def verify_payment_submission(
         )
     
     try:
-        # Get submission
-        db_submission = db.query(PaymentSubmission).filter(
-            PaymentSubmission.id == submission_id
-        ).first()
-        
-        if not db_submission:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Payment submission not found"
-            )
-        
         # Update verification details
-        db_submission.status = verification.status
-        db_submission.verification_notes = verification.verification_notes
-        
+        verification_data = {
+            "status": verification.status,
+            "verification_notes": verification.verification_notes
+        }
         # If status is verified or rejected, update verified_at timestamp
         if verification.status in ["verified", "rejected"]:
-            db_submission.verified_at = datetime.utcnow()
+            verification_data["verified_at"] = datetime.utcnow()
         
-        db_submission.updated_at = datetime.utcnow()
+        # The verified count moves with the status, so the status must still be the one read here
+        previous_status = db.query(PaymentSubmission.status).filter(PaymentSubmission.id == submission_id).scalar()
+        db_submission = update_row(
+            db,
+            PaymentSubmission,
+            submission_id,
+            verification_data,
+            versions=if_match_versions(if_match),
+            expect=[PaymentSubmission.status == previous_status]
+        )
+        if db_submission is None:
+            existing = db.query(PaymentSubmission).filter(PaymentSubmission.id == submission_id).first()
+            if not existing:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Payment submission not found"
+                )
+            raise_conflict(existing)
+        
+        add_counts(db, PaymentAnnouncement, "verified_count", {
+            db_submission["announcement_id"]: status_change(previous_status, db_submission["status"], "verified")
+        })
         db.commit()
-        db.refresh(db_submission)
+        student_changed(db_submission["student_id"])
+        set_etag(response, db_submission)
         return db_submission
     except SQLAlchemyError as e:
         db.rollback()
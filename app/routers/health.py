@@ -0,0 +1,35 @@
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+
+from ..utils.health import readiness, loop_lag_monitor
+
+router = APIRouter(prefix="/api/health", tags=["health"])
+
+@router.on_event("startup")
+async def start_loop_lag_monitor():
+    loop_lag_monitor.start()
+
+@router.on_event("shutdown")
+async def stop_loop_lag_monitor():
+    loop_lag_monitor.stop()
+
+# Liveness: the process is up and its event loop is responding
+@router.get("/live")
+async def liveness():
+    """
+    Liveness probe. Never touches the database, so a slow DB doesn't get workers restarted.
+    """
+    return {"status": "alive"}
+
+# Readiness: the worker can take more traffic right now
+@router.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe. Returns 503 when the DB pool is saturated, the DB round-trip
+    is over budget or the event loop is lagging, so the load balancer sends traffic elsewhere.
+    """
+    ready, checks = await readiness()
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ready" if ready else "unavailable", "checks": checks},
+    )
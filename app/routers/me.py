@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+
+from ..database.database import get_db
+from ..models.users import User
+from ..schemas.dashboard import LecturerDashboard, StudentDashboard
+from ..utils.auth import get_current_lecturer, get_current_student, get_lecturer_profile_id, get_student_profile_id
+from ..utils.dashboard import lecturer_dashboards, load_lecturer_dashboard, load_student_dashboard, student_dashboards
+
+router = APIRouter(prefix="/me", tags=["me"])
+
+# Everything a student's home screen shows (student only)
+@router.get("/dashboard", response_model=StudentDashboard)
+def read_student_dashboard(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_student)
+):
+    """
+    Upcoming exams, outstanding assignments, pending payments and recent grades of the current student
+    """
+    student_id = get_student_profile_id(db, current_user.id)
+    return student_dashboards.get_or_load(student_id, lambda: load_student_dashboard(db, student_id))
+
+# Grading backlog, latest submissions and upcoming exams per course (lecturer only)
+@router.get("/lecturer-dashboard", response_model=LecturerDashboard)
+def read_lecturer_dashboard(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_lecturer)
+):
+    """
+    For each of the current lecturer's courses: ungraded assignment and exam submissions, the latest submissions and upcoming exams
+    """
+    lecturer_profile_id = get_lecturer_profile_id(db, current_user.id)
+    if lecturer_profile_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Lecturer profile not found"
+        )
+    return lecturer_dashboards.get_or_load(lecturer_profile_id, lambda: load_lecturer_dashboard(db, lecturer_profile_id))
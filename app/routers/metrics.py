@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+
+from ..utils.metrics import METRICS_TOKEN, render_metrics
+
+router = APIRouter(tags=["metrics"])
+
+# Prometheus scrape endpoint
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics(authorization: Optional[str] = Header(None)):
+    """
+    Metrics of this worker in the Prometheus text format (requires METRICS_TOKEN when it is set)
+    """
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token"
+        )
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,304 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy.orm import Session
+from sqlalchemy import or_, select
+from starlette.concurrency import run_in_threadpool
+from datetime import datetime
+import os
+import secrets
+
+from ..database.database import get_db
+from ..database.upsert import insert_ignore
+from ..models.users import User, StudentProfile, CourseMaterial, AssignmentSubmission, MaterialType
+from ..models.exams import Exam, ExamSubmission
+from ..models.finance import PaymentSubmission
+from ..schemas.uploads import UploadSlotRequest, UploadSlot, UploadConfirm, UploadConfirmation
+from ..utils.auth import get_current_student
+from ..utils.blobstore import LocalBlobBackend, acquire_blob, blob_url, get_backend, is_sha256, release_blob, store_body
+from ..utils.counters import add_counts
+from ..utils.dashboard import student_changed
+from ..utils.signing import sign_token, verify_token
+from ..utils.transcript import record_grade_changes
+from ..utils.uploads import StoredUpload
+
+router = APIRouter(prefix="/uploads", tags=["uploads"])
+
+# Direct uploads may be larger than files sent through the multipart endpoints
+DIRECT_UPLOAD_MAX_BYTES = int(os.getenv("DIRECT_UPLOAD_MAX_BYTES", str(500 * 1024 * 1024)))
+DIRECT_UPLOAD_TTL = int(os.getenv("DIRECT_UPLOAD_TTL", "3600"))
+UPLOAD_TOKEN_PURPOSE = "direct-upload"
+# Path of the local stand-in for a bucket (put_blob); main.py exempts it from the global request size limit
+LOCAL_UPLOAD_PREFIX = "/uploads/blobs/"
+UPLOAD_TARGETS = ("exam", "assignment")
+
+def _get_student_profile(db: Session, current_user: User) -> StudentProfile:
+    student_profile = db.query(StudentProfile).filter(
+        StudentProfile.user_id == current_user.id
+    ).first()
+
+    if not student_profile:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Student profile not found"
+        )
+    return student_profile
+
+def _holds_reference(db: Session, student_profile_id: int, sha256: str) -> bool:
+    """
+    Whether one of the student's own submissions or slips already points at the blob.
+    """
+    owned = [
+        select(ExamSubmission.id).where(ExamSubmission.student_id == student_profile_id, ExamSubmission.submission_sha256 == sha256),
+        select(AssignmentSubmission.id).where(
+            AssignmentSubmission.student_id == student_profile_id, AssignmentSubmission.submission_sha256 == sha256
+        ),
+        select(PaymentSubmission.id).where(
+            PaymentSubmission.student_id == student_profile_id, PaymentSubmission.payment_slip_sha256 == sha256
+        ),
+    ]
+    return bool(db.scalar(select(or_(*(query.exists() for query in owned)))))
+
+def _upload_arrived(db: Session, student_profile_id: int, payload: dict) -> bool:
+    """
+    Whether the file of an upload slot is stored for this student: PUT
+    through this very slot, or already theirs. That the blob exists, or was
+    written recently, isn't enough: anyone may upload the same content, and
+    knowing a hash must not claim someone else's file.
+    """
+    backend = get_backend()
+    if backend.size(payload["sha256"]) != payload["size"]:
+        return False
+    if payload.get("slot") and backend.slot_received(payload["slot"], payload["sha256"]):
+        return True
+    return _holds_reference(db, student_profile_id, payload["sha256"])
+
+def _check_target(db: Session, student_profile: StudentProfile, target: str, target_id: int, at: datetime):
+    """
+    Raise unless the student may submit a file for the target at time `at`.
+    """
+    if target == "exam":
+        exam = db.query(Exam).filter(Exam.id == target_id).first()
+        if not exam:
+            raise HTTPException(status_code=404, detail="Exam not found")
+
+        existing_submission = db.query(ExamSubmission.id).filter(
+            ExamSubmission.exam_id == target_id,
+            ExamSubmission.student_id == student_profile.id
+        ).first()
+        if existing_submission:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="You have already submitted this exam"
+            )
+
+        if at > exam.due_date:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Exam submission deadline has passed"
+            )
+    elif target == "assignment":
+        assignment = db.query(CourseMaterial).filter(CourseMaterial.id == target_id).first()
+        if not assignment:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Assignment not found"
+            )
+
+        if assignment.material_type != MaterialType.ASSIGNMENT:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="This material is not an assignment"
+            )
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Target must be one of: {', '.join(UPLOAD_TARGETS)}"
+        )
+
+# Step 1: reserve an upload slot (student only)
+@router.post("/slots", response_model=UploadSlot, status_code=status.HTTP_201_CREATED)
+def request_upload_slot(
+    slot_request: UploadSlotRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_student)
+):
+    """
+    Reserve a direct upload for an exam or assignment submission. The file is
+    PUT to `upload_url` (the storage backend, not this API) and then confirmed
+    with the returned token. Nothing is written to the database until then.
+    A file the student already submitted elsewhere needs no upload.
+    """
+    sha256 = slot_request.sha256.lower()
+    if not is_sha256(sha256):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="sha256 must be a hex SHA-256 digest"
+        )
+    if slot_request.size > DIRECT_UPLOAD_MAX_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File exceeds the {DIRECT_UPLOAD_MAX_BYTES} byte upload limit"
+        )
+
+    student_profile = _get_student_profile(db, current_user)
+    issued_at = datetime.utcnow()
+    _check_target(db, student_profile, slot_request.target, slot_request.target_id, issued_at)
+
+    # Marked when this slot's PUT lands (see _upload_arrived)
+    slot = secrets.token_urlsafe(16)
+    token, expires = sign_token(UPLOAD_TOKEN_PURPOSE, {
+        "user_id": current_user.id,
+        "target": slot_request.target,
+        "target_id": slot_request.target_id,
+        "sha256": sha256,
+        "size": slot_request.size,
+        "content_type": slot_request.content_type,
+        # The deadline is checked against the time the slot was issued, so a slow upload that started in time still counts
+        "issued_at": issued_at.isoformat(),
+        "slot": slot,
+    }, DIRECT_UPLOAD_TTL)
+
+    backend = get_backend()
+    upload_url = None
+    headers = {}
+    if backend.size(sha256) != slot_request.size or not _holds_reference(db, student_profile.id, sha256):
+        if isinstance(backend, LocalBlobBackend):
+            upload_url = f"{LOCAL_UPLOAD_PREFIX}{sha256}?token={token}"
+            headers = {"Content-Type": slot_request.content_type}
+        else:
+            upload_url, headers = backend.presigned_put(sha256, slot_request.content_type, DIRECT_UPLOAD_TTL, slot)
+
+    return UploadSlot(
+        token=token,
+        upload_url=upload_url,
+        headers=headers,
+        expires_at=datetime.utcfromtimestamp(expires)
+    )
+
+# Step 2 (local storage only): the stand-in for a presigned bucket PUT
+@router.put("/blobs/{sha256}", status_code=status.HTTP_201_CREATED)
+async def put_blob(sha256: str, token: str, request: Request):
+    """
+    Receive the file body of an upload slot. Authorized by the slot token
+    alone, like a presigned URL; the content must match the announced hash and size.
+    """
+    backend = get_backend()
+    if not isinstance(backend, LocalBlobBackend):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    payload = verify_token(UPLOAD_TOKEN_PURPOSE, token)
+    if payload is None or payload["sha256"] != sha256 or not payload.get("slot"):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid or expired upload token"
+        )
+
+    # Anything longer than announced is cut off with 413, anything else fails the hash check
+    stored = await store_body(request, "direct_upload", sha256, payload["size"], payload["content_type"])
+    await run_in_threadpool(backend.record_slot, payload["slot"], sha256)
+    return {"sha256": stored.sha256, "size": stored.size}
+
+def _record_submission(db: Session, student_profile: StudentProfile, payload: dict) -> int:
+    stored = StoredUpload(None, payload["size"], payload["sha256"])
+    submission_url = blob_url(payload["sha256"])
+    now = datetime.utcnow()
+    # Take the blob reference first, so its row exists before anything points at it
+    acquire_blob(db, stored, payload["content_type"])
+
+    if payload["target"] == "exam":
+        inserted = insert_ignore(db, ExamSubmission, [{
+            "exam_id": payload["target_id"],
+            "student_id": student_profile.id,
+            "submission_url": submission_url,
+            "submission_sha256": payload["sha256"],
+            "status": "submitted",
+            "submitted_at": now
+        }], ("exam_id", "student_id"))
+        if not inserted:
+            # Lost a race with another submission of the same exam
+            db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="You have already submitted this exam"
+            )
+        add_counts(db, Exam, "submission_count", {payload["target_id"]: 1})
+        db.commit()
+        student_changed(student_profile.id)
+        return db.query(ExamSubmission.id).filter(
+            ExamSubmission.exam_id == payload["target_id"],
+            ExamSubmission.student_id == student_profile.id
+        ).scalar()
+
+    submission_key = (
+        AssignmentSubmission.assignment_id == payload["target_id"],
+        AssignmentSubmission.student_id == student_profile.id
+    )
+    inserted = insert_ignore(db, AssignmentSubmission, [{
+        "assignment_id": payload["target_id"],
+        "student_id": student_profile.id,
+        "submission_url": submission_url,
+        "submission_sha256": payload["sha256"],
+        "status": "submitted",
+        "submitted_at": now
+    }], ("assignment_id", "student_id"))
+    if inserted:
+        add_counts(db, CourseMaterial, "submission_count", {payload["target_id"]: 1})
+    else:
+        # Resubmission replaces the earlier file, and needs grading again. The row lock
+        # keeps two confirms racing here from both releasing the same earlier file
+        previous = db.query(
+            AssignmentSubmission.id, AssignmentSubmission.status, AssignmentSubmission.score,
+            AssignmentSubmission.submission_sha256
+        ).filter(*submission_key).with_for_update().one()
+        release_blob(db, previous.submission_sha256)
+        db.query(AssignmentSubmission).filter(AssignmentSubmission.id == previous.id).update({
+            AssignmentSubmission.submission_url: submission_url,
+            AssignmentSubmission.submission_sha256: payload["sha256"],
+            AssignmentSubmission.status: "submitted",
+            AssignmentSubmission.version: AssignmentSubmission.version + 1,
+        }, synchronize_session=False)
+        if previous.status == "graded":
+            add_counts(db, CourseMaterial, "graded_count", {payload["target_id"]: -1})
+            record_grade_changes(db, AssignmentSubmission, [(
+                student_profile.id, payload["target_id"],
+                ("graded", previous.score), ("submitted", previous.score)
+            )])
+
+    db.commit()
+    student_changed(student_profile.id)
+    return db.query(AssignmentSubmission.id).filter(*submission_key).scalar()
+
+# Step 3: confirm the upload and record the submission (student only)
+@router.post("/confirm", response_model=UploadConfirmation, status_code=status.HTTP_201_CREATED)
+def confirm_upload(
+    confirmation: UploadConfirm,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_student)
+):
+    """
+    Confirm a finished direct upload. Creates or updates the exam or assignment submission.
+    """
+    payload = verify_token(UPLOAD_TOKEN_PURPOSE, confirmation.token)
+    if payload is None or payload["user_id"] != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid or expired upload token"
+        )
+
+    student_profile = _get_student_profile(db, current_user)
+    if not _upload_arrived(db, student_profile.id, payload):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The file has not been uploaded yet"
+        )
+
+    issued_at = datetime.fromisoformat(payload["issued_at"])
+    _check_target(db, student_profile, payload["target"], payload["target_id"], issued_at)
+    submission_id = _record_submission(db, student_profile, payload)
+
+    return UploadConfirmation(
+        target=payload["target"],
+        target_id=payload["target_id"],
+        submission_id=submission_id,
+        submission_url=blob_url(payload["sha256"]),
+        sha256=payload["sha256"],
+        size=payload["size"]
+    )
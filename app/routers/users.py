@@ -1,14 +1,83 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Header, Response, status
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 from ..database.database import get_db
+from ..database.writes import insert_row, update_row
 from ..models.users import User, UserRole, LecturerProfile, StudentProfile
-from ..schemas.users import UserCreate, User as UserSchema, UserUpdate
-from ..utils.auth import get_password_hash, get_current_active_user, get_current_lecturer
+from ..schemas.users import Transcript, UserCreate, User as UserSchema, UserUpdate
+from ..utils.auth import (
+    get_password_hash, get_current_active_user, get_current_lecturer, get_lecturer_profile_id, get_student_profile_id
+)
+from ..utils.purge import purge_deleted, remove_user
+from ..utils.transcript import lectures_student, load_transcript
+from ..utils.versioning import if_match_versions, raise_conflict, set_etag
 
 router = APIRouter(prefix="/users", tags=["users"])
 
+def insert_user(db: Session, user: UserCreate, hashed_password: str) -> dict:
+    """
+    INSERT a user and the profile for their role; returns the user as a dict
+    with its profiles, ready for the User response model. The caller commits.
+    """
+    db_user = insert_row(db, User, {
+        "email": user.email,
+        "username": user.username,
+        "hashed_password": hashed_password,
+        "role": user.role,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "is_active": True
+    })
+    db_user["lecturer_profile"] = None
+    db_user["student_profile"] = None
+    
+    if user.role == UserRole.LECTURER and user.lecturer_profile:
+        db_user["lecturer_profile"] = insert_row(db, LecturerProfile, {
+            "user_id": db_user["id"],
+            **user.lecturer_profile.dict()
+        })
+    elif user.role == UserRole.STUDENT and user.student_profile:
+        db_user["student_profile"] = insert_row(db, StudentProfile, {
+            "user_id": db_user["id"],
+            **user.student_profile.dict()
+        })
+    return db_user
+
+def update_user_row(db: Session, user_id: int, user: UserUpdate, versions: Optional[List[int]]) -> Optional[dict]:
+    """
+    UPDATE a user and the profile for their role; returns the user as a dict
+    with its profiles, or None when no undeleted user at one of `versions`
+    matched. The caller commits.
+    """
+    user_data = user.dict(exclude_unset=True)
+    profile_data = {
+        UserRole.LECTURER: (LecturerProfile, get_lecturer_profile_id, user_data.pop("lecturer_profile", None)),
+        UserRole.STUDENT: (StudentProfile, get_student_profile_id, user_data.pop("student_profile", None)),
+    }
+    # Profiles aren't versioned themselves; the user row is written (and its version bumped) for profile edits too
+    db_user = update_row(
+        db, User, user_id, {**user_data, "updated_at": func.now()},
+        where=[User.deleted_at.is_(None)], versions=versions
+    )
+    if db_user is None:
+        return None
+    db_user["lecturer_profile"] = None
+    db_user["student_profile"] = None
+    
+    if db_user["role"] in profile_data:
+        model, get_profile_id, data = profile_data[db_user["role"]]
+        profile_id = get_profile_id(db, user_id)
+        if profile_id is not None:
+            if data:
+                profile = update_row(db, model, profile_id, data)
+            else:
+                profile = dict(db.execute(select(model.__table__).where(model.id == profile_id)).one()._mapping)
+            db_user["lecturer_profile" if model is LecturerProfile else "student_profile"] = profile
+    return db_user
+
 # Create a new user
 @router.post("/", response_model=UserSchema, status_code=status.HTTP_201_CREATED)
 def create_user(user: UserCreate, db: Session = Depends(get_db)):
@@ -25,46 +94,18 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
             detail="Email or username already registered"
         )
     
-    # Create new user
+    # Create the user and their profile in one transaction
     hashed_password = get_password_hash(user.password)
-    db_user = User(
-        email=user.email,
-        username=user.username,
-        hashed_password=hashed_password,
-        role=user.role,
-        first_name=user.first_name,
-        last_name=user.last_name
-    )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    
-    # Create lecturer profile if it's a lecturer
-    if user.role == UserRole.LECTURER and user.lecturer_profile:
-        lecturer_profile = LecturerProfile(
-            user_id=db_user.id,
-            department=user.lecturer_profile.department,
-            bio=user.lecturer_profile.bio,
-            qualification=user.lecturer_profile.qualification
-        )
-        db.add(lecturer_profile)
+    try:
+        db_user = insert_user(db, user, hashed_password)
         db.commit()
-        db.refresh(lecturer_profile)
-    
-    # Create student profile if it's a student
-    if user.role == UserRole.STUDENT and user.student_profile:
-        student_profile = StudentProfile(
-            user_id=db_user.id,
-            enrollment_number=user.student_profile.enrollment_number,
-            semester=user.student_profile.semester,
-            program=user.student_profile.program
+    except IntegrityError:
+        # Lost a race with another registration, or the enrollment number is taken
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email, username or enrollment number already registered"
         )
-        db.add(student_profile)
-        db.commit()
-        db.refresh(student_profile)
-    
-    # Refresh user to get the profiles
-    db.refresh(db_user)
     return db_user
 
 # Get all users
@@ -78,29 +119,59 @@ def read_users(
     """
     Get all users (requires authentication)
     """
-    users = db.query(User).offset(skip).limit(limit).all()
+    users = db.query(User).filter(User.deleted_at.is_(None)).offset(skip).limit(limit).all()
     return users
 
 # Get user by ID
 @router.get("/{user_id}", response_model=UserSchema)
 def read_user(
     user_id: int, 
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Get a specific user by ID (requires authentication)
     """
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = db.query(User).filter(User.id == user_id, User.deleted_at.is_(None)).first()
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
+    set_etag(response, db_user)
     return db_user
 
+# Get a student's grade summary across courses
+@router.get("/{user_id}/transcript", response_model=Transcript)
+def read_transcript(
+    user_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Get a student's graded assignments and exams and average score per course
+    (the student themselves, lecturers of their courses and admins)
+    """
+    allowed = (
+        current_user.id == user_id
+        or current_user.role == UserRole.ADMIN
+        or (current_user.role == UserRole.LECTURER and lectures_student(db, current_user.id, user_id))
+    )
+    if not allowed:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to view this transcript"
+        )
+    transcript = load_transcript(db, user_id)
+    if transcript is None:
+        raise HTTPException(status_code=404, detail="Student not found")
+    return transcript
+
 # Update user
 @router.put("/{user_id}", response_model=UserSchema)
 def update_user(
     user_id: int,
     user: UserUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
@@ -114,49 +185,33 @@ def update_user(
             detail="Not authorized to update this user"
         )
     
-    db_user = db.query(User).filter(User.id == user_id).first()
-    if not db_user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    # Update user fields if provided
-    user_data = user.dict(exclude_unset=True)
-    
-    # Handle nested lecturer profile update
-    if "lecturer_profile" in user_data and db_user.role == UserRole.LECTURER:
-        lecturer_data = user_data.pop("lecturer_profile")
-        if db_user.lecturer_profile and lecturer_data:
-            for key, value in lecturer_data.items():
-                setattr(db_user.lecturer_profile, key, value)
-    
-    # Handle nested student profile update
-    if "student_profile" in user_data and db_user.role == UserRole.STUDENT:
-        student_data = user_data.pop("student_profile")
-        if db_user.student_profile and student_data:
-            for key, value in student_data.items():
-                setattr(db_user.student_profile, key, value)
-    
-    # Update remaining user fields
-    for key, value in user_data.items():
-        setattr(db_user, key, value)
+    db_user = update_user_row(db, user_id, user, if_match_versions(if_match))
+    if db_user is None:
+        # Nothing was updated; find out why
+        existing = db.query(User).filter(User.id == user_id, User.deleted_at.is_(None)).first()
+        if not existing:
+            raise HTTPException(status_code=404, detail="User not found")
+        raise_conflict(existing)
     
     db.commit()
-    db.refresh(db_user)
+    set_etag(response, db_user)
     return db_user
 
 # Delete user
 @router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_user(
     user_id: int,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_lecturer)  # Only lecturers can delete users
 ):
     """
     Delete a user (requires lecturer privileges)
     """
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = db.query(User).filter(User.id == user_id, User.deleted_at.is_(None)).first()
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    db.delete(db_user)
-    db.commit()
+    if remove_user(db, db_user.id):
+        background_tasks.add_task(purge_deleted)
     return None 
\ No newline at end of file
@@ -0,0 +1,73 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Optional
+
+class DashboardExam(BaseModel):
+    id: int
+    title: str
+    course_name: str
+    due_date: datetime
+    submission_status: Optional[str] = None  # None until the student submits
+
+class DashboardAssignment(BaseModel):
+    id: int
+    title: Optional[str] = None
+    course_id: int
+    course_title: Optional[str] = None
+    week_number: Optional[int] = None
+    submission_status: Optional[str] = None  # None until the student submits
+
+class DashboardPayment(BaseModel):
+    id: int
+    title: str
+    amount: str
+    due_date: datetime
+    submission_status: Optional[str] = None  # None until the student submits
+
+class DashboardGrade(BaseModel):
+    kind: str  # assignment or exam
+    id: int
+    title: Optional[str] = None
+    course_title: Optional[str] = None
+    grade: Optional[str] = None
+    score: Optional[float] = None
+    feedback: Optional[str] = None
+    graded_at: Optional[datetime] = None
+
+class StudentDashboard(BaseModel):
+    student_id: int
+    upcoming_exams: List[DashboardExam] = []
+    outstanding_assignments: List[DashboardAssignment] = []
+    pending_payments: List[DashboardPayment] = []
+    recent_grades: List[DashboardGrade] = []
+
+class DashboardSubmission(BaseModel):
+    kind: str  # assignment or exam
+    id: int
+    item_id: int
+    item_title: Optional[str] = None
+    student_id: int
+    enrollment_number: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    status: Optional[str] = None
+    submitted_at: Optional[datetime] = None
+
+class DashboardUpcomingExam(BaseModel):
+    id: int
+    title: str
+    due_date: datetime
+    submission_count: int = 0
+    graded_count: int = 0
+
+class DashboardCourse(BaseModel):
+    id: int
+    title: Optional[str] = None
+    ungraded_assignment_submissions: int = 0
+    ungraded_exam_submissions: int = 0
+    latest_submissions: List[DashboardSubmission] = []
+    upcoming_exams: List[DashboardUpcomingExam] = []
+
+class LecturerDashboard(BaseModel):
+    lecturer_id: int
+    courses: List[DashboardCourse] = []
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 class ExamBase(BaseModel):
     title: str
@@ -23,7 +23,10 @@ class ExamUpdate(BaseModel):
 class Exam(ExamBase):
     id: int
     status: str
-    created_by: int
+    file_sha256: Optional[str] = None
+    submission_count: int = 0
+    graded_count: int = 0
+    created_by: Optional[int] = None  # None once the creator's account is deleted
     created_at: datetime
     updated_at: datetime
 
@@ -43,6 +46,7 @@ class ExamSubmission(ExamSubmissionBase):
     student_id: int
     status: str
     grade: Optional[str] = None
+    score: Optional[float] = None
     feedback: Optional[str] = None
     submitted_at: datetime
     graded_at: Optional[datetime] = None
@@ -51,4 +55,8 @@ class ExamSubmission(ExamSubmissionBase):
 
     class Config:
         orm_mode = True
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True
+
+class ExamSubmissionClaim(BaseModel):
+    claim_expires_at: datetime
+    submissions: List[ExamSubmission]
@@ -22,7 +22,9 @@ class PaymentAnnouncementUpdate(BaseModel):
 
 class PaymentAnnouncementResponse(PaymentAnnouncementBase):
     id: int
-    created_by: int
+    submission_count: int = 0
+    verified_count: int = 0
+    created_by: Optional[int] = None
     created_at: datetime
     updated_at: datetime
 
@@ -53,6 +55,7 @@ class PaymentVerificationUpdate(BaseModel):
 class PaymentSubmissionResponse(PaymentSubmissionBase):
     id: int
     student_id: int
+    payment_slip_sha256: Optional[str] = None
     status: str
     verification_notes: Optional[str] = None
     submitted_at: datetime
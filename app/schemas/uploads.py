@@ -0,0 +1,28 @@
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Dict, Optional
+
+class UploadSlotRequest(BaseModel):
+    target: str = Field(..., description="What the file is submitted for: exam or assignment")
+    target_id: int
+    sha256: str = Field(..., description="Hex SHA-256 of the file")
+    size: int = Field(..., gt=0, description="File size in bytes")
+    content_type: str = "application/octet-stream"
+
+class UploadSlot(BaseModel):
+    token: str
+    upload_url: Optional[str] = None  # None when the student already submitted this file; confirm right away
+    method: str = "PUT"
+    headers: Dict[str, str] = {}
+    expires_at: datetime
+
+class UploadConfirm(BaseModel):
+    token: str
+
+class UploadConfirmation(BaseModel):
+    target: str
+    target_id: int
+    submission_id: int
+    submission_url: str
+    sha256: str
+    size: int
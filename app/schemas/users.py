@@ -98,6 +98,15 @@ class AssignmentSubmissionUpdate(BaseModel):
     grade: Optional[str] = None
     feedback: Optional[str] = None
 
+class SubmissionGrade(BaseModel):
+    submission_id: int
+    grade: Optional[str] = None  # None keeps the current grade
+    feedback: Optional[str] = None
+    version: Optional[int] = None  # ETag version last seen; the batch fails with 409 if the submission has changed since
+
+class GradeBatch(BaseModel):
+    grades: List[SubmissionGrade] = Field(..., max_length=1000)
+
 class AssignmentSubmission(AssignmentSubmissionBase):
     id: int
     assignment_id: int
@@ -106,11 +115,16 @@ class AssignmentSubmission(AssignmentSubmissionBase):
     updated_at: datetime
     status: str
     grade: Optional[str] = None
+    score: Optional[float] = None  # the grade as a number, when it is one
     feedback: Optional[str] = None
 
     class Config:
         from_attributes = True
 
+class AssignmentSubmissionClaim(BaseModel):
+    claim_expires_at: datetime
+    submissions: List[AssignmentSubmission]
+
 # Course Material Schemas
 class CourseMaterialBase(BaseModel):
     title: str
@@ -132,6 +146,8 @@ class CourseMaterial(CourseMaterialBase):
     week_id: int
     created_at: datetime
     updated_at: datetime
+    submission_count: int = 0
+    graded_count: int = 0
     submissions: List[AssignmentSubmission] = []
 
     class Config:
@@ -181,4 +197,19 @@ class Course(CourseBase):
     weeks: List[CourseWeek] = []
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True
+
+# Transcript Schemas
+class TranscriptCourse(BaseModel):
+    course_id: int
+    course_title: Optional[str] = None
+    assignments_graded: int
+    exams_graded: int
+    scored_count: int
+    average_score: Optional[float] = None
+    updated_at: Optional[datetime] = None
+
+class Transcript(BaseModel):
+    student_id: int
+    courses: List[TranscriptCourse] = []
+    average_score: Optional[float] = None
@@ -1,5 +1,3 @@
-from passlib.context import CryptContext
-from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import Depends, HTTPException, status
@@ -7,28 +5,49 @@ from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 
 from ..schemas.users import TokenData
-from ..models.users import User, StudentProfile
+from ..models.users import User, StudentProfile, LecturerProfile
 from ..database.database import get_db
+from .metrics import BCRYPT_IN_PROGRESS
+from .cache import TTLCache
 
 # Configuration
 SECRET_KEY = "YOUR_SECRET_KEY_HERE"  # In production, use a secure key and store in environment variables
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Password hashing setup
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# user id -> student/lecturer profile id; profiles are created with the user and never move
+student_profile_ids = TTLCache("student_profile_id", ttl=300)
+lecturer_profile_ids = TTLCache("lecturer_profile_id", ttl=300)
+
+# Password hashing setup (passlib and python-jose are imported on first use to keep worker start-up fast)
+_pwd_context = None
+
+def get_pwd_context():
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
 
 # OAuth2 setup
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")  # Updated to match the new token URL
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    with BCRYPT_IN_PROGRESS.track():
+        return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    with BCRYPT_IN_PROGRESS.track():
+        return get_pwd_context().hash(password)
+
+def warm_password_hasher():
+    """
+    Load the bcrypt backend now instead of on the first login request
+    """
+    get_pwd_context().handler("bcrypt").get_backend()
 
 def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(User).filter(User.username == username).first()
+    user = db.query(User).filter(User.username == username, User.deleted_at.is_(None)).first()
     if not user:
         return False
     if not verify_password(password, user.hashed_password):
@@ -36,6 +55,7 @@ def authenticate_user(db: Session, username: str, password: str):
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    from jose import jwt
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -45,21 +65,28 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def decode_access_token(token: str) -> Optional[str]:
+    """
+    Return the username a valid, unexpired token was issued for, or None
+    """
+    from jose import JWTError, jwt
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return payload.get("sub")
+
 async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
+    username = decode_access_token(token)
+    if username is None:
         raise credentials_exception
-    user = db.query(User).filter(User.username == token_data.username).first()
+    token_data = TokenData(username=username)
+    user = db.query(User).filter(User.username == token_data.username, User.deleted_at.is_(None)).first()
     if user is None:
         raise credentials_exception
     return user
@@ -87,8 +114,7 @@ async def get_current_student(current_user: User = Depends(get_current_active_us
         )
     
     # Get the student profile
-    student_profile = db.query(StudentProfile).filter(StudentProfile.user_id == current_user.id).first()
-    if not student_profile:
+    if get_student_profile_id(db, current_user.id) is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Student profile not found. Please complete your profile setup."
@@ -96,6 +122,24 @@ async def get_current_student(current_user: User = Depends(get_current_active_us
     
     return current_user
 
+def get_student_profile_id(db: Session, user_id: int) -> Optional[int]:
+    """
+    Student profile id of a user (cached), or None if they have no profile
+    """
+    def load():
+        row = db.query(StudentProfile.id).filter(StudentProfile.user_id == user_id).first()
+        return row[0] if row else None
+    return student_profile_ids.get_or_load(user_id, load)
+
+def get_lecturer_profile_id(db: Session, user_id: int) -> Optional[int]:
+    """
+    Lecturer profile id of a user (cached), or None if they have no profile
+    """
+    def load():
+        row = db.query(LecturerProfile.id).filter(LecturerProfile.user_id == user_id).first()
+        return row[0] if row else None
+    return lecturer_profile_ids.get_or_load(user_id, load)
+
 # Function to check if user is admin
 async def get_current_admin(current_user: User = Depends(get_current_active_user)):
     if current_user.role != "admin":
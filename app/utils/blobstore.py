@@ -0,0 +1,418 @@
+"""
+Content-addressed blob store for uploaded files.
+
+Files are stored once under their SHA-256 (`ab/cd/abcd...`), whatever exam,
+payment slip or term they were uploaded for; the `blobs` table counts the
+rows that point at each blob. Uploading a file that is already stored only
+bumps its count. Blobs nobody references any more are removed by
+`collect_garbage` (see gc_blobs.py) after a grace period, so an upload that
+is still between storing and acquiring its blob is never collected.
+
+Whatever deletes or repoints a referencing row releases its blobs in the
+same transaction (`release_blob`, `release_blobs` for many rows). Rows
+removed by ON DELETE CASCADE can't do that themselves, so the collector
+first recounts every blob's references from BLOB_REFERENCES and corrects
+`ref_count`; a count can be wrong for a while, but never makes it delete a
+blob that is still referenced.
+
+BLOB_BACKEND selects local disk (BLOB_DIR) or an S3-compatible bucket
+(S3_BUCKET, plus S3_ENDPOINT_URL for MinIO); the S3 backend needs boto3.
+"""
+import base64
+import collections
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from fastapi import HTTPException, Request, UploadFile, status
+from sqlalchemy import bindparam, case, func, select, union_all, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from ..models.exams import Exam, ExamSubmission
+from ..models.files import Blob
+from ..models.finance import PaymentSubmission
+from ..models.users import AssignmentSubmission
+from .metrics import Counter, register
+from .uploads import MAX_UPLOAD_BYTES, StoredUpload, stream_body_to_temp, stream_to_temp
+
+logger = logging.getLogger("lms.blobstore")
+
+BLOB_BACKEND = os.getenv("BLOB_BACKEND", "local")
+BLOB_DIR = Path(os.getenv("BLOB_DIR", "blobs"))
+# Uploads are spooled here before they are stored; must be on the same filesystem as BLOB_DIR
+BLOB_TMP_DIR = Path(os.getenv("BLOB_TMP_DIR", str(BLOB_DIR / ".tmp")))
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # e.g. http://localhost:9000 for MinIO
+S3_PREFIX = os.getenv("S3_PREFIX", "blobs/")
+# Unreferenced blobs and stray temp files younger than this are left alone by the collector
+BLOB_GC_GRACE_SECONDS = float(os.getenv("BLOB_GC_GRACE_HOURS", "24")) * 3600
+
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Every column that points at a blob
+BLOB_REFERENCES = (
+    Exam.file_sha256,
+    ExamSubmission.submission_sha256,
+    AssignmentSubmission.submission_sha256,
+    PaymentSubmission.payment_slip_sha256,
+)
+
+BLOBS_STORED = register(Counter(
+    "lms_blobs_stored_total",
+    "Uploaded files by kind and whether their content was already stored",
+    ("kind", "result"),
+))
+
+def is_sha256(value: str) -> bool:
+    return bool(value) and SHA256_PATTERN.match(value) is not None
+
+def blob_key(sha256: str) -> str:
+    # Two levels of fan-out keep directories small: 65536 leaves
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+class LocalBlobBackend:
+    def __init__(self, root: Path = BLOB_DIR):
+        self.root = Path(root)
+
+    def path(self, sha256: str) -> Path:
+        return self.root / blob_key(sha256)
+
+    def exists(self, sha256: str) -> bool:
+        return self.path(sha256).exists()
+
+    def put(self, sha256: str, temp_path: Path, content_type: Optional[str] = None) -> bool:
+        """
+        Move a finished temp file into place. Returns False, and drops the temp
+        file, when the content is already stored.
+        """
+        destination = self.path(sha256)
+        if destination.exists():
+            # Refresh the mtime so a collector run can't delete it under the upload that just matched it
+            os.utime(destination)
+            os.unlink(temp_path)
+            return False
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(temp_path, destination)
+        return True
+
+    def delete(self, sha256: str):
+        try:
+            os.unlink(self.path(sha256))
+        except FileNotFoundError:
+            pass
+
+    def size(self, sha256: str) -> Optional[int]:
+        try:
+            return self.path(sha256).stat().st_size
+        except FileNotFoundError:
+            return None
+
+    def modified_at(self, sha256: str) -> Optional[float]:
+        try:
+            return self.path(sha256).stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def iter_blobs(self) -> Iterator[Tuple[str, float]]:
+        """
+        (sha256, mtime) of every stored blob.
+        """
+        for path in self.root.glob("??/??/*"):
+            if is_sha256(path.name):
+                yield path.name, path.stat().st_mtime
+
+    def record_slot(self, slot: str, sha256: str):
+        """
+        Note that the file of direct upload `slot` was PUT. The marker is a temp
+        file, so the collector removes it once the slot is long expired.
+        """
+        BLOB_TMP_DIR.mkdir(parents=True, exist_ok=True)
+        (BLOB_TMP_DIR / f".slot-{slot}").write_text(sha256)
+
+    def slot_received(self, slot: str, sha256: str) -> bool:
+        try:
+            return (BLOB_TMP_DIR / f".slot-{slot}").read_text() == sha256
+        except FileNotFoundError:
+            return False
+
+class S3BlobBackend:
+    def __init__(self, bucket: str = S3_BUCKET, endpoint_url: Optional[str] = S3_ENDPOINT_URL, prefix: str = S3_PREFIX):
+        try:
+            import boto3
+        except ImportError as e:
+            raise RuntimeError("BLOB_BACKEND=s3 requires boto3 (pip install boto3)") from e
+        if not bucket:
+            raise RuntimeError("BLOB_BACKEND=s3 requires S3_BUCKET")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def key(self, sha256: str) -> str:
+        return self.prefix + blob_key(sha256)
+
+    def _head(self, sha256: str):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(sha256))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def exists(self, sha256: str) -> bool:
+        return self._head(sha256) is not None
+
+    def put(self, sha256: str, temp_path: Path, content_type: Optional[str] = None) -> bool:
+        try:
+            if self.exists(sha256):
+                # Same reasoning as the local backend: a fresh copy resets LastModified for the collector
+                self.client.copy_object(
+                    Bucket=self.bucket,
+                    Key=self.key(sha256),
+                    CopySource={"Bucket": self.bucket, "Key": self.key(sha256)},
+                    MetadataDirective="REPLACE",
+                    ContentType=content_type or "application/octet-stream",
+                )
+                return False
+            extra_args = {"ContentType": content_type} if content_type else None
+            self.client.upload_file(str(temp_path), self.bucket, self.key(sha256), ExtraArgs=extra_args)
+            return True
+        finally:
+            os.unlink(temp_path)
+
+    def size(self, sha256: str) -> Optional[int]:
+        head = self._head(sha256)
+        return head["ContentLength"] if head else None
+
+    def presigned_put(self, sha256: str, content_type: str, expires_in: int, slot: str) -> Tuple[str, dict]:
+        """
+        (url, headers) for a client PUT straight to the bucket. The SHA-256 is
+        part of the signature, so the bucket rejects any other content. The
+        object is tagged with `slot`, so `slot_received` can tell that this
+        slot's PUT wrote it.
+        """
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        params = {
+            "Bucket": self.bucket,
+            "Key": self.key(sha256),
+            "ContentType": content_type,
+            "ChecksumSHA256": checksum,
+            "Metadata": {"slot": slot},
+        }
+        url = self.client.generate_presigned_url("put_object", Params=params, ExpiresIn=expires_in)
+        return url, {"Content-Type": content_type, "x-amz-checksum-sha256": checksum, "x-amz-meta-slot": slot}
+
+    def slot_received(self, slot: str, sha256: str) -> bool:
+        # A later upload of the same content replaces the tag; that slot's owner has to PUT again
+        head = self._head(sha256)
+        return head is not None and head.get("Metadata", {}).get("slot") == slot
+
+    def presigned_get(self, sha256: str, expires_in: int, content_type: str, content_disposition: Optional[str] = None) -> str:
+        params = {"Bucket": self.bucket, "Key": self.key(sha256), "ResponseContentType": content_type}
+        if content_disposition:
+            params["ResponseContentDisposition"] = content_disposition
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires_in)
+
+    def delete(self, sha256: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(sha256))
+
+    def modified_at(self, sha256: str) -> Optional[float]:
+        head = self._head(sha256)
+        return head["LastModified"].timestamp() if head else None
+
+    def iter_blobs(self) -> Iterator[Tuple[str, float]]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", []):
+                name = item["Key"].rsplit("/", 1)[-1]
+                if is_sha256(name):
+                    yield name, item["LastModified"].timestamp()
+
+_backend = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if BLOB_BACKEND == "s3":
+            _backend = S3BlobBackend()
+        elif BLOB_BACKEND == "local":
+            _backend = LocalBlobBackend()
+        else:
+            raise RuntimeError(f"Unknown BLOB_BACKEND {BLOB_BACKEND!r}")
+    return _backend
+
+async def _put_stored(stored: StoredUpload, kind: str, content_type: Optional[str], expected_sha256: Optional[str] = None):
+    backend = get_backend()
+    try:
+        if expected_sha256 is not None and stored.sha256 != expected_sha256:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Uploaded content does not match the announced SHA-256"
+            )
+        created = await run_in_threadpool(backend.put, stored.sha256, stored.path, content_type)
+    except BaseException:
+        if stored.path.exists():
+            os.unlink(stored.path)
+        raise
+    BLOBS_STORED.inc(kind, "new" if created else "duplicate")
+
+async def store_upload(upload: UploadFile, kind: str, max_bytes: int = MAX_UPLOAD_BYTES) -> StoredUpload:
+    """
+    Stream an upload into the blob store and return its size and SHA-256.
+    The caller still has to `acquire_blob` it in the transaction that references it.
+    """
+    stored = await stream_to_temp(upload, BLOB_TMP_DIR, kind, max_bytes)
+    await _put_stored(stored, kind, upload.content_type)
+    return stored
+
+async def store_body(request: Request, kind: str, expected_sha256: str, max_bytes: int, content_type: Optional[str] = None) -> StoredUpload:
+    """
+    Stream a raw request body into the blob store, refusing it unless it hashes to `expected_sha256`.
+    """
+    stored = await stream_body_to_temp(request, BLOB_TMP_DIR, kind, max_bytes)
+    await _put_stored(stored, kind, content_type, expected_sha256)
+    return stored
+
+def blob_url(sha256: str) -> str:
+    """
+    API path that downloads the blob (see routers/files.py).
+    """
+    return f"/files/{sha256}"
+
+def acquire_blob(db: Session, stored: StoredUpload, content_type: Optional[str] = None):
+    """
+    Count one more reference to a stored blob, creating its row on first use.
+    Doesn't commit: the count must change in the same transaction as the referencing row.
+    """
+    updated = db.query(Blob).filter(Blob.sha256 == stored.sha256).update(
+        {Blob.ref_count: Blob.ref_count + 1, Blob.updated_at: datetime.utcnow()},
+        synchronize_session=False,
+    )
+    if updated:
+        return
+    try:
+        with db.begin_nested():
+            db.add(Blob(sha256=stored.sha256, size=stored.size, content_type=content_type, ref_count=1))
+    except IntegrityError:
+        # Another request created the row first
+        db.query(Blob).filter(Blob.sha256 == stored.sha256).update(
+            {Blob.ref_count: Blob.ref_count + 1, Blob.updated_at: datetime.utcnow()},
+            synchronize_session=False,
+        )
+
+def release_blob(db: Session, sha256: Optional[str]):
+    """
+    Drop one reference. The blob itself stays until the collector runs. Doesn't commit.
+    """
+    if not sha256:
+        return
+    db.query(Blob).filter(Blob.sha256 == sha256, Blob.ref_count > 0).update(
+        {Blob.ref_count: Blob.ref_count - 1, Blob.updated_at: datetime.utcnow()},
+        synchronize_session=False,
+    )
+
+def blob_column(model):
+    """
+    The column of `model` that points at a blob, or None.
+    """
+    for column in BLOB_REFERENCES:
+        if column.class_ is model:
+            return column
+    return None
+
+def release_blobs(db: Session, column, *conditions):
+    """
+    Drop the references held by the rows matching `conditions` through
+    `column` (one of BLOB_REFERENCES), before those rows are deleted or
+    repointed. Doesn't commit.
+    """
+    counts = collections.Counter(db.scalars(select(column).where(column.isnot(None), *conditions)).all())
+    if not counts:
+        return
+    db.execute(
+        update(Blob.__table__)
+        .where(Blob.sha256 == bindparam("match_sha256"), Blob.ref_count > 0)
+        .values(
+            ref_count=case((Blob.ref_count > bindparam("released"), Blob.ref_count - bindparam("released")), else_=0),
+            updated_at=datetime.utcnow(),
+        ),
+        [{"match_sha256": sha256, "released": released} for sha256, released in counts.items()]
+    )
+
+def recount_references(db: Session, dry_run: bool = False) -> int:
+    """
+    Set every blob's `ref_count` to the number of rows in BLOB_REFERENCES
+    pointing at it. Returns how many counts were wrong. A count is only
+    replaced if it didn't change meanwhile, so a concurrent acquire or
+    release isn't lost.
+    """
+    references = union_all(*(select(column.label("sha256")).where(column.isnot(None)) for column in BLOB_REFERENCES)).subquery()
+    actual = dict(db.execute(select(references.c.sha256, func.count()).group_by(references.c.sha256)).all())
+    wrong = [
+        {"match_sha256": sha256, "seen": ref_count, "actual": actual.get(sha256, 0)}
+        for sha256, ref_count in db.execute(select(Blob.sha256, Blob.ref_count)).all()
+        if ref_count != actual.get(sha256, 0)
+    ]
+    if wrong and not dry_run:
+        # updated_at restarts the grace period of blobs whose count drops to 0 here
+        db.execute(
+            update(Blob.__table__)
+            .where(Blob.sha256 == bindparam("match_sha256"), Blob.ref_count == bindparam("seen"))
+            .values(ref_count=bindparam("actual"), updated_at=datetime.utcnow()),
+            wrong
+        )
+        db.commit()
+        logger.warning("Corrected the reference counts of %d blobs", len(wrong))
+    return len(wrong)
+
+def collect_garbage(db: Session, backend=None, grace_seconds: float = BLOB_GC_GRACE_SECONDS, dry_run: bool = False) -> dict:
+    """
+    Delete blobs that have had no references for `grace_seconds`, stored
+    objects that never got a row (uploads that failed after storing) and
+    stale temp files. Returns counts per category.
+    """
+    backend = backend or get_backend()
+    cutoff = time.time() - grace_seconds
+    cutoff_datetime = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    result = {"recounted": recount_references(db, dry_run), "unreferenced": 0, "orphaned": 0, "temp_files": 0, "bytes": 0}
+
+    unreferenced = db.query(Blob.sha256, Blob.size).filter(Blob.ref_count <= 0, Blob.updated_at < cutoff_datetime).all()
+    for sha256, size in unreferenced:
+        if dry_run:
+            result["unreferenced"] += 1
+            result["bytes"] += size
+            continue
+        # Conditional delete: a concurrent acquire wins over the collector
+        deleted = db.query(Blob).filter(Blob.sha256 == sha256, Blob.ref_count <= 0).delete(synchronize_session=False)
+        db.commit()
+        if not deleted:
+            continue
+        modified = backend.modified_at(sha256)
+        if modified is not None and modified < cutoff:
+            backend.delete(sha256)
+        result["unreferenced"] += 1
+        result["bytes"] += size
+
+    known = {sha256 for (sha256,) in db.query(Blob.sha256)}
+    for sha256, modified in backend.iter_blobs():
+        if sha256 in known or modified >= cutoff:
+            continue
+        if not dry_run:
+            backend.delete(sha256)
+        result["orphaned"] += 1
+
+    if BLOB_TMP_DIR.exists():
+        for path in BLOB_TMP_DIR.iterdir():
+            if path.stat().st_mtime < cutoff:
+                if not dry_run:
+                    path.unlink(missing_ok=True)
+                result["temp_files"] += 1
+
+    logger.info("Blob garbage collection%s: %s", " (dry run)" if dry_run else "", result)
+    return result
@@ -0,0 +1,120 @@
+"""
+Denormalized submission counters.
+
+Assignments (CourseMaterial), exams and payment announcements carry
+`submission_count` and `graded_count` (`verified_count` for payments), so
+lecturer pages can show "N submitted / M graded" without counting rows.
+The submit, grade and verify paths adjust them with `add_counts`, a
+relative `count = count + n` UPDATE in the same transaction as the
+submission change. Submissions removed by ON DELETE CASCADE (a deleted
+student, say) aren't subtracted, and a resubmission racing with grading can
+be miscounted, so `reconcile_counters` recounts in batches and repairs
+whatever drifted; run it periodically with `python reconcile_counters.py`.
+It only overwrites counters that still hold the values it read, so an
+`add_counts` committed while it recounts isn't lost; a row skipped that way
+is repaired on the next run.
+"""
+import logging
+from typing import Dict
+
+from sqlalchemy import bindparam, case, func, select, update
+from sqlalchemy.orm import Session
+
+from ..models.exams import Exam, ExamSubmission
+from ..models.finance import PaymentAnnouncement, PaymentSubmission
+from ..models.users import AssignmentSubmission, CourseMaterial
+
+logger = logging.getLogger("lms.counters")
+
+# parent model, submission foreign key, {counter column: condition (None counts every submission)}
+COUNTERS = (
+    (CourseMaterial, AssignmentSubmission.assignment_id, {
+        "submission_count": None,
+        "graded_count": AssignmentSubmission.status == "graded",
+    }),
+    (Exam, ExamSubmission.exam_id, {
+        "submission_count": None,
+        "graded_count": ExamSubmission.status == "graded",
+    }),
+    (PaymentAnnouncement, PaymentSubmission.announcement_id, {
+        "submission_count": None,
+        "verified_count": PaymentSubmission.status == "verified",
+    }),
+)
+
+def add_counts(db: Session, model, column: str, deltas: Dict[int, int]):
+    """
+    Add `deltas` (parent id -> change) to the `column` counter of `model`
+    rows with one executemany. The caller commits.
+    """
+    params = [{"match_id": parent_id, "delta": delta} for parent_id, delta in deltas.items() if delta]
+    if not params:
+        return
+    table = model.__table__
+    counter = table.c[column]
+    db.execute(
+        update(table).where(table.c.id == bindparam("match_id")).values({counter: counter + bindparam("delta")}),
+        params
+    )
+
+def status_change(previous: str, current: str, counted: str) -> int:
+    """
+    +1 when a submission moved into the `counted` status, -1 when it left it.
+    """
+    return (current == counted) - (previous == counted)
+
+def reconcile_counters(db: Session, batch_size: int = 1000) -> dict:
+    """
+    Recount the submissions of every assignment, exam and announcement and
+    fix counters that are off. Returns how many rows were repaired per table.
+    A counter is only replaced if it didn't change since it was read.
+    """
+    repaired = {}
+    for model, foreign_key, counters in COUNTERS:
+        table = model.__table__
+        columns = list(counters)
+        stmt = update(table).where(
+            table.c.id == bindparam("match_id"),
+            *(table.c[column] == bindparam(f"seen_{column}") for column in columns)
+        ).values(
+            {table.c[column]: bindparam(f"new_{column}") for column in columns}
+        )
+        aggregates = [
+            func.count() if condition is None else func.sum(case((condition, 1), else_=0))
+            for condition in counters.values()
+        ]
+        fixed = 0
+        last_id = 0
+        while True:
+            stored = db.execute(
+                select(table.c.id, *(table.c[column] for column in columns))
+                .where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+            ).all()
+            if not stored:
+                break
+            last_id = stored[-1][0]
+            actual = {
+                row[0]: tuple(int(value or 0) for value in row[1:])
+                for row in db.execute(
+                    select(foreign_key, *aggregates)
+                    .where(foreign_key.in_([row[0] for row in stored]))
+                    .group_by(foreign_key)
+                ).all()
+            }
+            params = []
+            for row in stored:
+                counts = actual.get(row[0], (0,) * len(columns))
+                if tuple(row[1:]) != counts:
+                    params.append({
+                        "match_id": row[0],
+                        **{f"seen_{column}": seen for column, seen in zip(columns, row[1:])},
+                        **{f"new_{column}": count for column, count in zip(columns, counts)},
+                    })
+            if params:
+                db.execute(stmt, params)
+            db.commit()
+            fixed += len(params)
+        repaired[table.name] = fixed
+        if fixed:
+            logger.warning("Repaired %d drifted submission counters in %s", fixed, table.name)
+    return repaired
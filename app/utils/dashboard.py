@@ -0,0 +1,224 @@
+"""
+Dashboards: everything a home screen shows, in one request.
+
+The student dashboard replaces the course, week, submission-status and
+finance calls a home screen used to make one by one. It is built with four
+set-based queries, whatever the number of courses: upcoming exams,
+outstanding assignments and payments, each outer-joined to the student's
+own submission, and the latest grades (assignments and exams, UNION ALL).
+
+Dashboards are cached per student for STUDENT_DASHBOARD_TTL seconds, long
+enough to absorb a burst of home-screen reloads. Each worker only hears of
+the changes it makes itself (`student_changed` for a student's own
+submissions and grades, `coursework_changed` for exams, assignments,
+courses and payment announcements), so a change made through another
+worker shows up only when the entry expires: the TTL is the staleness
+bound, which is why it is seconds rather than minutes.
+
+The lecturer dashboard summarizes each of the lecturer's courses: how
+many assignment and exam submissions wait for grading (counted per course
+with GROUP BY through the (status, assignment_id) and (status, exam_id)
+indexes), the latest submissions (ROW_NUMBER per course) and the exams
+coming up. It changes with every submission in the lecturer's courses, so
+instead of being invalidated it is only cached for LECTURER_DASHBOARD_TTL
+seconds.
+"""
+import os
+from datetime import datetime
+
+from sqlalchemy import and_, func, literal, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from ..models.exams import Exam, ExamSubmission
+from ..models.finance import PaymentAnnouncement, PaymentSubmission
+from ..models.users import AssignmentSubmission, Course, CourseMaterial, CourseWeek, MaterialType, StudentProfile, User
+from .cache import TTLCache
+
+STUDENT_DASHBOARD_TTL = int(os.getenv("STUDENT_DASHBOARD_TTL", "5"))
+LECTURER_DASHBOARD_TTL = int(os.getenv("LECTURER_DASHBOARD_TTL", "30"))
+# Entries per dashboard list
+DASHBOARD_ITEMS = 50
+RECENT_GRADES = 10
+# Per course on the lecturer dashboard
+LATEST_SUBMISSIONS = 5
+UPCOMING_EXAMS = 5
+
+# student profile id -> dashboard
+student_dashboards = TTLCache("student_dashboard", ttl=STUDENT_DASHBOARD_TTL)
+# lecturer profile id -> dashboard
+lecturer_dashboards = TTLCache("lecturer_dashboard", ttl=LECTURER_DASHBOARD_TTL)
+
+def student_changed(*student_ids: int):
+    """
+    Drop this worker's dashboards of students whose submissions or grades changed.
+    """
+    for student_id in student_ids:
+        student_dashboards.invalidate(student_id)
+
+def coursework_changed():
+    """
+    Drop every dashboard of this worker, after a change to exams, assignments, courses or payment announcements.
+    """
+    student_dashboards.clear()
+
+def _rows(db: Session, query) -> list:
+    return [dict(row._mapping) for row in db.execute(query)]
+
+def load_student_dashboard(db: Session, student_id: int) -> dict:
+    now = datetime.utcnow()
+    upcoming_exams = select(
+        Exam.id, Exam.title, Exam.course_name, Exam.due_date,
+        ExamSubmission.status.label("submission_status"),
+    ).outerjoin(
+        ExamSubmission, and_(ExamSubmission.exam_id == Exam.id, ExamSubmission.student_id == student_id)
+    ).where(
+        Exam.due_date >= now, Exam.status == "active"
+    ).order_by(Exam.due_date).limit(DASHBOARD_ITEMS)
+    
+    # Not submitted yet, or waiting for a grade
+    outstanding_assignments = select(
+        CourseMaterial.id, CourseMaterial.title,
+        Course.id.label("course_id"), Course.title.label("course_title"), CourseWeek.week_number,
+        AssignmentSubmission.status.label("submission_status"),
+    ).join(
+        CourseWeek, CourseWeek.id == CourseMaterial.week_id
+    ).join(
+        Course, Course.id == CourseWeek.course_id
+    ).outerjoin(
+        AssignmentSubmission,
+        and_(AssignmentSubmission.assignment_id == CourseMaterial.id, AssignmentSubmission.student_id == student_id)
+    ).where(
+        CourseMaterial.material_type == MaterialType.ASSIGNMENT,
+        Course.deleted_at.is_(None),
+        or_(AssignmentSubmission.id.is_(None), AssignmentSubmission.status != "graded")
+    ).order_by(Course.title, CourseWeek.week_number, CourseMaterial.id).limit(DASHBOARD_ITEMS)
+    
+    # Not paid yet, or not verified yet
+    pending_payments = select(
+        PaymentAnnouncement.id, PaymentAnnouncement.title, PaymentAnnouncement.amount, PaymentAnnouncement.due_date,
+        PaymentSubmission.status.label("submission_status"),
+    ).outerjoin(
+        PaymentSubmission,
+        and_(PaymentSubmission.announcement_id == PaymentAnnouncement.id, PaymentSubmission.student_id == student_id)
+    ).where(
+        or_(PaymentSubmission.id.is_(None), PaymentSubmission.status != "verified")
+    ).order_by(PaymentAnnouncement.due_date).limit(DASHBOARD_ITEMS)
+    
+    graded_assignments = select(
+        literal("assignment").label("kind"), CourseMaterial.id, CourseMaterial.title, Course.title.label("course_title"),
+        AssignmentSubmission.grade, AssignmentSubmission.score, AssignmentSubmission.feedback,
+        AssignmentSubmission.updated_at.label("graded_at"),
+    ).join(
+        CourseMaterial, CourseMaterial.id == AssignmentSubmission.assignment_id
+    ).join(
+        CourseWeek, CourseWeek.id == CourseMaterial.week_id
+    ).join(
+        Course, Course.id == CourseWeek.course_id
+    ).where(AssignmentSubmission.student_id == student_id, AssignmentSubmission.status == "graded")
+    graded_exams = select(
+        literal("exam").label("kind"), Exam.id, Exam.title, Exam.course_name.label("course_title"),
+        ExamSubmission.grade, ExamSubmission.score, ExamSubmission.feedback,
+        ExamSubmission.graded_at,
+    ).join(
+        Exam, Exam.id == ExamSubmission.exam_id
+    ).where(ExamSubmission.student_id == student_id, ExamSubmission.status == "graded")
+    grades = union_all(graded_assignments, graded_exams).subquery()
+    recent_grades = select(grades).order_by(grades.c.graded_at.desc()).limit(RECENT_GRADES)
+    
+    return {
+        "student_id": student_id,
+        "upcoming_exams": _rows(db, upcoming_exams),
+        "outstanding_assignments": _rows(db, outstanding_assignments),
+        "pending_payments": _rows(db, pending_payments),
+        "recent_grades": _rows(db, recent_grades),
+    }
+
+def load_lecturer_dashboard(db: Session, lecturer_profile_id: int) -> dict:
+    courses = {
+        row.id: {
+            "id": row.id,
+            "title": row.title,
+            "ungraded_assignment_submissions": 0,
+            "ungraded_exam_submissions": 0,
+            "latest_submissions": [],
+            "upcoming_exams": [],
+        }
+        for row in db.execute(
+            select(Course.id, Course.title).where(
+                Course.lecturer_id == lecturer_profile_id, Course.deleted_at.is_(None)
+            ).order_by(Course.title)
+        )
+    }
+    result = {"lecturer_id": lecturer_profile_id, "courses": list(courses.values())}
+    if not courses:
+        return result
+    course_ids = list(courses)
+    # Exams name their course by title
+    exam_course = and_(Course.title == Exam.course_name, Course.id.in_(course_ids))
+    
+    ungraded_assignments = select(CourseWeek.course_id, func.count()).select_from(AssignmentSubmission).join(
+        CourseMaterial, CourseMaterial.id == AssignmentSubmission.assignment_id
+    ).join(
+        CourseWeek, CourseWeek.id == CourseMaterial.week_id
+    ).where(
+        AssignmentSubmission.status == "submitted", CourseWeek.course_id.in_(course_ids)
+    ).group_by(CourseWeek.course_id)
+    for course_id, count in db.execute(ungraded_assignments):
+        courses[course_id]["ungraded_assignment_submissions"] = count
+    
+    ungraded_exams = select(Course.id, func.count()).select_from(ExamSubmission).join(
+        Exam, Exam.id == ExamSubmission.exam_id
+    ).join(
+        Course, exam_course
+    ).where(ExamSubmission.status == "submitted").group_by(Course.id)
+    for course_id, count in db.execute(ungraded_exams):
+        courses[course_id]["ungraded_exam_submissions"] = count
+    
+    assignment_submissions = select(
+        literal("assignment").label("kind"), AssignmentSubmission.id, CourseMaterial.id.label("item_id"),
+        CourseMaterial.title.label("item_title"), CourseWeek.course_id, AssignmentSubmission.student_id,
+        AssignmentSubmission.status, AssignmentSubmission.submitted_at,
+    ).join(
+        CourseMaterial, CourseMaterial.id == AssignmentSubmission.assignment_id
+    ).join(
+        CourseWeek, CourseWeek.id == CourseMaterial.week_id
+    ).where(CourseWeek.course_id.in_(course_ids))
+    exam_submissions = select(
+        literal("exam").label("kind"), ExamSubmission.id, Exam.id.label("item_id"),
+        Exam.title.label("item_title"), Course.id.label("course_id"), ExamSubmission.student_id,
+        ExamSubmission.status, ExamSubmission.submitted_at,
+    ).join(
+        Exam, Exam.id == ExamSubmission.exam_id
+    ).join(Course, exam_course)
+    submissions = union_all(assignment_submissions, exam_submissions).subquery()
+    ranked = select(
+        submissions,
+        func.row_number().over(
+            partition_by=submissions.c.course_id,
+            order_by=(submissions.c.submitted_at.desc(), submissions.c.id.desc())
+        ).label("position"),
+    ).subquery()
+    latest = select(
+        ranked.c.kind, ranked.c.id, ranked.c.item_id, ranked.c.item_title, ranked.c.course_id,
+        ranked.c.student_id, ranked.c.status, ranked.c.submitted_at,
+        StudentProfile.enrollment_number, User.first_name, User.last_name,
+    ).outerjoin(
+        StudentProfile, StudentProfile.id == ranked.c.student_id
+    ).outerjoin(
+        User, User.id == StudentProfile.user_id
+    ).where(ranked.c.position <= LATEST_SUBMISSIONS).order_by(ranked.c.course_id, ranked.c.position)
+    for row in _rows(db, latest):
+        courses[row.pop("course_id")]["latest_submissions"].append(row)
+    
+    upcoming = select(
+        Exam.id, Exam.title, Exam.due_date, Exam.submission_count, Exam.graded_count, Course.id.label("course_id"),
+    ).join(
+        Course, exam_course
+    ).where(
+        Exam.due_date >= datetime.utcnow(), Exam.status == "active"
+    ).order_by(Exam.due_date, Exam.id)
+    for row in _rows(db, upcoming):
+        exams = courses[row.pop("course_id")]["upcoming_exams"]
+        if len(exams) < UPCOMING_EXAMS:
+            exams.append(row)
+    return result
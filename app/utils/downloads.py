@@ -0,0 +1,149 @@
+"""
+Serving stored blobs.
+
+Blobs never change once written, so the SHA-256 is a strong ETag and
+responses can be cached for a year. Local files go out through Starlette's
+FileResponse, which hands the path to the server (`http.response.pathsend`)
+where supported; single byte ranges are answered with 206 for resumable
+downloads. With X_ACCEL_REDIRECT_PREFIX set, the app only checks access and
+nginx sends the file itself (sendfile, ranges and all). S3 blobs are
+redirected to a short-lived presigned URL.
+
+Content types come from the uploader, so every response carries
+`nosniff` and anything outside INLINE_CONTENT_TYPES is sent as an
+attachment: an uploaded HTML or SVG page must never render on our origin.
+"""
+import os
+from typing import Optional
+
+import anyio
+from fastapi import HTTPException, Request, status
+from starlette.responses import FileResponse, RedirectResponse, Response
+
+from .blobstore import LocalBlobBackend, blob_key, get_backend
+
+# e.g. "/_blobs/": nginx `location /_blobs/ { internal; alias /srv/lms/blobs/; }`
+X_ACCEL_REDIRECT_PREFIX = os.getenv("X_ACCEL_REDIRECT_PREFIX")
+BLOB_CACHE_CONTROL = os.getenv("BLOB_CACHE_CONTROL", "private, max-age=31536000, immutable")
+S3_DOWNLOAD_URL_TTL = int(os.getenv("S3_DOWNLOAD_URL_TTL", "300"))
+INLINE_CONTENT_TYPES = frozenset(
+    os.getenv("INLINE_CONTENT_TYPES", "application/pdf,image/png,image/jpeg,image/gif,image/webp,text/plain").split(",")
+)
+
+class RangeFileResponse(FileResponse):
+    """
+    206 response with bytes `start`..`end` (inclusive) of a file.
+    """
+
+    def __init__(self, path, start: int, end: int, stat_result: os.stat_result, **kwargs):
+        super().__init__(path, status_code=status.HTTP_206_PARTIAL_CONTENT, stat_result=stat_result, **kwargs)
+        self.start = start
+        self.end = end
+        self.headers["content-range"] = f"bytes {start}-{end}/{stat_result.st_size}"
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # File shrank under us; end the body rather than leave the client waiting
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+def parse_range(header: str, size: int):
+    """
+    (start, end) of a single `bytes=` range, None to send the whole file
+    (no range, several ranges or a unit we don't know), or raises 416.
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, _, last = ranges.strip().partition("-")
+    try:
+        if first == "":
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise ValueError
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+            end = min(end, size - 1)
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def content_disposition(content_type: str, filename: Optional[str] = None) -> Optional[str]:
+    """
+    Content-Disposition for a blob: attachment unless the type is safe to
+    show inline, None for an inline response without a filename.
+    """
+    inline = content_type.split(";", 1)[0].strip().lower() in INLINE_CONTENT_TYPES
+    if filename:
+        return f'{"inline" if inline else "attachment"}; filename="{filename}"'
+    return None if inline else "attachment"
+
+def blob_response(request: Request, sha256: str, content_type: Optional[str] = None, filename: Optional[str] = None) -> Response:
+    """
+    Response serving a stored blob, honouring If-None-Match, Range and If-Range.
+    """
+    etag = f'"{sha256}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": BLOB_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+        "X-Content-Type-Options": "nosniff",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    backend = get_backend()
+    media_type = content_type or "application/octet-stream"
+    disposition = content_disposition(media_type, filename)
+    if not isinstance(backend, LocalBlobBackend):
+        url = backend.presigned_get(sha256, S3_DOWNLOAD_URL_TTL, media_type, disposition)
+        return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT, headers={"X-Content-Type-Options": "nosniff"})
+    if disposition:
+        headers["Content-Disposition"] = disposition
+
+    path = backend.path(sha256)
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+
+    if X_ACCEL_REDIRECT_PREFIX:
+        headers["X-Accel-Redirect"] = X_ACCEL_REDIRECT_PREFIX + blob_key(sha256)
+        return Response(media_type=media_type, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        byte_range = parse_range(range_header, stat_result.st_size)
+        if byte_range is not None:
+            start, end = byte_range
+            return RangeFileResponse(path, start, end, stat_result, headers=headers, media_type=media_type)
+    return FileResponse(path, headers=headers, media_type=media_type, stat_result=stat_result)
@@ -0,0 +1,219 @@
+"""
+Course gradebook: one row per student, one group of columns per assignment
+and exam, and grade statistics per assignment and exam.
+
+The cells come from a single query (assignment and exam submissions of
+the course, UNION ALL, each outer-joined from its assignment or exam so
+items nobody has submitted still get columns) and are pivoted or grouped
+with pandas instead of per-row Python, so a gradebook is held in memory
+in full while it is sent. pandas, and pyarrow for Parquet, are imported
+on first use so they don't slow down worker start-up.
+
+Statistics are cached per course for GRADE_STATS_TTL seconds; grading
+clears the cache (see utils/grading.py), so a cached answer is at most
+that old only about new submissions, or grades written by another worker.
+"""
+import io
+import os
+from typing import Iterator, List
+
+from sqlalchemy import literal, select, union_all
+from sqlalchemy.orm import Session
+
+from ..models.exams import Exam, ExamSubmission
+from ..models.users import AssignmentSubmission, Course, CourseMaterial, CourseWeek, MaterialType, StudentProfile, User
+from .cache import TTLCache
+
+GRADEBOOK_FORMATS = ("json", "csv", "parquet")
+CELL_FIELDS = ("status", "grade", "submitted_at")
+STUDENT_COLUMNS = ["student_id", "enrollment_number", "first_name", "last_name"]
+# Rows encoded per response chunk for JSON and CSV. The frame itself is built in full
+# first; chunking only avoids holding the whole encoded document as well
+STREAM_CHUNK_ROWS = 1000
+GRADE_STATS_TTL = int(os.getenv("GRADE_STATS_TTL", "60"))
+# Scores are percentages for the histogram; anything above 100 lands in the last bucket
+HISTOGRAM_EDGES = list(range(0, 101, 10))
+
+# course id -> grade statistics
+grade_stats = TTLCache("grade_stats", ttl=GRADE_STATS_TTL)
+
+def _cells(course: Course):
+    assignments = select(
+        literal("assignment").label("kind"),
+        CourseMaterial.id.label("item_id"),
+        CourseMaterial.title.label("title"),
+        AssignmentSubmission.student_id,
+        AssignmentSubmission.status,
+        AssignmentSubmission.grade,
+        AssignmentSubmission.submitted_at,
+        AssignmentSubmission.score,
+    ).join(
+        CourseWeek, CourseWeek.id == CourseMaterial.week_id
+    ).outerjoin(
+        AssignmentSubmission, AssignmentSubmission.assignment_id == CourseMaterial.id
+    ).where(
+        CourseWeek.course_id == course.id,
+        CourseMaterial.material_type == MaterialType.ASSIGNMENT
+    )
+    exams = select(
+        literal("exam").label("kind"),
+        Exam.id.label("item_id"),
+        Exam.title.label("title"),
+        ExamSubmission.student_id,
+        ExamSubmission.status,
+        ExamSubmission.grade,
+        ExamSubmission.submitted_at,
+        ExamSubmission.score,
+    ).outerjoin(
+        ExamSubmission, ExamSubmission.exam_id == Exam.id
+    ).where(Exam.course_name == course.title)
+    cells = union_all(assignments, exams).subquery()
+    return select(
+        cells,
+        StudentProfile.enrollment_number,
+        User.first_name,
+        User.last_name,
+    ).outerjoin(
+        StudentProfile, StudentProfile.id == cells.c.student_id
+    ).outerjoin(
+        User, User.id == StudentProfile.user_id
+    )
+
+def _load_cells(db: Session, course: Course):
+    """
+    Return (items, submitted): the course's assignments and exams as dicts
+    (key, kind, id, title), and a DataFrame with one row per submission.
+    """
+    import pandas as pd
+
+    result = db.execute(_cells(course))
+    long = pd.DataFrame.from_records(result.all(), columns=list(result.keys()))
+    long["key"] = long["kind"] + ":" + long["item_id"].astype(str)
+
+    item_rows = long[["key", "kind", "item_id", "title"]].drop_duplicates().sort_values(["kind", "item_id"])
+    items = [
+        {"key": key, "kind": kind, "id": int(item_id), "title": title}
+        for key, kind, item_id, title in item_rows.itertuples(index=False)
+    ]
+    # Rows without a student only stand for an item nobody has submitted
+    submitted = long.dropna(subset=["student_id"])
+    submitted = submitted.assign(student_id=submitted["student_id"].astype("int64"))
+    return items, submitted
+
+def load_gradebook(db: Session, course: Course):
+    """
+    Return (items, frame): the gradebook's assignments and exams as dicts
+    (key, kind, id, title) in column order, and a DataFrame with the
+    student columns followed by "<key> status", "<key> grade" and
+    "<key> submitted_at" for each item.
+    """
+    import pandas as pd
+
+    items, submitted = _load_cells(db, course)
+    columns = [f"{item['key']} {field}" for item in items for field in CELL_FIELDS]
+    if submitted.empty:
+        return items, pd.DataFrame(columns=STUDENT_COLUMNS + columns)
+
+    # (student, item) is unique, see the submission tables' unique constraints
+    wide = submitted.pivot(index="student_id", columns="key", values=list(CELL_FIELDS))
+    wide.columns = [f"{key} {field}" for field, key in wide.columns]
+    wide = wide.reindex(columns=columns)
+
+    students = submitted.drop_duplicates("student_id").set_index("student_id")[STUDENT_COLUMNS[1:]]
+    frame = students.join(wide).sort_values(["enrollment_number", "last_name"]).reset_index()
+    return items, frame
+
+def grade_statistics(db: Session, course: Course) -> List[dict]:
+    """
+    Per assignment and exam: submission and grading counts, and the mean,
+    median, quartiles, 90th percentile, range and histogram of the scores.
+    """
+    import pandas as pd
+
+    items, submitted = _load_cells(db, course)
+    counts = submitted.groupby("key").size()
+    graded = submitted["status"].eq("graded").groupby(submitted["key"]).sum()
+
+    # A resubmission keeps the score of its earlier grade until it is graded again
+    scored = submitted[submitted["status"].eq("graded")].dropna(subset=["score"]).astype({"score": "float64"})
+    scores = scored.groupby("key")["score"]
+    summary = scores.agg(["count", "mean", "median", "min", "max"])
+    percentiles = scores.quantile([0.25, 0.75, 0.9]).unstack()
+    # Bucket i holds [10 i, 10 i + 10); 100 goes in the last one
+    bucket_width = HISTOGRAM_EDGES[1] - HISTOGRAM_EDGES[0]
+    bucket_count = len(HISTOGRAM_EDGES) - 1
+    buckets = (scored["score"].clip(HISTOGRAM_EDGES[0], HISTOGRAM_EDGES[-1]) // bucket_width).clip(upper=bucket_count - 1)
+    histogram = pd.crosstab(scored["key"], buckets.astype("int64")).reindex(columns=range(bucket_count), fill_value=0)
+
+    def number(table, key, column):
+        if key not in table.index or column not in table.columns:
+            return None
+        value = table.at[key, column]
+        return None if pd.isna(value) else float(value)
+
+    stats = []
+    for item in items:
+        key = item["key"]
+        submissions = int(counts.get(key, 0))
+        graded_count = int(graded.get(key, 0))
+        stats.append({
+            **item,
+            "submissions": submissions,
+            "graded": graded_count,
+            "progress": graded_count / submissions if submissions else None,
+            "scored": int(summary.at[key, "count"]) if key in summary.index else 0,
+            "mean": number(summary, key, "mean"),
+            "median": number(summary, key, "median"),
+            "p25": number(percentiles, key, 0.25),
+            "p75": number(percentiles, key, 0.75),
+            "p90": number(percentiles, key, 0.9),
+            "min": number(summary, key, "min"),
+            "max": number(summary, key, "max"),
+            "histogram": [
+                {"from": low, "to": high, "count": int(count)}
+                for low, high, count in zip(
+                    HISTOGRAM_EDGES,
+                    HISTOGRAM_EDGES[1:],
+                    histogram.loc[key] if key in histogram.index else [0] * bucket_count
+                )
+            ],
+        })
+    return stats
+
+def _chunks(frame) -> Iterator:
+    for start in range(0, len(frame), STREAM_CHUNK_ROWS):
+        yield frame.iloc[start:start + STREAM_CHUNK_ROWS]
+
+def stream_json(course: Course, items: List[dict], frame) -> Iterator[bytes]:
+    """
+    {"course_id", "items", "columns", "rows"}, with `rows` as arrays in `columns` order.
+    """
+    import json
+
+    head = {"course_id": course.id, "items": items, "columns": list(frame.columns)}
+    yield json.dumps(head)[:-1].encode() + b', "rows": ['
+    first = True
+    for chunk in _chunks(frame):
+        rows = chunk.to_json(orient="values", date_format="iso")[1:-1]
+        if rows:
+            yield (rows if first else "," + rows).encode()
+            first = False
+    yield b"]}"
+
+def stream_csv(frame) -> Iterator[bytes]:
+    header = True
+    for chunk in _chunks(frame):
+        yield chunk.to_csv(index=False, header=header, date_format="%Y-%m-%dT%H:%M:%S").encode()
+        header = False
+    if header:
+        yield frame.to_csv(index=False).encode()
+
+def to_parquet(frame) -> bytes:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)") from e
+    buffer = io.BytesIO()
+    # Empty columns have no type to infer; store them as strings
+    frame.astype({column: "string" for column in frame.columns if frame[column].isna().all()}).to_parquet(buffer, index=False)
+    return buffer.getvalue()
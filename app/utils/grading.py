@@ -0,0 +1,216 @@
+"""
+Grading many submissions in one request, and sharing the grading of one
+assignment or exam between several graders.
+
+A batch of grades is authorized with one SELECT of the ids and versions of
+the submissions the lecturer may grade, then written with one executemany
+UPDATE (`database.writes.update_many`) in a single transaction: either
+every grade in the request is saved or none is.
+
+Graders working through the same assignment claim the next ungraded
+submissions instead of paging through all of them. A claim is a lease:
+`claimed_by` and `claim_expires_at` are set for GRADING_CLAIM_TTL seconds,
+after which the submission can be claimed again if it is still ungraded.
+On MySQL 8 / MariaDB 10.6+ and PostgreSQL the candidates are picked with
+`SELECT ... FOR UPDATE SKIP LOCKED`, so concurrent claims never wait on or
+hand out the same rows. SQLite has no row locks (it serializes writers),
+so there the UPDATE re-checks that each row is still unclaimed and only
+the rows it actually changed are handed out.
+
+Grades are free-form strings; every write of a grade also stores its
+numeric `score` (`parse_score`) so statistics can be computed in the
+database, drops the cached statistics and dashboards, and updates the students' grade
+summaries (utils/transcript.py).
+"""
+import os
+import re
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import bindparam, case, or_, select, update
+from sqlalchemy.orm import Session
+
+from ..database.writes import update_many
+from .counters import add_counts
+from .dashboard import student_changed
+from .gradebook import grade_stats
+from .transcript import record_grade_changes
+
+GRADING_CLAIM_TTL = int(os.getenv("GRADING_CLAIM_TTL", "900"))
+MAX_CLAIM_BATCH = 50
+
+_NUMBER = r"[-+]?\d+(?:\.\d+)?"
+_FRACTION = re.compile(rf"^({_NUMBER})\s*/\s*({_NUMBER})$")
+_PERCENT = re.compile(rf"^({_NUMBER})\s*%?$")
+
+def parse_score(grade: Optional[str]) -> Optional[float]:
+    """
+    The numeric value of a grade: "85" and "85%" give 85.0, and a fraction
+    such as "17/20" gives the percentage (85.0). Letter grades and other
+    text give None.
+    """
+    if grade is None:
+        return None
+    grade = grade.strip()
+    match = _FRACTION.match(grade)
+    if match:
+        total = float(match.group(2))
+        return float(match.group(1)) / total * 100 if total else None
+    match = _PERCENT.match(grade)
+    return float(match.group(1)) if match else None
+
+def backfill_scores(db: Session, model, batch_size: int = 1000) -> int:
+    """
+    Set `score` from `grade` on every graded row of `model`, one batch (and
+    one executemany) at a time. Doesn't bump versions: the grade itself is
+    unchanged. Returns how many rows got a score.
+    """
+    table = model.__table__
+    stmt = update(table).where(table.c.id == bindparam("match_id")).values(score=bindparam("new_score"))
+    filled = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(model.id, model.grade).where(model.id > last_id, model.grade.isnot(None)).order_by(model.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return filled
+        last_id = rows[-1].id
+        params = [{"match_id": row.id, "new_score": parse_score(row.grade)} for row in rows]
+        db.execute(stmt, params)
+        db.commit()
+        filled += sum(param["new_score"] is not None for param in params)
+
+def _supports_skip_locked(dialect) -> bool:
+    if dialect.name == "postgresql":
+        return True
+    if dialect.name == "mysql":
+        version = dialect.server_version_info or (0,)
+        return version >= ((10, 6) if getattr(dialect, "is_mariadb", False) else (8, 0))
+    return False
+
+def claim_submissions(db: Session, model, parent_column, parent_id: int, grader_id: int, limit: int) -> Tuple[list, datetime]:
+    """
+    Claim up to `limit` ungraded `model` submissions whose `parent_column`
+    (assignment or exam) is `parent_id` for the grader. Returns the claimed
+    rows and when the claim expires.
+    """
+    # Whole seconds, as MySQL DATETIME stores them
+    now = datetime.utcnow().replace(microsecond=0)
+    expires_at = now + timedelta(seconds=GRADING_CLAIM_TTL)
+    claimable = [
+        model.status == "submitted",
+        parent_column == parent_id,
+        or_(model.claim_expires_at.is_(None), model.claim_expires_at < now),
+    ]
+    candidates = select(model.id).where(*claimable).order_by(model.id).limit(min(max(limit, 1), MAX_CLAIM_BATCH))
+    if _supports_skip_locked(db.get_bind().dialect):
+        ids = db.scalars(candidates.with_for_update(skip_locked=True)).all()
+    else:
+        ids = db.scalars(candidates).all()
+    if ids:
+        # Re-checking `claimable` makes this a compare-and-set where rows aren't locked
+        db.query(model).filter(model.id.in_(ids), *claimable).update(
+            {model.claimed_by: grader_id, model.claim_expires_at: expires_at}, synchronize_session=False
+        )
+    db.commit()
+    if not ids:
+        return [], expires_at
+    claimed = db.query(model).filter(model.id.in_(ids), model.claimed_by == grader_id).order_by(model.id).all()
+    return claimed, expires_at
+
+def release_claims(db: Session, model, parent_column, parent_id: int, grader_id: int) -> int:
+    """
+    Give back the grader's unfinished claims on an assignment or exam.
+    """
+    released = db.query(model).filter(
+        parent_column == parent_id,
+        model.claimed_by == grader_id,
+        model.status == "submitted"
+    ).update({model.claimed_by: None, model.claim_expires_at: None}, synchronize_session=False)
+    db.commit()
+    return released
+
+def apply_grades(db: Session, model, parent_column, parent_model, grades: List, owned, set_: dict) -> list:
+    """
+    Grade the `model` submissions named in `grades` (SubmissionGrade items).
+    `owned` restricts the submissions to those the lecturer may grade; `set_`
+    is applied to every graded row. The graded_count of each submission's
+    `parent_model` row (through `parent_column`) counts newly graded ones.
+    Returns the updated rows in request order.
+    """
+    ids = [grade.submission_id for grade in grades]
+    if not ids:
+        return []
+    if len(set(ids)) != len(ids):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Each submission can only be graded once per request"
+        )
+    
+    current = {
+        row.id: row
+        for row in db.execute(
+            select(
+                model.id, model.version, model.status, model.score, model.student_id, parent_column.label("parent_id")
+            ).where(model.id.in_(ids), owned)
+        ).all()
+    }
+    missing = [submission_id for submission_id in ids if submission_id not in current]
+    if missing:
+        existing = set(db.scalars(select(model.id).where(model.id.in_(missing))).all())
+        unknown = [submission_id for submission_id in missing if submission_id not in existing]
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Submissions not found: {unknown}"
+            )
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Not authorized to grade submissions: {missing}"
+        )
+    
+    stale = [grade.submission_id for grade in grades if grade.version is not None and grade.version != current[grade.submission_id].version]
+    if stale:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Submissions changed by someone else: {stale}; reload them and try again"
+        )
+    
+    rows = [
+        {
+            "id": grade.submission_id,
+            "grade": grade.grade,
+            "feedback": grade.feedback,
+            "score": parse_score(grade.grade),
+            "version": current[grade.submission_id].version,
+        }
+        for grade in grades
+    ]
+    # The score follows the grade, including to None for a grade that isn't a number
+    score = case((bindparam("new_grade").is_(None), model.__table__.c.score), else_=bindparam("new_score"))
+    matched = update_many(db, model, rows, ("grade", "feedback"), set_={**set_, "score": score})
+    if matched is not None and matched != len(rows):
+        # Some row changed between the SELECT and the UPDATE
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Submissions were changed while grading; reload them and try again"
+        )
+    # The versions matched, so these statuses are the ones that were replaced
+    newly_graded = Counter(row.parent_id for row in current.values() if row.status != "graded")
+    add_counts(db, parent_model, "graded_count", newly_graded)
+    changes = []
+    for row in rows:
+        before = current[row["id"]]
+        score = before.score if row["grade"] is None else row["score"]
+        changes.append((before.student_id, before.parent_id, (before.status, before.score), (set_.get("status", before.status), score)))
+    record_grade_changes(db, model, changes)
+    db.commit()
+    grade_stats.clear()
+    student_changed(*{row.student_id for row in current.values()})
+    
+    stored = {row.id: row for row in db.query(model).filter(model.id.in_(ids))}
+    return [stored[submission_id] for submission_id in ids]
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+from ..database.database import engine
+from .metrics import cache_hit, cache_miss
+
+logger = logging.getLogger("lms.health")
+
+# Readiness budgets
+POOL_SATURATION_LIMIT = float(os.getenv("READY_POOL_SATURATION", "0.9"))  # share of pool capacity checked out
+DB_LATENCY_BUDGET_MS = float(os.getenv("READY_DB_LATENCY_MS", "100"))
+LOOP_LAG_BUDGET_MS = float(os.getenv("READY_LOOP_LAG_MS", "200"))
+# Probe results are reused for this long, so health checks don't add DB load
+PROBE_TTL_SECONDS = float(os.getenv("READY_PROBE_TTL", "2"))
+LOOP_LAG_INTERVAL_SECONDS = 0.5
+
+def pool_stats():
+    """
+    Snapshot of the connection pool of this worker. Reads counters only, never touches the DB.
+    """
+    pool = engine.pool
+    size = pool.size() if hasattr(pool, "size") else 0
+    checked_out = pool.checkedout() if hasattr(pool, "checkedout") else 0
+    max_overflow = max(getattr(pool, "_max_overflow", 0), 0)
+    capacity = size + max_overflow
+    return {
+        "size": size,
+        "checked_out": checked_out,
+        "overflow": pool.overflow() if hasattr(pool, "overflow") else 0,
+        "capacity": capacity,
+        "saturation": round(checked_out / capacity, 3) if capacity else 0.0,
+    }
+
+class DatabaseProbe:
+    """
+    Round-trip latency of a `SELECT 1`, refreshed at most once per PROBE_TTL_SECONDS.
+    Concurrent health checks share the last result instead of queuing more
+    probes; only the first ones of a worker wait for the probe in flight.
+    """
+
+    def __init__(self):
+        self.latency_ms = None
+        self.error = None
+        self.checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _run(self):
+        started = time.perf_counter()
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        return (time.perf_counter() - started) * 1000
+
+    def _stale(self) -> bool:
+        return time.monotonic() - self.checked_at >= PROBE_TTL_SECONDS
+
+    async def result(self):
+        # Before the first result there is nothing to share, so callers wait for the probe in flight
+        if self._stale() and (not self._lock.locked() or self.checked_at == 0.0):
+            async with self._lock:
+                if self._stale():
+                    cache_miss("readiness_probe")
+                    try:
+                        self.latency_ms = await run_in_threadpool(self._run)
+                        self.error = None
+                    except Exception as e:
+                        self.latency_ms = None
+                        self.error = str(e)
+                        logger.warning("Database readiness probe failed: %s", e)
+                    self.checked_at = time.monotonic()
+                else:
+                    cache_hit("readiness_probe")
+        else:
+            cache_hit("readiness_probe")
+        return {"latency_ms": self.latency_ms, "error": self.error}
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up from a fixed sleep; a busy or
+    blocked loop shows up as lag long before requests start timing out.
+    """
+
+    def __init__(self):
+        self.lag_ms = 0.0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(LOOP_LAG_INTERVAL_SECONDS)
+            self.lag_ms = max((time.perf_counter() - started - LOOP_LAG_INTERVAL_SECONDS) * 1000, 0.0)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+database_probe = DatabaseProbe()
+loop_lag_monitor = LoopLagMonitor()
+
+async def readiness():
+    """
+    Returns (ready, checks). Pool saturation is checked first and needs no I/O,
+    so a saturated worker is reported unavailable without waiting on the DB.
+    """
+    pool = pool_stats()
+    checks = {"pool": pool, "loop_lag_ms": round(loop_lag_monitor.lag_ms, 1)}
+    if pool["saturation"] >= POOL_SATURATION_LIMIT:
+        checks["reason"] = "database pool saturated"
+        return False, checks
+    if loop_lag_monitor.lag_ms > LOOP_LAG_BUDGET_MS:
+        checks["reason"] = "event loop lagging"
+        return False, checks
+    database = await database_probe.result()
+    checks["database"] = database
+    if database["error"] is not None or database["latency_ms"] is None:
+        checks["reason"] = "database unreachable"
+        return False, checks
+    if database["latency_ms"] > DB_LATENCY_BUDGET_MS:
+        checks["reason"] = "database latency over budget"
+        return False, checks
+    return True, checks
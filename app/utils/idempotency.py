@@ -0,0 +1,308 @@
+"""
+Idempotency-Key handling for POST and PUT requests.
+
+A client that may retry a write sends a unique `Idempotency-Key` header.
+The first request with a given key (per user) runs normally and its
+response is stored in the idempotency_keys table for IDEMPOTENCY_TTL
+seconds; a retry with the same key gets that response back, marked
+`Idempotent-Replayed: true`, without running the handler again. Recently
+stored responses are also kept in this worker's memory, so replays usually
+skip the database too.
+
+A retry that arrives while the first request is still running gets 409,
+and reusing a key for a different request (method, path, query or raw
+body, all of it even when the handler didn't read it) gets 422. 5xx responses are not stored, so the client can retry them.
+Requests without a valid bearer token are passed through untouched.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+
+from ..database.database import SessionLocal
+from ..database.upsert import insert_ignore
+from ..models.idempotency import IdempotencyRecord
+from .auth import decode_access_token
+from .cache import TTLCache
+from .metrics import Counter, register
+
+logger = logging.getLogger("lms.idempotency")
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+IDEMPOTENT_METHODS = ("POST", "PUT")
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+# A request that holds its key longer than this is assumed dead (e.g. its worker was killed) and the key is freed
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+IDEMPOTENCY_MAX_RESPONSE_BYTES = int(os.getenv("IDEMPOTENCY_MAX_RESPONSE_BYTES", str(1024 * 1024)))
+IDEMPOTENCY_PURGE_INTERVAL = int(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "3600"))
+MAX_KEY_LENGTH = 255
+# Response headers replayed along with the body; the rest are set by the server again
+STORED_HEADERS = (b"content-type", b"location", b"etag")
+
+IDEMPOTENT_REQUESTS = register(Counter(
+    "lms_idempotent_requests_total",
+    "Requests with an Idempotency-Key by outcome",
+    ("result",),
+))
+
+# (username, key) -> stored response
+stored_responses = TTLCache("idempotency", ttl=min(IDEMPOTENCY_TTL, 300))
+
+def _header(scope, name: bytes) -> Optional[bytes]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value
+    return None
+
+def _snapshot(record: IdempotencyRecord) -> dict:
+    return {
+        "request_hash": record.request_hash,
+        "status_code": record.status_code,
+        "headers": json.loads(record.response_headers or "[]"),
+        "body": record.response_body or b"",
+        "created_at": record.created_at,
+        "expires_at": record.expires_at,
+    }
+
+def _claim(username: str, key: str, method: str, path: str) -> Optional[dict]:
+    """
+    Reserve the key for a new request. Returns None when this request owns
+    it now, otherwise the existing record (still running when its
+    status_code is None).
+    """
+    db = SessionLocal()
+    try:
+        for _ in range(2):
+            now = datetime.utcnow()
+            row = {
+                "username": username,
+                "key": key,
+                "method": method,
+                "path": path,
+                "created_at": now,
+                "expires_at": now + timedelta(seconds=IDEMPOTENCY_TTL),
+            }
+            inserted = insert_ignore(db, IdempotencyRecord, [row], ("username", "key"))
+            db.commit()
+            if inserted:
+                return None
+
+            record = db.query(IdempotencyRecord).filter(
+                IdempotencyRecord.username == username,
+                IdempotencyRecord.key == key
+            ).first()
+            if record is None:
+                continue
+            stale = record.status_code is None and record.created_at < now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+            if record.expires_at > now and not stale:
+                return _snapshot(record)
+            # Expired, or its request died: start over with this one
+            db.delete(record)
+            db.commit()
+        # Lost the key to a concurrent request twice in a row; report it as running
+        return {"status_code": None}
+    finally:
+        db.close()
+
+def _store(username: str, key: str, request_hash: str, status_code: int, headers: list, body: bytes):
+    db = SessionLocal()
+    try:
+        db.query(IdempotencyRecord).filter(
+            IdempotencyRecord.username == username,
+            IdempotencyRecord.key == key
+        ).update({
+            "request_hash": request_hash,
+            "status_code": status_code,
+            "response_headers": json.dumps(headers),
+            "response_body": body,
+        }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def _release(username: str, key: str):
+    db = SessionLocal()
+    try:
+        db.query(IdempotencyRecord).filter(
+            IdempotencyRecord.username == username,
+            IdempotencyRecord.key == key
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def purge_expired() -> int:
+    """
+    Delete expired records. Returns how many were removed.
+    """
+    db = SessionLocal()
+    try:
+        deleted = db.query(IdempotencyRecord).filter(
+            IdempotencyRecord.expires_at < datetime.utcnow()
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+async def _send_json(send, status_code: int, detail: str, extra_headers=()):
+    body = json.dumps({"detail": detail}).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *extra_headers]
+    await send({"type": "http.response.start", "status": status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+class IdempotencyMiddleware:
+    """
+    Stores and replays responses of POST/PUT requests that carry an
+    Idempotency-Key. Other requests only pay for the header check.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._last_purge = time.monotonic()
+        self._tasks = set()
+
+    def _fingerprint(self, scope):
+        digest = hashlib.sha256()
+        digest.update(f"{scope['method']}\n{scope['path']}\n".encode())
+        digest.update(scope["query_string"] + b"\n")
+        return digest
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        if now - self._last_purge < IDEMPOTENCY_PURGE_INTERVAL:
+            return
+        self._last_purge = now
+
+        async def purge():
+            try:
+                deleted = await run_in_threadpool(purge_expired)
+            except SQLAlchemyError as e:
+                logger.warning("Could not purge expired idempotency keys: %s", e)
+                return
+            if deleted:
+                logger.info("Purged %d expired idempotency keys", deleted)
+
+        task = asyncio.ensure_future(purge())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _replay(self, scope, receive, send, stored: dict):
+        # The body is read (and dropped) only to check that this is the same request
+        digest = self._fingerprint(scope)
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            digest.update(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        if digest.hexdigest() != stored["request_hash"]:
+            IDEMPOTENT_REQUESTS.inc("mismatch")
+            return await _send_json(send, 422, "Idempotency-Key was already used for a different request")
+
+        IDEMPOTENT_REQUESTS.inc("replayed")
+        body = stored["body"]
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in stored["headers"]]
+        headers += [(b"content-length", str(len(body)).encode()), (b"idempotent-replayed", b"true")]
+        await send({"type": "http.response.start", "status": stored["status_code"], "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in IDEMPOTENT_METHODS:
+            return await self.app(scope, receive, send)
+        raw_key = _header(scope, IDEMPOTENCY_HEADER)
+        if raw_key is None:
+            return await self.app(scope, receive, send)
+        authorization = _header(scope, b"authorization")
+        username = None
+        if authorization and authorization.lower().startswith(b"bearer "):
+            username = decode_access_token(authorization[7:].decode("latin-1"))
+        if username is None:
+            return await self.app(scope, receive, send)
+
+        key = raw_key.decode("latin-1").strip()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return await _send_json(send, 400, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+
+        cache_key = (username, key)
+        stored = stored_responses.get(cache_key)
+        if stored is None:
+            stored = await run_in_threadpool(_claim, username, key, scope["method"], scope["path"])
+            if stored is not None and stored["status_code"] is not None:
+                remaining = (stored["expires_at"] - datetime.utcnow()).total_seconds()
+                stored_responses.set(cache_key, stored, ttl=min(stored_responses.ttl, remaining))
+        if stored is not None:
+            if stored["status_code"] is None:
+                IDEMPOTENT_REQUESTS.inc("in_progress")
+                return await _send_json(
+                    send, 409, "A request with this Idempotency-Key is still being processed",
+                    extra_headers=[(b"retry-after", b"1")]
+                )
+            return await self._replay(scope, receive, send, stored)
+
+        # First request with this key: run it, hashing the body on the way in and keeping the response
+        digest = self._fingerprint(scope)
+        body_hashed = False
+        status_code = None
+        headers = []
+        chunks = []
+        size = 0
+
+        async def hashing_receive():
+            nonlocal body_hashed
+            message = await receive()
+            if message["type"] == "http.request":
+                digest.update(message.get("body", b""))
+                body_hashed = not message.get("more_body", False)
+            return message
+
+        async def recording_send(message):
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                # A handler that answers early (401, 404, ...) may not have read the whole
+                # body; hash the rest too, or a retry of the same request would get 422
+                while not body_hashed:
+                    if (await hashing_receive())["type"] == "http.disconnect":
+                        break
+                status_code = message["status"]
+                headers.extend(
+                    [name.decode("latin-1"), value.decode("latin-1")]
+                    for name, value in message.get("headers", []) if name.lower() in STORED_HEADERS
+                )
+            elif message["type"] == "http.response.body" and size <= IDEMPOTENCY_MAX_RESPONSE_BYTES:
+                body = message.get("body", b"")
+                size += len(body)
+                chunks.append(body)
+            await send(message)
+
+        try:
+            await self.app(scope, hashing_receive, recording_send)
+        except BaseException:
+            await run_in_threadpool(_release, username, key)
+            raise
+
+        if status_code is None or status_code >= 500 or size > IDEMPOTENCY_MAX_RESPONSE_BYTES or not body_hashed:
+            # Nothing worth replaying; free the key so a retry runs again
+            await run_in_threadpool(_release, username, key)
+            IDEMPOTENT_REQUESTS.inc("released")
+            return
+
+        body = b"".join(chunks)
+        request_hash = digest.hexdigest()
+        await run_in_threadpool(_store, username, key, request_hash, status_code, headers, body)
+        stored_responses.set(cache_key, {
+            "request_hash": request_hash,
+            "status_code": status_code,
+            "headers": headers,
+            "body": body,
+        })
+        IDEMPOTENT_REQUESTS.inc("stored")
+        self._maybe_purge()
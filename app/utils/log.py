@@ -0,0 +1,195 @@
+"""
+Structured request logging.
+
+Every log line is a JSON object carrying the request ID of the request that
+produced it. Records are put on a bounded in-memory queue and written to
+stdout by a background listener thread, so request handlers never block on
+the stream. One access line per request records route, status, latency,
+DB time and query count, sampled per route.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from ..database import instrumentation
+from .metrics import COLLECTORS, Gauge, register, route_template
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Share of requests that get an access log line; errors and slow requests are always logged
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+# Per-route overrides, e.g. "/api/health/ready=0,/courses/=0.1"
+LOG_SAMPLE_ROUTES = {
+    route.strip(): float(rate)
+    for route, _, rate in (item.partition("=") for item in os.getenv("LOG_SAMPLE_ROUTES", "").split(",") if "=" in item)
+}
+LOG_SLOW_REQUEST_MS = float(os.getenv("LOG_SLOW_REQUEST_MS", "1000"))
+REQUEST_ID_HEADER = b"x-request-id"
+
+access_logger = logging.getLogger("lms.access")
+
+LOG_RECORDS_DROPPED = register(Gauge(
+    "lms_log_records_dropped",
+    "Log records dropped because the log queue was full",
+))
+
+_request_id: ContextVar[Optional[str]] = ContextVar("lms_request_id", default=None)
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+# Attributes every LogRecord has; anything else was passed with `extra=` and goes into the JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        # Stamp the ID on the calling thread, before the record crosses to the listener thread
+        record.request_id = _request_id.get()
+        return True
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Never blocks the caller: when the queue is full the record is dropped and counted.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Merge args into the message now, while they still hold their values, and drop them;
+        # exc_info stays on the record for the listener's formatter
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+_listener = None
+_listener_pid = None
+_queue_handler = None
+
+def _collect_dropped():
+    if _queue_handler is not None:
+        LOG_RECORDS_DROPPED.set(_queue_handler.dropped)
+
+COLLECTORS.append(_collect_dropped)
+
+def setup_logging():
+    """
+    Route the `lms` loggers through a JSON queue handler. Safe to call again in
+    a forked worker: the listener thread doesn't survive fork, so it gets a new
+    queue and thread there.
+    """
+    global _listener, _listener_pid, _queue_handler
+    if _listener_pid == os.getpid():
+        return
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    logger = logging.getLogger("lms")
+    logger.handlers = [queue_handler]
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+    _queue_handler = queue_handler
+
+def shutdown_logging():
+    global _listener, _listener_pid
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+    _listener = None
+    _listener_pid = None
+
+def _sample_rate(template: str) -> float:
+    return LOG_SAMPLE_ROUTES.get(template, LOG_SAMPLE_RATE)
+
+class RequestLogMiddleware:
+    """
+    Assigns a request ID (taken from X-Request-ID when the client sends one),
+    echoes it on the response and writes one sampled access line per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for key, value in scope["headers"]:
+            if key == REQUEST_ID_HEADER:
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        _request_id.set(request_id)
+        stats = instrumentation.start_request()
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(REQUEST_ID_HEADER, request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            latency_ms = (time.perf_counter() - started) * 1000
+            template = route_template(scope)
+            rate = _sample_rate(template)
+            if status_code >= 500 or latency_ms >= LOG_SLOW_REQUEST_MS or random.random() < rate:
+                access_logger.info(
+                    "%s %s %s",
+                    scope["method"],
+                    template,
+                    status_code,
+                    extra={
+                        "method": scope["method"],
+                        "route": template,
+                        "path": scope["path"],
+                        "status": status_code,
+                        "latency_ms": round(latency_ms, 3),
+                        "db_ms": round(stats.db_time * 1000, 3),
+                        "query_count": stats.query_count,
+                    },
+                )
@@ -0,0 +1,281 @@
+"""
+Prometheus-compatible metrics for the LMS API.
+
+The collectors are plain dicts updated without locks: request metrics are
+recorded on the event loop thread only, so the hot path is a dict lookup,
+a bisect and a few additions. Collectors also updated from threadpool
+workers are created with `threadsafe=True` and take a short lock. Values are per worker process; Prometheus
+should scrape every worker (or sum over the `instance` label).
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from ..database import instrumentation
+
+# Request latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# Optional bearer token required to scrape /metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+class Counter:
+    """
+    Counters incremented from threadpool workers should pass `threadsafe=True`,
+    like gauges, so concurrent increments aren't lost.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), threadsafe=False):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock() if threadsafe else None
+
+    def inc(self, *labels, amount=1):
+        if self._lock is None:
+            self._values[labels] = self._values.get(labels, 0) + amount
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def label_sets(self):
+        return list(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in list(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Gauge:
+    """
+    Gauges updated from threadpool workers should pass `threadsafe=True`, so
+    increments and decrements take a short lock and can't drift.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), threadsafe=False):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock() if threadsafe else None
+
+    def inc(self, *labels, amount=1):
+        if self._lock is None:
+            self._values[labels] = self._values.get(labels, 0) + amount
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def track(self, *labels):
+        """
+        Context manager that counts the wrapped block as in progress.
+        """
+        return _GaugeTracker(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labels, value in list(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class _GaugeTracker:
+    __slots__ = ("gauge", "labels")
+
+    def __init__(self, gauge, labels):
+        self.gauge = gauge
+        self.labels = labels
+
+    def __enter__(self):
+        self.gauge.inc(*self.labels)
+
+    def __exit__(self, *exc_info):
+        self.gauge.dec(*self.labels)
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._values = {}
+
+    def observe(self, value, *labels):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values.setdefault(labels, [0] * (len(self.buckets) + 2))
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                label_text = _format_labels(self.labelnames, labels, ("le", bound))
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {series[-1]}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+# Registered metrics, in exposition order
+REGISTRY = []
+# Callables run at scrape time to refresh gauges that are cheap to read but not worth tracking live
+COLLECTORS = []
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+REQUEST_LATENCY = register(Histogram(
+    "lms_http_request_duration_seconds",
+    "HTTP request latency by route template and status",
+    ("method", "route", "status"),
+))
+REQUESTS_IN_FLIGHT = register(Gauge(
+    "lms_http_requests_in_flight",
+    "HTTP requests currently being served",
+))
+QUERIES_PER_REQUEST = register(Histogram(
+    "lms_db_queries_per_request",
+    "SQL statements executed per HTTP request",
+    ("route",),
+    buckets=QUERY_COUNT_BUCKETS,
+))
+DB_TIME = register(Counter(
+    "lms_db_time_seconds_total",
+    "Time spent in SQL statements by route template",
+    ("route",),
+))
+DB_POOL = register(Gauge(
+    "lms_db_pool_connections",
+    "Database pool connections by state",
+    ("state",),
+))
+BCRYPT_IN_PROGRESS = register(Gauge(
+    "lms_bcrypt_operations_in_progress",
+    "bcrypt hash/verify operations running in a worker thread",
+    threadsafe=True,
+))
+CACHE_REQUESTS = register(Counter(
+    "lms_cache_requests_total",
+    "Cache lookups by cache and result",
+    ("cache", "result"),
+    # TTLCache lookups run in threadpool workers too (sync dependencies and routes)
+    threadsafe=True,
+))
+CACHE_HIT_RATIO = register(Gauge(
+    "lms_cache_hit_ratio",
+    "Share of cache lookups that were hits since the worker started",
+    ("cache",),
+))
+
+def cache_hit(cache: str):
+    CACHE_REQUESTS.inc(cache, "hit")
+
+def cache_miss(cache: str):
+    CACHE_REQUESTS.inc(cache, "miss")
+
+def _collect_pool():
+    from .health import pool_stats
+    stats = pool_stats()
+    for state in ("size", "checked_out", "overflow", "capacity"):
+        DB_POOL.set(stats[state], state)
+
+def _collect_cache_ratios():
+    caches = {cache for cache, _ in CACHE_REQUESTS.label_sets()}
+    for cache in caches:
+        hits = CACHE_REQUESTS.value(cache, "hit")
+        total = hits + CACHE_REQUESTS.value(cache, "miss")
+        CACHE_HIT_RATIO.set(round(hits / total, 4) if total else 0.0, cache)
+
+COLLECTORS.extend([_collect_pool, _collect_cache_ratios])
+
+def render_metrics() -> str:
+    for collect in COLLECTORS:
+        collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class MetricsMiddleware:
+    """
+    Records latency, status and SQL activity of every HTTP request, labelled by
+    route template (e.g. `/exams/{exam_id}`) so label cardinality stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        # Plain attribute instead of a gauge update per request; published at scrape time
+        self.in_flight = 0
+        COLLECTORS.append(self._collect_in_flight)
+
+    def _collect_in_flight(self):
+        REQUESTS_IN_FLIGHT.set(self.in_flight)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        stats = instrumentation.start_request()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.in_flight -= 1
+            template = route_template(scope)
+            REQUEST_LATENCY.observe(time.perf_counter() - started, scope["method"], template, status_code)
+            QUERIES_PER_REQUEST.observe(stats.query_count, template)
+            if stats.db_time:
+                DB_TIME.inc(template, amount=stats.db_time)
+
+def route_template(scope) -> str:
+    """
+    Path template of the matched route, the raw path for plain Starlette routes
+    such as /openapi.json, or "unmatched" so 404 scans can't blow up label cardinality.
+    """
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "endpoint" in scope:
+        return scope["path"]
+    return "unmatched"
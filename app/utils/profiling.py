@@ -0,0 +1,224 @@
+"""
+On-demand statistical profiling of single requests.
+
+An admin adds `X-Profile: 1` (or `?_profile=1`) to a request; PROFILE_SAMPLE_RATE
+additionally profiles a random share of all requests in the background. The
+profiler samples the event-loop thread and the threadpool threads that ran the
+request's queries; other requests pay nothing. Those threads are shared,
+though: while the request awaits, the loop runs other requests' coroutines,
+and a threadpool thread may go on to serve another request, so under load a
+profile also contains some of their stacks. Profile on a quiet worker when
+that matters. Each profile is stored under PROFILE_DIR as folded stacks
+(`<id>.folded`, ready for flamegraph.pl or speedscope) plus a JSON file with
+the request details and its SQL timeline; only the newest PROFILE_MAX_FILES
+are kept.
+"""
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from urllib.parse import parse_qsl
+
+from starlette.concurrency import run_in_threadpool
+
+from ..database import instrumentation
+from ..database.database import SessionLocal
+from ..models.users import User, UserRole
+from .auth import decode_access_token
+from .metrics import route_template
+
+logger = logging.getLogger("lms.profiling")
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_QUERY_PARAM = "_profile"
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_MS", "2")) / 1000
+MAX_STACK_DEPTH = 128
+
+# Leaf functions of an event loop that is waiting for I/O rather than running request code
+IDLE_LOOP_FUNCTIONS = {"select", "poll", "epoll", "kqueue", "_run_once"}
+
+class StackSampler(threading.Thread):
+    """
+    Samples the current stack of the request's threads every PROFILE_INTERVAL_SECONDS
+    and counts identical stacks, which is all a flamegraph needs.
+    """
+
+    def __init__(self, loop_thread: int, stats: instrumentation.QueryStats):
+        super().__init__(name="lms-profiler", daemon=True)
+        self.loop_thread = loop_thread
+        self.stats = stats
+        self.samples = Counter()
+        self._halt = threading.Event()
+
+    def _fold(self, frame):
+        stack = []
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def run(self):
+        while not self._halt.wait(PROFILE_INTERVAL_SECONDS):
+            frames = sys._current_frames()
+            for thread_id in (self.loop_thread, *self.stats.threads):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                if thread_id == self.loop_thread and frame.f_code.co_name in IDLE_LOOP_FUNCTIONS:
+                    continue
+                label = "event-loop" if thread_id == self.loop_thread else "worker"
+                self.samples[";".join([label, *self._fold(frame)])] += 1
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+def _header(scope, name: bytes):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value
+    return None
+
+def _profile_requested(scope) -> bool:
+    if _header(scope, PROFILE_HEADER) is not None:
+        return True
+    query_string = scope["query_string"]
+    # Cheap check first; most requests have no such parameter
+    if PROFILE_QUERY_PARAM.encode() not in query_string:
+        return False
+    return (PROFILE_QUERY_PARAM, "1") in parse_qsl(query_string.decode("latin-1"))
+
+def _is_admin_token(authorization: bytes) -> bool:
+    if not authorization or not authorization.lower().startswith(b"bearer "):
+        return False
+    username = decode_access_token(authorization[7:].decode("latin-1"))
+    if username is None:
+        return False
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.username == username).first()
+        return user is not None and user.is_active and user.role == UserRole.ADMIN
+    finally:
+        db.close()
+
+def _write_profile(profile_id: str, folded: Counter, details: dict):
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(PROFILE_DIR / f"{profile_id}.folded", "w") as folded_file:
+        for stack, count in folded.most_common():
+            folded_file.write(f"{stack} {count}\n")
+    with open(PROFILE_DIR / f"{profile_id}.json", "w") as details_file:
+        json.dump(details, details_file, indent=2)
+    _prune_profiles()
+
+def _prune_profiles():
+    """
+    Delete all but the newest PROFILE_MAX_FILES profiles.
+    """
+    paths = sorted(PROFILE_DIR.glob("*.json"), key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in paths[PROFILE_MAX_FILES:]:
+        path.unlink(missing_ok=True)
+        path.with_suffix(".folded").unlink(missing_ok=True)
+
+def load_profile(profile_id: str):
+    """
+    Return a stored profile, or None. Profile ids are hex UUIDs, which also
+    keeps the lookup inside PROFILE_DIR.
+    """
+    try:
+        uuid.UUID(hex=profile_id)
+    except ValueError:
+        return None
+    details_path = PROFILE_DIR / f"{profile_id}.json"
+    if not details_path.exists():
+        return None
+    details = json.loads(details_path.read_text())
+    details["folded"] = (PROFILE_DIR / f"{profile_id}.folded").read_text()
+    return details
+
+def list_profiles(limit: int = 50):
+    paths = sorted(PROFILE_DIR.glob("*.json"), key=lambda path: path.stat().st_mtime, reverse=True)
+    profiles = []
+    for path in paths[:limit]:
+        details = json.loads(path.read_text())
+        details.pop("sql_timeline", None)
+        profiles.append(details)
+    return profiles
+
+class ProfilingMiddleware:
+    """
+    Profiles requests that ask for it (admins only) or that are picked by
+    PROFILE_SAMPLE_RATE. Unprofiled requests only pay for the trigger check.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def _should_profile(self, scope):
+        if _profile_requested(scope):
+            authorization = _header(scope, b"authorization")
+            if await run_in_threadpool(_is_admin_token, authorization):
+                return "requested"
+            return None
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        trigger = await self._should_profile(scope)
+        if trigger is None:
+            return await self.app(scope, receive, send)
+
+        profile_id = uuid.uuid4().hex
+        stats = instrumentation.start_request(record_timeline=True)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        sampler = StackSampler(threading.get_ident(), stats)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - started
+            sampler.stop()
+            details = {
+                "id": profile_id,
+                "trigger": trigger,
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": route_template(scope),
+                "status": status_code,
+                "duration_ms": round(duration * 1000, 3),
+                "samples": sum(sampler.samples.values()),
+                "interval_ms": PROFILE_INTERVAL_SECONDS * 1000,
+                "query_count": stats.query_count,
+                "db_time_ms": round(stats.db_time * 1000, 3),
+                "sql_timeline": [
+                    {"offset_ms": round(offset * 1000, 3), "duration_ms": round(query_time * 1000, 3), "statement": statement}
+                    for offset, query_time, statement in stats.timeline
+                ],
+                "created_at": time.time(),
+            }
+            try:
+                await run_in_threadpool(_write_profile, profile_id, sampler.samples, details)
+            except OSError as e:
+                logger.warning("Could not store profile %s: %s", profile_id, e)
@@ -0,0 +1,182 @@
+"""
+Deleting courses and user accounts.
+
+Foreign keys are declared ON DELETE CASCADE, so a course or user is removed
+with a single DELETE and the database takes the weeks, materials,
+submissions and profiles under it along. That is one transaction locking
+every dependent row, which is fine for ordinary records but not for a
+course with thousands of submissions. Above SOFT_DELETE_MIN_ROWS dependent
+rows the record is only marked `deleted_at`, which hides it at once, and
+`purge_deleted` removes its rows bottom-up in batches of PURGE_BATCH_SIZE
+with one commit per batch. Delete endpoints run the purger after their
+response is sent; `python purge_deleted.py` finishes anything an
+interrupted worker left behind.
+"""
+import logging
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from ..database.database import SessionLocal
+from ..models.exams import ExamSubmission
+from ..models.finance import PaymentSubmission
+from ..models.users import (
+    AssignmentSubmission, Course, CourseMaterial, CourseWeek, LecturerProfile, StudentProfile, User
+)
+from .blobstore import blob_column, release_blobs
+
+logger = logging.getLogger("lms.purge")
+
+SOFT_DELETE_MIN_ROWS = int(os.getenv("SOFT_DELETE_MIN_ROWS", "1000"))
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "500"))
+
+# One purge at a time per worker. A delete arriving meanwhile is left for the next run
+# (the next delete, or purge_deleted.py): the running one listed its ids at the start
+_purge_lock = threading.Lock()
+
+def _course_ids_of(user_id: int):
+    lecturer_profile_ids = select(LecturerProfile.id).where(LecturerProfile.user_id == user_id)
+    return select(Course.id).where(Course.lecturer_id.in_(lecturer_profile_ids))
+
+def _course_rows(course_ids):
+    """
+    (model, condition) for everything under the given courses, deepest first.
+    """
+    week_ids = select(CourseWeek.id).where(CourseWeek.course_id.in_(course_ids))
+    material_ids = select(CourseMaterial.id).where(CourseMaterial.week_id.in_(week_ids))
+    return [
+        (AssignmentSubmission, AssignmentSubmission.assignment_id.in_(material_ids)),
+        (CourseMaterial, CourseMaterial.week_id.in_(week_ids)),
+        (CourseWeek, CourseWeek.course_id.in_(course_ids)),
+    ]
+
+def _user_rows(user_id: int):
+    """
+    (model, condition) for everything owned by the user, deepest first.
+    """
+    course_ids = _course_ids_of(user_id)
+    student_profile_ids = select(StudentProfile.id).where(StudentProfile.user_id == user_id)
+    return [
+        (AssignmentSubmission, AssignmentSubmission.student_id.in_(student_profile_ids)),
+        (ExamSubmission, ExamSubmission.student_id.in_(student_profile_ids)),
+        (PaymentSubmission, PaymentSubmission.student_id.in_(student_profile_ids)),
+        *_course_rows(course_ids),
+        (Course, Course.id.in_(course_ids)),
+    ]
+
+def _count(db: Session, rows) -> int:
+    total = 0
+    for model, condition in rows:
+        total += db.query(func.count(model.id)).filter(condition).scalar()
+        if total >= SOFT_DELETE_MIN_ROWS:
+            break
+    return total
+
+def _release_files(db: Session, rows):
+    """
+    Release the uploaded files of the rows about to be deleted; the cascade can't.
+    """
+    for model, condition in rows:
+        column = blob_column(model)
+        if column is not None:
+            release_blobs(db, column, condition)
+
+def _delete_in_batches(db: Session, model, condition, batch_size: int) -> int:
+    deleted = 0
+    while True:
+        ids = db.scalars(select(model.id).where(condition).limit(batch_size)).all()
+        if not ids:
+            return deleted
+        _release_files(db, [(model, model.id.in_(ids))])
+        deleted += db.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+
+def remove_course(db: Session, course_id: int) -> bool:
+    """
+    Delete a course, or only mark it deleted when it is too large to delete
+    in one transaction. Returns True when `purge_deleted` has work to do.
+    """
+    rows = _course_rows([course_id])
+    if _count(db, rows) < SOFT_DELETE_MIN_ROWS:
+        _release_files(db, rows)
+        db.query(Course).filter(Course.id == course_id).delete(synchronize_session=False)
+        db.commit()
+        return False
+    db.query(Course).filter(Course.id == course_id).update(
+        {Course.deleted_at: datetime.utcnow()}, synchronize_session=False
+    )
+    db.commit()
+    return True
+
+def remove_user(db: Session, user_id: int) -> bool:
+    """
+    Delete a user with their profile, courses and submissions, or only
+    deactivate and mark them deleted when that is too many rows for one
+    transaction. Returns True when `purge_deleted` has work to do.
+    """
+    rows = _user_rows(user_id)
+    if _count(db, rows) < SOFT_DELETE_MIN_ROWS:
+        _release_files(db, rows)
+        db.query(User).filter(User.id == user_id).delete(synchronize_session=False)
+        db.commit()
+        return False
+    now = datetime.utcnow()
+    db.query(User).filter(User.id == user_id).update(
+        {User.deleted_at: now, User.is_active: False}, synchronize_session=False
+    )
+    # Hide a lecturer's courses along with them. MySQL can't UPDATE a table filtered by a
+    # subquery on the same table, so filter on the lecturer profile instead of _course_ids_of
+    lecturer_profile_ids = select(LecturerProfile.id).where(LecturerProfile.user_id == user_id)
+    db.query(Course).filter(Course.lecturer_id.in_(lecturer_profile_ids), Course.deleted_at.is_(None)).update(
+        {Course.deleted_at: now}, synchronize_session=False
+    )
+    db.commit()
+    return True
+
+def purge_course(db: Session, course_id: int, batch_size: int = PURGE_BATCH_SIZE) -> int:
+    deleted = 0
+    for model, condition in _course_rows([course_id]):
+        deleted += _delete_in_batches(db, model, condition, batch_size)
+    deleted += db.query(Course).filter(Course.id == course_id).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+def purge_user(db: Session, user_id: int, batch_size: int = PURGE_BATCH_SIZE) -> int:
+    deleted = 0
+    for model, condition in _user_rows(user_id):
+        deleted += _delete_in_batches(db, model, condition, batch_size)
+    # The profiles go with the user row
+    deleted += db.query(User).filter(User.id == user_id).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+def purge_deleted(batch_size: int = PURGE_BATCH_SIZE) -> dict:
+    """
+    Remove every course and user marked deleted, in batches. Returns how many
+    courses, users and rows were removed.
+    """
+    result = {"courses": 0, "users": 0, "rows": 0}
+    if not _purge_lock.acquire(blocking=False):
+        return result
+    db = SessionLocal()
+    try:
+        # Users first: purging a lecturer also removes their marked courses
+        for user_id in db.scalars(select(User.id).where(User.deleted_at.isnot(None))).all():
+            result["rows"] += purge_user(db, user_id, batch_size)
+            result["users"] += 1
+        for course_id in db.scalars(select(Course.id).where(Course.deleted_at.isnot(None))).all():
+            result["rows"] += purge_course(db, course_id, batch_size)
+            result["courses"] += 1
+    except Exception:
+        db.rollback()
+        logger.exception("Purging deleted records failed; it resumes on the next run")
+        raise
+    finally:
+        db.close()
+        _purge_lock.release()
+    if result["rows"]:
+        logger.info("Purged %d deleted users and %d deleted courses (%d rows)", result["users"], result["courses"], result["rows"])
+    return result
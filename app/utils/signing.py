@@ -0,0 +1,78 @@
+"""
+HMAC-signed, expiring download URLs and tokens for stored blobs.
+
+A signed URL carries everything needed to serve the file: the hash, the
+content type, an expiry and an HMAC-SHA256 over those. Verifying it needs
+the secret only, so downloads skip JWT decoding and the user lookup, and
+any proxy holding FILE_URL_SECRET can check them too. Upload slots use the
+same secret for compact signed tokens (see `sign_token`).
+"""
+import base64
+import hashlib
+import hmac
+import json
+import math
+import os
+import time
+from typing import Optional, Tuple
+from urllib.parse import urlencode
+
+from .auth import SECRET_KEY
+
+# Defaults to a key derived from the JWT secret, so the two can't be swapped for one another
+FILE_URL_SECRET = os.getenv("FILE_URL_SECRET", "").encode() or hmac.new(SECRET_KEY.encode(), b"lms-file-urls", hashlib.sha256).digest()
+FILE_URL_TTL = int(os.getenv("FILE_URL_TTL", "900"))
+# Expiries are rounded up to this step so repeated mints give the same URL, which keeps browser and proxy caches warm
+FILE_URL_EXPIRY_STEP = int(os.getenv("FILE_URL_EXPIRY_STEP", "300"))
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _signature(sha256: str, expires: int, content_type: str) -> str:
+    message = f"{sha256}\n{expires}\n{content_type}".encode()
+    return _b64encode(hmac.new(FILE_URL_SECRET, message, hashlib.sha256).digest())
+
+def sign_blob_url(sha256: str, content_type: Optional[str] = None, ttl: int = FILE_URL_TTL, now: Optional[float] = None) -> Tuple[str, int]:
+    """
+    Returns (url, expires) for a signed download of `sha256`, valid for at least `ttl` seconds.
+    """
+    content_type = content_type or "application/octet-stream"
+    now = time.time() if now is None else now
+    expires = int(math.ceil((now + ttl) / FILE_URL_EXPIRY_STEP) * FILE_URL_EXPIRY_STEP)
+    query = urlencode({"expires": expires, "type": content_type, "sig": _signature(sha256, expires, content_type)})
+    return f"/files/signed/{sha256}?{query}", expires
+
+def verify_blob_signature(sha256: str, expires: int, content_type: str, signature: str, now: Optional[float] = None) -> bool:
+    now = time.time() if now is None else now
+    if expires < now:
+        return False
+    return hmac.compare_digest(_signature(sha256, expires, content_type), signature)
+
+def sign_token(purpose: str, payload: dict, ttl: int) -> Tuple[str, int]:
+    """
+    Returns (token, expires): `payload` plus purpose and expiry, signed.
+    Tokens of one purpose are never accepted for another.
+    """
+    expires = int(time.time()) + ttl
+    body = _b64encode(json.dumps({**payload, "purpose": purpose, "exp": expires}, separators=(",", ":")).encode())
+    signature = _b64encode(hmac.new(FILE_URL_SECRET, body.encode(), hashlib.sha256).digest())
+    return f"{body}.{signature}", expires
+
+def verify_token(purpose: str, token: str) -> Optional[dict]:
+    """
+    The payload of a valid, unexpired token of `purpose`, or None.
+    """
+    body, _, signature = (token or "").partition(".")
+    expected = _b64encode(hmac.new(FILE_URL_SECRET, body.encode(), hashlib.sha256).digest())
+    if not signature or not hmac.compare_digest(expected, signature):
+        return None
+    try:
+        payload = json.loads(_b64decode(body))
+    except ValueError:
+        return None
+    if payload.get("purpose") != purpose or payload.get("exp", 0) < time.time():
+        return None
+    return payload
@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import importlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
+
+from .metrics import cache_hit, cache_miss
+
+logger = logging.getLogger("lms.startup")
+
+# Wall clock reference for the boot report; main.py resets it before its first import
+BOOT_STARTED = time.perf_counter()
+
+# Defer router imports and the bcrypt backend until the first request needs them
+LAZY_STARTUP = os.getenv("LAZY_STARTUP", "0") == "1"
+# Boot budget we want each worker to meet, from first import to first response
+BOOT_TARGET_MS = float(os.getenv("BOOT_TARGET_MS", "1500"))
+OPENAPI_CACHE_DIR = Path(os.getenv("OPENAPI_CACHE_DIR", ".cache"))
+
+# Paths that must answer before the routers are loaded
+EAGER_PATHS = {"/", "/api/health", "/api/health/live", "/api/health/ready", "/metrics"}
+
+APP_DIR = Path(__file__).resolve().parent.parent
+
+def mark_boot_started(started: float):
+    global BOOT_STARTED
+    BOOT_STARTED = started
+
+def elapsed_ms(since: float = None) -> float:
+    return (time.perf_counter() - (since or BOOT_STARTED)) * 1000
+
+class RouterRegistry:
+    """
+    Imports router modules and includes them in the app, timing each import
+    so the boot report can show where worker start-up goes.
+    """
+
+    def __init__(self, app: FastAPI, modules):
+        self.app = app
+        self.modules = list(modules)
+        self.timings = {}
+        self.registered = False
+        self._lock = asyncio.Lock()
+
+    def register(self):
+        if self.registered:
+            return
+        for name in self.modules:
+            started = time.perf_counter()
+            module = importlib.import_module(name)
+            self.app.include_router(module.router)
+            self.timings[name] = elapsed_ms(started)
+        # Routes changed, so any schema generated before now is stale
+        self.app.openapi_schema = None
+        self.registered = True
+
+    async def ensure_registered(self):
+        if self.registered:
+            return
+        async with self._lock:
+            if not self.registered:
+                await run_in_threadpool(self.register)
+
+class StartupMiddleware:
+    """
+    Loads lazily registered routers on the first request that needs them and
+    reports how long the worker took to serve its first response.
+    """
+
+    def __init__(self, app, registry: RouterRegistry):
+        self.app = app
+        self.registry = registry
+        self.first_response_ms = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if not self.registry.registered and scope["path"] not in EAGER_PATHS:
+            await self.registry.ensure_registered()
+        if self.first_response_ms is None:
+            await self.app(scope, receive, send)
+            if self.first_response_ms is None:
+                self.first_response_ms = elapsed_ms()
+                log = logger.info if self.first_response_ms <= BOOT_TARGET_MS else logger.warning
+                log("First response %.0f ms after boot (target %.0f ms)", self.first_response_ms, BOOT_TARGET_MS)
+            return
+        await self.app(scope, receive, send)
+
+def report_boot(registry: RouterRegistry, extra_timings: dict = None):
+    """
+    Log the import-time breakdown of the worker, slowest first, and whether
+    the worker came up within BOOT_TARGET_MS.
+    """
+    timings = dict(extra_timings or {})
+    timings.update(registry.timings)
+    total = elapsed_ms()
+    breakdown = ", ".join(
+        f"{name}={ms:.0f}ms" for name, ms in sorted(timings.items(), key=lambda item: item[1], reverse=True)
+    )
+    log = logger.info if total <= BOOT_TARGET_MS else logger.warning
+    log(
+        "Worker ready in %.0f ms (target %.0f ms, routers %s): %s",
+        total,
+        BOOT_TARGET_MS,
+        "registered" if registry.registered else "deferred",
+        breakdown or "no imports timed",
+    )
+    return total
+
+def _source_fingerprint(app: FastAPI) -> str:
+    # Any code change under app/ or to the app metadata invalidates the cached schema
+    digest = hashlib.sha1(f"{app.title}:{app.version}:{app.openapi_version}".encode())
+    for path in sorted(APP_DIR.rglob("*.py")):
+        stat = path.stat()
+        digest.update(f"{path.relative_to(APP_DIR)}:{stat.st_mtime_ns}:{stat.st_size}".encode())
+    digest.update(",".join(sorted(getattr(route, "path", "") for route in app.routes)).encode())
+    return digest.hexdigest()[:16]
+
+def install_openapi_cache(app: FastAPI, registry: RouterRegistry):
+    """
+    Serve the OpenAPI schema from a disk cache keyed by the source fingerprint,
+    so only the first worker after a deploy pays for generating it.
+    """
+    generate = app.openapi
+
+    def openapi():
+        if app.openapi_schema:
+            return app.openapi_schema
+        if not registry.registered:
+            registry.register()
+        cache_file = OPENAPI_CACHE_DIR / f"openapi-{_source_fingerprint(app)}.json"
+        try:
+            app.openapi_schema = json.loads(cache_file.read_text())
+            cache_hit("openapi")
+            return app.openapi_schema
+        except (OSError, ValueError):
+            cache_miss("openapi")
+        schema = generate()
+        try:
+            OPENAPI_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            temp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+            temp_file.write_text(json.dumps(schema))
+            os.replace(temp_file, cache_file)
+        except OSError as e:
+            logger.warning("Could not cache the OpenAPI schema: %s", e)
+        return schema
+
+    app.openapi = openapi
@@ -0,0 +1,254 @@
+"""
+Per-student grade summary, behind the transcript endpoint.
+
+A transcript covers every course a student has grades in; computed live it
+would join both submission tables through materials, weeks and courses.
+Instead `student_grade_summary` keeps one row per student and course with
+the number of graded assignments and exams and the count and total of
+their numeric scores, so a transcript is one indexed read. Every path that
+changes a submission's status or score passes the before and after states
+to `record_grade_changes` in the same transaction, after writing the
+submission, and the difference is added with one upsert. A decrement for a
+row that doesn't exist yet (a summary never backfilled) recomputes that
+row from the submissions instead of leaving negative totals. `rebuild_grade_summary` recomputes the table
+from the submissions (`python rebuild_grade_summary.py`) for backfill or
+after a bulk change made outside the API.
+
+Exams name their course by title; an exam whose title matches no course
+isn't summarized.
+"""
+from collections import defaultdict
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, insert, literal, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from ..database.upsert import upsert
+from ..models.exams import Exam, ExamSubmission
+from ..models.users import (
+    AssignmentSubmission, Course, CourseMaterial, CourseWeek, LecturerProfile, StudentGradeSummary, StudentProfile, User
+)
+
+SUMMARY_COLUMNS = ("assignments_graded", "exams_graded", "scored_count", "score_total")
+
+# (status, score) of a submission, or None before it exists
+State = Optional[Tuple[str, Optional[float]]]
+
+def _exam_course_id():
+    return select(func.min(Course.id)).where(
+        Course.title == Exam.course_name, Course.deleted_at.is_(None)
+    ).scalar_subquery()
+
+def _course_ids(db: Session, model, parent_ids) -> dict:
+    """
+    Assignment or exam id -> course id.
+    """
+    if model is AssignmentSubmission:
+        query = select(CourseMaterial.id, CourseWeek.course_id).join(
+            CourseWeek, CourseWeek.id == CourseMaterial.week_id
+        ).where(CourseMaterial.id.in_(parent_ids))
+    else:
+        query = select(Exam.id, _exam_course_id()).where(Exam.id.in_(parent_ids))
+    return dict(db.execute(query).all())
+
+def _contribution(state: State) -> Tuple[int, int, float]:
+    """
+    (graded, scored, score) that one submission adds to its summary row.
+    """
+    if state is None or state[0] != "graded":
+        return 0, 0, 0.0
+    score = state[1]
+    return 1, int(score is not None), score or 0.0
+
+def record_grade_changes(db: Session, model, changes: Iterable[Tuple[int, int, State, State]]):
+    """
+    Apply status and score changes of `model` (AssignmentSubmission or
+    ExamSubmission) submissions to the summary. `changes` holds
+    (student_id, assignment or exam id, before, after). Call it after the
+    submissions are written; the caller commits.
+    """
+    counter = "assignments_graded" if model is AssignmentSubmission else "exams_graded"
+    deltas = defaultdict(lambda: [0, 0, 0.0])
+    for student_id, parent_id, before, after in changes:
+        old, new = _contribution(before), _contribution(after)
+        if old == new:
+            continue
+        delta = deltas[(student_id, parent_id)]
+        for i in range(3):
+            delta[i] += new[i] - old[i]
+    if not deltas:
+        return
+    
+    courses = _course_ids(db, model, {parent_id for _, parent_id in deltas})
+    rows = {}
+    for (student_id, parent_id), (graded, scored, score) in deltas.items():
+        course_id = courses.get(parent_id)
+        if course_id is None:
+            continue
+        row = rows.setdefault((student_id, course_id), {
+            "student_id": student_id, "course_id": course_id, **{column: 0 for column in SUMMARY_COLUMNS}
+        })
+        row[counter] += graded
+        row["scored_count"] += scored
+        row["score_total"] += score
+    decrements = {key for key, row in rows.items() if any(row[column] < 0 for column in SUMMARY_COLUMNS)}
+    if decrements:
+        existing = {
+            tuple(key) for key in db.execute(
+                select(StudentGradeSummary.student_id, StudentGradeSummary.course_id).where(
+                    StudentGradeSummary.student_id.in_({key[0] for key in decrements}),
+                    StudentGradeSummary.course_id.in_({key[1] for key in decrements})
+                )
+            )
+        }
+        missing = decrements - existing
+        if missing:
+            recomputed = {
+                (row["student_id"], row["course_id"]): row
+                for row in _summaries(db, sorted({key[0] for key in missing}))
+            }
+            upsert(
+                db,
+                StudentGradeSummary,
+                [recomputed[key] for key in sorted(missing) if key in recomputed],
+                conflict_columns=("student_id", "course_id"),
+                update_columns=SUMMARY_COLUMNS,
+                set_={"updated_at": func.now()}
+            )
+            for key in missing:
+                del rows[key]
+    # Same key order in every transaction, so concurrent graders lock rows in the same order
+    upsert(
+        db,
+        StudentGradeSummary,
+        [rows[key] for key in sorted(rows)],
+        conflict_columns=("student_id", "course_id"),
+        update_columns=(),
+        add_columns=SUMMARY_COLUMNS,
+        set_={"updated_at": func.now()}
+    )
+
+def _summaries(db: Session, student_ids: List[int]) -> List[dict]:
+    assignments = select(
+        AssignmentSubmission.student_id,
+        CourseWeek.course_id.label("course_id"),
+        literal(1).label("assignment"),
+        literal(0).label("exam"),
+        AssignmentSubmission.score,
+    ).join(
+        CourseMaterial, CourseMaterial.id == AssignmentSubmission.assignment_id
+    ).join(
+        CourseWeek, CourseWeek.id == CourseMaterial.week_id
+    ).where(AssignmentSubmission.student_id.in_(student_ids), AssignmentSubmission.status == "graded")
+    exams = select(
+        ExamSubmission.student_id,
+        _exam_course_id().label("course_id"),
+        literal(0).label("assignment"),
+        literal(1).label("exam"),
+        ExamSubmission.score,
+    ).join(
+        Exam, Exam.id == ExamSubmission.exam_id
+    ).where(ExamSubmission.student_id.in_(student_ids), ExamSubmission.status == "graded")
+    graded = union_all(assignments, exams).subquery()
+    rows = db.execute(
+        select(
+            graded.c.student_id,
+            graded.c.course_id,
+            func.sum(graded.c.assignment),
+            func.sum(graded.c.exam),
+            func.count(graded.c.score),
+            func.coalesce(func.sum(graded.c.score), 0),
+        ).where(graded.c.course_id.isnot(None)).group_by(graded.c.student_id, graded.c.course_id)
+    ).all()
+    return [
+        {"student_id": row[0], "course_id": row[1], **dict(zip(SUMMARY_COLUMNS, (int(row[2]), int(row[3]), int(row[4]), float(row[5]))))}
+        for row in rows
+    ]
+
+def rebuild_grade_summary(db: Session, batch_size: int = 500) -> int:
+    """
+    Recompute the summary of every student from their submissions,
+    `batch_size` students per transaction. Returns how many rows were written.
+    Grades saved while a batch is being rebuilt may be overwritten by it, so
+    run this when little grading is going on, or run it again.
+    """
+    written = 0
+    last_id = 0
+    while True:
+        student_ids = db.scalars(
+            select(StudentProfile.id).where(StudentProfile.id > last_id).order_by(StudentProfile.id).limit(batch_size)
+        ).all()
+        if not student_ids:
+            return written
+        last_id = student_ids[-1]
+        rows = _summaries(db, student_ids)
+        db.query(StudentGradeSummary).filter(
+            StudentGradeSummary.student_id.in_(student_ids)
+        ).delete(synchronize_session=False)
+        if rows:
+            db.execute(insert(StudentGradeSummary), rows)
+        db.commit()
+        written += len(rows)
+
+def lectures_student(db: Session, lecturer_user_id: int, student_user_id: int) -> bool:
+    """
+    Whether the lecturer teaches a course the student has submitted work to.
+    """
+    courses = select(Course.id, Course.title).where(
+        Course.lecturer_id.in_(select(LecturerProfile.id).where(LecturerProfile.user_id == lecturer_user_id)),
+        Course.deleted_at.is_(None)
+    ).subquery()
+    student = select(StudentProfile.id).where(StudentProfile.user_id == student_user_id)
+    assignments = select(AssignmentSubmission.id).join(
+        CourseMaterial, CourseMaterial.id == AssignmentSubmission.assignment_id
+    ).join(
+        CourseWeek, CourseWeek.id == CourseMaterial.week_id
+    ).where(AssignmentSubmission.student_id.in_(student), CourseWeek.course_id.in_(select(courses.c.id)))
+    exams = select(ExamSubmission.id).join(
+        Exam, Exam.id == ExamSubmission.exam_id
+    ).where(ExamSubmission.student_id.in_(student), Exam.course_name.in_(select(courses.c.title)))
+    return bool(db.scalar(select(or_(assignments.exists(), exams.exists()))))
+
+def load_transcript(db: Session, user_id: int) -> Optional[dict]:
+    """
+    The transcript of the student with user id `user_id`, or None when they
+    have no student profile.
+    """
+    student = select(StudentProfile.id).join(User, User.id == StudentProfile.user_id).where(
+        StudentProfile.user_id == user_id, User.deleted_at.is_(None)
+    )
+    rows = db.execute(
+        select(StudentGradeSummary, Course.title).join(
+            Course, Course.id == StudentGradeSummary.course_id
+        ).where(
+            StudentGradeSummary.student_id.in_(student), Course.deleted_at.is_(None)
+        ).order_by(Course.title)
+    ).all()
+    if rows:
+        student_id = rows[0][0].student_id
+    else:
+        student_id = db.scalar(student)
+        if student_id is None:
+            return None
+    
+    def average(total, count):
+        return total / count if count else None
+    
+    return {
+        "student_id": student_id,
+        "courses": [
+            {
+                "course_id": summary.course_id,
+                "course_title": title,
+                "assignments_graded": summary.assignments_graded,
+                "exams_graded": summary.exams_graded,
+                "scored_count": summary.scored_count,
+                "average_score": average(summary.score_total, summary.scored_count),
+                "updated_at": summary.updated_at,
+            }
+            for summary, title in rows
+        ],
+        "average_score": average(
+            sum(summary.score_total for summary, _ in rows), sum(summary.scored_count for summary, _ in rows)
+        ),
+    }
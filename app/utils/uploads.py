@@ -0,0 +1,180 @@
+"""
+Streaming file uploads.
+
+Uploads are copied in UPLOAD_CHUNK_SIZE pieces: reading from the spooled
+upload and writing/hashing each chunk run in the threadpool, so the event
+loop stays free and a worker never holds a whole file in memory. The file is
+written to a temp file and only handed on (see blobstore) once it is
+complete and its SHA-256 is known, so readers never see a partial file.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import AsyncIterator
+
+from fastapi import HTTPException, Request, UploadFile, status
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+from .metrics import Counter, Histogram, register
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+# Request bodies larger than this are refused before they are parsed; leaves room for multipart framing
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(MAX_UPLOAD_BYTES + 1024 * 1024)))
+
+# Upload throughput buckets, in bytes per second
+THROUGHPUT_BUCKETS = (256e3, 1e6, 4e6, 16e6, 64e6, 256e6, 1e9)
+
+UPLOAD_BYTES = register(Counter(
+    "lms_upload_bytes_total",
+    "Bytes received through file uploads",
+    ("kind",),
+))
+UPLOADS = register(Counter(
+    "lms_uploads_total",
+    "File uploads by kind and result",
+    ("kind", "result"),
+))
+UPLOAD_THROUGHPUT = register(Histogram(
+    "lms_upload_throughput_bytes_per_second",
+    "Throughput of completed file uploads",
+    ("kind",),
+    buckets=THROUGHPUT_BUCKETS,
+))
+
+class StoredUpload:
+    __slots__ = ("path", "size", "sha256")
+
+    def __init__(self, path: Path, size: int, sha256: str):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+def _open_temp(directory: Path):
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".part")
+    return os.fdopen(fd, "wb"), temp_path
+
+def _write_chunk(file_object, hasher, chunk: bytes):
+    # hashlib releases the GIL for large buffers, so hashing overlaps with other requests
+    hasher.update(chunk)
+    file_object.write(chunk)
+
+def _finish(file_object):
+    file_object.flush()
+    os.fsync(file_object.fileno())
+    file_object.close()
+
+def _discard(file_object, temp_path: str):
+    file_object.close()
+    try:
+        os.unlink(temp_path)
+    except FileNotFoundError:
+        pass
+
+async def _upload_chunks(upload: UploadFile) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+async def _body_chunks(request: Request) -> AsyncIterator[bytes]:
+    # The server hands the body over in small pieces; batch them so each threadpool hop writes a full chunk
+    buffer = bytearray()
+    async for piece in request.stream():
+        buffer += piece
+        if len(buffer) >= UPLOAD_CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+async def _copy_to_temp(chunks: AsyncIterator[bytes], directory: Path, kind: str, max_bytes: int) -> StoredUpload:
+    started = time.perf_counter()
+    hasher = hashlib.sha256()
+    size = 0
+    file_object, temp_path = await run_in_threadpool(_open_temp, Path(directory))
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                UPLOADS.inc(kind, "too_large")
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"File exceeds the {max_bytes} byte upload limit"
+                )
+            await run_in_threadpool(_write_chunk, file_object, hasher, chunk)
+        await run_in_threadpool(_finish, file_object)
+    except BaseException:
+        await run_in_threadpool(_discard, file_object, temp_path)
+        raise
+
+    elapsed = time.perf_counter() - started
+    UPLOADS.inc(kind, "stored")
+    UPLOAD_BYTES.inc(kind, amount=size)
+    if elapsed > 0:
+        UPLOAD_THROUGHPUT.observe(size / elapsed, kind)
+    return StoredUpload(Path(temp_path), size, hasher.hexdigest())
+
+async def stream_to_temp(upload: UploadFile, directory: Path, kind: str, max_bytes: int = MAX_UPLOAD_BYTES) -> StoredUpload:
+    """
+    Stream `upload` to a new temp file in `directory`, hashing it on the way.
+    Raises 413 once more than `max_bytes` arrive; nothing is left on disk in
+    that case. The caller owns the returned temp file.
+    """
+    return await _copy_to_temp(_upload_chunks(upload), directory, kind, max_bytes)
+
+async def stream_body_to_temp(request: Request, directory: Path, kind: str, max_bytes: int = MAX_UPLOAD_BYTES) -> StoredUpload:
+    """
+    Same as `stream_to_temp`, for a raw (non-multipart) request body.
+    """
+    return await _copy_to_temp(_body_chunks(request), directory, kind, max_bytes)
+
+class RequestSizeLimitMiddleware:
+    """
+    Refuses request bodies over MAX_REQUEST_BYTES with 413: up front when
+    Content-Length says so, otherwise as soon as the streamed body goes over,
+    so an oversized upload is never spooled to disk in full.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_REQUEST_BYTES, exempt_prefixes: tuple = ()):
+        self.app = app
+        self.max_bytes = max_bytes
+        # Routes that enforce their own, larger limit (direct uploads)
+        self.exempt_prefixes = tuple(exempt_prefixes)
+
+    def _too_large(self):
+        return HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Request body exceeds {self.max_bytes} bytes"
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exempt_prefixes):
+            return await self.app(scope, receive, send)
+
+        for key, value in scope["headers"]:
+            if key == b"content-length":
+                if value.isdigit() and int(value) > self.max_bytes:
+                    error = self._too_large()
+                    response = JSONResponse(status_code=error.status_code, content={"detail": error.detail})
+                    return await response(scope, receive, send)
+                break
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside the app, so its exception handlers turn it into the 413 response
+                    raise self._too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
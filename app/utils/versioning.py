@@ -0,0 +1,77 @@
+"""
+Optimistic concurrency for update endpoints.
+
+Mutable models have a `version` column registered as the mapper's
+`version_id_col`, so SQLAlchemy writes every change as
+`UPDATE ... SET version = version + 1 WHERE id = ? AND version = ?` and
+raises StaleDataError when another request changed the row after it was
+read. No row locks are taken. The version is sent to clients as a strong
+ETag; a client that sends it back in If-Match only updates the row it last
+saw, and gets 409 with the current ETag otherwise. Handlers that write with
+`database.writes.update_row` pass `if_match_versions(...)` into the UPDATE's
+WHERE clause instead.
+"""
+from typing import List, Optional
+
+from fastapi import HTTPException, Response, status
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+def etag(obj) -> str:
+    version = obj["version"] if isinstance(obj, dict) else obj.version
+    return f'"{version}"'
+
+def set_etag(response: Response, obj):
+    response.headers["ETag"] = etag(obj)
+
+def _conflict(detail: str, current: Optional[str] = None) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=detail,
+        headers={"ETag": current} if current else None
+    )
+
+def if_match_versions(if_match: Optional[str]) -> Optional[List[int]]:
+    """
+    The versions an If-Match header allows, or None for any (no header or `*`).
+    """
+    if if_match is None:
+        return None
+    versions = []
+    for value in if_match.split(","):
+        value = value.strip()
+        if value == "*":
+            return None
+        try:
+            versions.append(int(value.strip('"')))
+        except ValueError:
+            # Not one of our ETags; it can't match any version
+            continue
+    return versions
+
+def raise_conflict(obj):
+    """
+    409 for an update whose If-Match no longer names the current version of `obj`.
+    """
+    raise _conflict("This record was changed by someone else; reload it and try again", etag(obj))
+
+def check_if_match(if_match: Optional[str], obj):
+    """
+    Raise 409 unless the If-Match header (if any) names the object's current version.
+    """
+    if if_match is None:
+        return
+    candidates = [value.strip() for value in if_match.split(",")]
+    current = etag(obj)
+    if "*" not in candidates and current not in candidates:
+        raise_conflict(obj)
+
+def commit_versioned(db: Session):
+    """
+    Commit, turning a lost race on a versioned row into 409.
+    """
+    try:
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise _conflict("This record was changed by someone else while you were saving; reload it and try again")
@@ -0,0 +1,25 @@
+import sys
+import os
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database.database import SessionLocal, create_tables
+from app.models.exams import ExamSubmission
+from app.models.users import AssignmentSubmission
+from app.utils.grading import backfill_scores
+
+# Fill the numeric score of submissions graded before scores were stored.
+# Safe to run again: it recomputes every score from its grade.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Set submission scores from their grades")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows updated per transaction")
+    args = parser.parse_args()
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        assignments = backfill_scores(db, AssignmentSubmission, args.batch_size)
+        exams = backfill_scores(db, ExamSubmission, args.batch_size)
+    finally:
+        db.close()
+    print(f"Scored {assignments} assignment submissions and {exams} exam submissions")
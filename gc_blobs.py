@@ -0,0 +1,28 @@
+import sys
+import os
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database.database import SessionLocal, create_tables
+from app.utils.blobstore import BLOB_GC_GRACE_SECONDS, collect_garbage
+
+# Remove stored files that no exam or payment submission refers to any more.
+# Run it periodically, e.g. from cron: python gc_blobs.py
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete unreferenced blobs from the file store")
+    parser.add_argument("--grace-hours", type=float, default=BLOB_GC_GRACE_SECONDS / 3600,
+                        help="keep blobs unreferenced for less than this long (default: BLOB_GC_GRACE_HOURS)")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be deleted")
+    args = parser.parse_args()
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        result = collect_garbage(db, grace_seconds=args.grace_hours * 3600, dry_run=args.dry_run)
+    finally:
+        db.close()
+    action = "Would delete" if args.dry_run else "Deleted"
+    if result["recounted"]:
+        print(f"{'Would correct' if args.dry_run else 'Corrected'} {result['recounted']} wrong reference counts")
+    print(f"{action} {result['unreferenced']} unreferenced blobs ({result['bytes']} bytes), "
+          f"{result['orphaned']} orphaned objects and {result['temp_files']} stale temp files")
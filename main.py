@@ -1,15 +1,75 @@
+import time
+
+BOOT_STARTED = time.perf_counter()
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.exc import SQLAlchemyError
+import logging
+import os
 import uvicorn
 
-from app.database.database import engine, Base
-from app.routers import users, auth, courses, course_weeks, course_materials, assignments, admin, exams, finance
+from app.utils import startup
+from app.database import instrumentation
+from app.database.database import engine, create_tables, reset_pool_after_fork, warm_pool
+from app.utils.auth import warm_password_hasher
+from app.utils.idempotency import IdempotencyMiddleware
+from app.utils.metrics import MetricsMiddleware
+from app.utils.profiling import ProfilingMiddleware
+from app.utils.uploads import RequestSizeLimitMiddleware
+from app.utils.log import RequestLogMiddleware, setup_logging, shutdown_logging
+from app.routers import health, metrics
+
+setup_logging()
+startup.mark_boot_started(BOOT_STARTED)
+CORE_IMPORTS_MS = startup.elapsed_ms()
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+# Create database tables on startup instead of at import (serve.py does it once before forking)
+CREATE_TABLES_ON_STARTUP = os.getenv("DB_CREATE_ALL", "1") == "1"
 
 app = FastAPI(title="LMS API", description="Learning Management System API")
 
+logger = logging.getLogger("lms")
+
+# Routers, in registration order
+ROUTER_MODULES = [
+    "app.routers.auth",
+    "app.routers.users",
+    "app.routers.courses",
+    "app.routers.course_weeks",
+    "app.routers.course_materials",
+    "app.routers.assignments",
+    "app.routers.admin",
+    "app.routers.exams",
+    "app.routers.finance",
+    "app.routers.files",
+    "app.routers.uploads",
+    "app.routers.me",
+]
+routers = startup.RouterRegistry(app, ROUTER_MODULES)
+
+# Health probes and metrics are always registered up front so they answer while other routers load
+app.include_router(health.router)
+app.include_router(metrics.router)
+
+# Include routers now, or on the first request in lazy start-up mode
+if not startup.LAZY_STARTUP:
+    routers.register()
+app.add_middleware(startup.StartupMiddleware, registry=routers)
+startup.install_openapi_cache(app, routers)
+
+# Count queries per request and record per-route latency
+instrumentation.install(engine)
+# Replay stored responses to retried POST/PUT requests that carry an Idempotency-Key
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(MetricsMiddleware)
+# Profile single requests on demand (admins only) or at PROFILE_SAMPLE_RATE
+app.add_middleware(ProfilingMiddleware)
+# Refuse oversized request bodies before they are spooled to disk; direct uploads check their own announced size
+app.add_middleware(RequestSizeLimitMiddleware, exempt_prefixes=("/uploads/blobs/",))
+# JSON access log with request IDs, written off the request path
+app.add_middleware(RequestLogMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -19,16 +79,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Include routers
-app.include_router(auth.router)
-app.include_router(users.router)
-app.include_router(courses.router)
-app.include_router(course_weeks.router)
-app.include_router(course_materials.router)
-app.include_router(assignments.router)
-app.include_router(admin.router)
-app.include_router(exams.router)
-app.include_router(finance.router)
+# Warm each worker before it starts accepting connections
+@app.on_event("startup")
+def warm_worker():
+    # Connections and the log thread of a preloading master don't carry over to forked workers
+    setup_logging()
+    reset_pool_after_fork()
+    try:
+        if CREATE_TABLES_ON_STARTUP:
+            create_tables()
+        warm_pool()
+    except SQLAlchemyError as e:
+        logger.warning("Could not warm the database pool: %s", e)
+    if not startup.LAZY_STARTUP:
+        warm_password_hasher()
+    startup.report_boot(routers, {"core imports": CORE_IMPORTS_MS})
+
+@app.on_event("shutdown")
+def flush_logs():
+    shutdown_logging()
 
 @app.get("/")
 async def root():
@@ -39,4 +108,4 @@ async def health_check():
     return {"status": "healthy"}
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,19 @@
+import sys
+import os
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database.database import create_tables
+from app.utils.purge import PURGE_BATCH_SIZE, purge_deleted
+
+# Finish removing courses and users that were too large to delete in one request.
+# Delete endpoints start this themselves; run it from cron to catch up after restarts: python purge_deleted.py
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Purge soft-deleted courses and users in batches")
+    parser.add_argument("--batch-size", type=int, default=PURGE_BATCH_SIZE,
+                        help="rows deleted per transaction (default: PURGE_BATCH_SIZE)")
+    args = parser.parse_args()
+
+    create_tables()
+    result = purge_deleted(batch_size=args.batch_size)
+    print(f"Purged {result['users']} users and {result['courses']} courses ({result['rows']} rows)")
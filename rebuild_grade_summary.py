@@ -0,0 +1,22 @@
+import sys
+import os
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database.database import SessionLocal, create_tables
+from app.utils.transcript import rebuild_grade_summary
+
+# Recompute the per-student grade summary behind the transcript endpoint from the submissions.
+# Run it once after upgrading, and after changing grades directly in the database.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the student grade summary table")
+    parser.add_argument("--batch-size", type=int, default=500, help="students rebuilt per transaction")
+    args = parser.parse_args()
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        written = rebuild_grade_summary(db, batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(f"Wrote {written} grade summary rows")
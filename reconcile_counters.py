@@ -0,0 +1,22 @@
+import sys
+import os
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database.database import SessionLocal, create_tables
+from app.utils.counters import reconcile_counters
+
+# Recount submissions and fix drifted submission/graded/verified counters.
+# Run it periodically, e.g. nightly from cron: python reconcile_counters.py
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Repair denormalized submission counters")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows checked per transaction")
+    args = parser.parse_args()
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        repaired = reconcile_counters(db, batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(", ".join(f"{table}: {count} repaired" for table, count in repaired.items()))
@@ -0,0 +1,99 @@
+"""
+Production entry point for the LMS API.
+
+    python serve.py
+
+Runs gunicorn with uvicorn workers and a preloaded app when gunicorn is
+installed, otherwise falls back to uvicorn's own multi-process supervisor.
+Every setting can be overridden with an environment variable of the same name.
+"""
+import importlib.util
+import os
+
+import uvicorn
+
+def _cpu_count():
+    # Respect container CPU affinity where the platform exposes it
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def _installed(module):
+    return importlib.util.find_spec(module) is not None
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+WORKERS = int(os.getenv("WORKERS", str(_cpu_count())))
+
+# Keep idle connections open longer than the load balancer does, so it never
+# reuses a socket we are about to close
+KEEPALIVE = int(os.getenv("KEEPALIVE", "65"))
+BACKLOG = int(os.getenv("BACKLOG", "2048"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+WORKER_TIMEOUT = int(os.getenv("WORKER_TIMEOUT", "60"))
+# Recycle workers now and then to cap slow memory growth; jitter avoids restarting them all at once
+MAX_REQUESTS = int(os.getenv("MAX_REQUESTS", "10000"))
+MAX_REQUESTS_JITTER = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+
+LOOP = "uvloop" if _installed("uvloop") else "asyncio"
+HTTP = "httptools" if _installed("httptools") else "h11"
+
+def run_gunicorn():
+    from gunicorn.app.base import BaseApplication
+    from uvicorn.workers import UvicornWorker
+
+    class LMSWorker(UvicornWorker):
+        CONFIG_KWARGS = {
+            "loop": LOOP,
+            "http": HTTP,
+            "timeout_graceful_shutdown": GRACEFUL_TIMEOUT,
+        }
+
+    class LMSApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{HOST}:{PORT}")
+            self.cfg.set("workers", WORKERS)
+            self.cfg.set("worker_class", LMSWorker)
+            # Import the app once in the master so workers fork with it already loaded
+            self.cfg.set("preload_app", True)
+            self.cfg.set("keepalive", KEEPALIVE)
+            self.cfg.set("backlog", BACKLOG)
+            self.cfg.set("graceful_timeout", GRACEFUL_TIMEOUT)
+            self.cfg.set("timeout", WORKER_TIMEOUT)
+            self.cfg.set("max_requests", MAX_REQUESTS)
+            self.cfg.set("max_requests_jitter", MAX_REQUESTS_JITTER)
+
+        def load(self):
+            from main import app
+            return app
+
+    LMSApplication().run()
+
+def run_uvicorn():
+    # uvicorn spawns its workers, so the app is imported in each of them instead of preloaded
+    uvicorn.run(
+        "main:app",
+        host=HOST,
+        port=PORT,
+        workers=WORKERS,
+        loop=LOOP,
+        http=HTTP,
+        backlog=BACKLOG,
+        timeout_keep_alive=KEEPALIVE,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        proxy_headers=True,
+    )
+
+def prepare_database():
+    # Create tables once here so the workers can skip it at start-up
+    from app.database.database import create_tables
+    create_tables()
+    os.environ["DB_CREATE_ALL"] = "0"
+
+if __name__ == "__main__":
+    prepare_database()
+    print(f"Starting LMS API on {HOST}:{PORT} with {WORKERS} workers (loop={LOOP}, http={HTTP})")
+    if _installed("gunicorn"):
+        run_gunicorn()
+    else:
+        run_uvicorn()
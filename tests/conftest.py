@@ -0,0 +1,80 @@
+"""
+Shared fixtures: the app on a throwaway SQLite database, with files and
+caches under a temporary directory, and a lecturer and two students.
+"""
+import os
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+WORK_DIR = tempfile.mkdtemp(prefix="lms-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(WORK_DIR, "lms.db")
+os.environ["BLOB_DIR"] = os.path.join(WORK_DIR, "blobs")
+os.environ["PROFILE_DIR"] = os.path.join(WORK_DIR, "profiles")
+os.environ["OPENAPI_CACHE_DIR"] = os.path.join(WORK_DIR, ".cache")
+# Small limits, so size checks and chunking are exercised with small files
+os.environ["MAX_UPLOAD_BYTES"] = str(64 * 1024)
+os.environ["MAX_REQUEST_BYTES"] = str(128 * 1024)
+os.environ["UPLOAD_CHUNK_SIZE"] = str(16 * 1024)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+from app.database.database import SessionLocal  # noqa: E402
+
+# Anything comfortably in the future, so submissions are on time
+DUE_DATE = (datetime.utcnow() + timedelta(days=365)).isoformat()
+
+def _register(client, role: str) -> dict:
+    name = f"{role}-{uuid.uuid4().hex[:8]}"
+    profile = {"lecturer_profile": {}} if role == "lecturer" else {"student_profile": {}}
+    response = client.post("/users/", json={
+        "email": f"{name}@example.com", "username": name, "role": role, "password": "secret", **profile
+    })
+    assert response.status_code == 201, response.text
+    token = client.post("/token", data={"username": name, "password": "secret"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+@pytest.fixture(scope="session")
+def lecturer(client):
+    return _register(client, "lecturer")
+
+@pytest.fixture(scope="session")
+def student(client):
+    return _register(client, "student")
+
+@pytest.fixture(scope="session")
+def other_student(client):
+    return _register(client, "student")
+
+@pytest.fixture
+def db(client):
+    # The tables are created when the app starts
+    session = SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture
+def course(client, lecturer):
+    """
+    A new course of the lecturer with one week, one assignment and one exam.
+    """
+    title = f"Course {uuid.uuid4().hex[:8]}"
+    course = client.post("/courses/", json={"title": title, "description": "d"}, headers=lecturer).json()
+    week = client.post("/course-weeks/", json={"title": "Week 1", "week_number": 1, "course_id": course["id"]}, headers=lecturer).json()
+    assignment = client.post("/course-materials/", json={
+        "title": "Assignment 1", "material_type": "assignment", "content": "c", "week_id": week["id"]
+    }, headers=lecturer).json()
+    exam = client.post("/exams/", json={
+        "title": "Exam 1", "description": "d", "course_name": title, "exam_url": "u", "due_date": DUE_DATE
+    }, headers=lecturer).json()
+    return {**course, "assignment_id": assignment["id"], "exam_id": exam["id"]}
@@ -0,0 +1,53 @@
+from conftest import _register
+
+def _submit(client, course, *students):
+    return [
+        client.post("/assignments/submit", json={"assignment_id": course["assignment_id"], "submission_url": "a"}, headers=headers).json()
+        for headers in students
+    ]
+
+def test_batch_grades_assignments_in_request_order(client, course, lecturer, student, other_student):
+    first, second = _submit(client, course, student, other_student)
+    response = client.patch("/assignments/submissions", json={"grades": [
+        {"submission_id": second["id"], "grade": "B", "feedback": "ok"},
+        {"submission_id": first["id"], "grade": "90"},
+    ]}, headers=lecturer)
+    assert response.status_code == 200, response.text
+    graded = response.json()
+    assert [row["id"] for row in graded] == [second["id"], first["id"]]
+    assert [(row["grade"], row["status"]) for row in graded] == [("B", "graded"), ("90", "graded")]
+    assert graded[0]["feedback"] == "ok"
+
+    # A grade of None keeps the current one
+    response = client.patch("/assignments/submissions", json={"grades": [
+        {"submission_id": first["id"], "feedback": "late"},
+    ]}, headers=lecturer)
+    assert response.status_code == 200, response.text
+    assert (response.json()[0]["grade"], response.json()[0]["feedback"]) == ("90", "late")
+
+def test_batch_grades_exams(client, course, lecturer, student):
+    client.post(f"/exams/{course['exam_id']}/submit", json={"submission_url": "e"}, headers=student)
+    submission = client.get(f"/exams/{course['exam_id']}/submissions", headers=lecturer).json()[0]
+    response = client.patch("/exams/submissions", json={"grades": [{"submission_id": submission["id"], "grade": "75"}]}, headers=lecturer)
+    assert response.status_code == 200, response.text
+    assert response.json()[0]["grade"] == "75"
+
+def test_batch_rejects_duplicates_unknown_and_foreign_submissions(client, course, lecturer, student):
+    (submission,) = _submit(client, course, student)
+    twice = [{"submission_id": submission["id"], "grade": "1"}, {"submission_id": submission["id"], "grade": "2"}]
+    assert client.patch("/assignments/submissions", json={"grades": twice}, headers=lecturer).status_code == 400
+    unknown = [{"submission_id": submission["id"], "grade": "1"}, {"submission_id": 10 ** 9, "grade": "2"}]
+    assert client.patch("/assignments/submissions", json={"grades": unknown}, headers=lecturer).status_code == 404
+    foreign = [{"submission_id": submission["id"], "grade": "1"}]
+    assert client.patch("/assignments/submissions", json={"grades": foreign}, headers=_register(client, "lecturer")).status_code == 403
+
+def test_batch_is_all_or_nothing_on_a_stale_version(client, course, lecturer, student, other_student):
+    first, second = _submit(client, course, student, other_student)
+    # New submissions are at version 1
+    response = client.patch("/assignments/submissions", json={"grades": [
+        {"submission_id": first["id"], "grade": "50", "version": 1},
+        {"submission_id": second["id"], "grade": "60", "version": 2},
+    ]}, headers=lecturer)
+    assert response.status_code == 409
+    rows = client.get(f"/assignments/material/{course['assignment_id']}/submissions", headers=lecturer).json()
+    assert all(row["grade"] is None for row in rows)
@@ -0,0 +1,77 @@
+import hashlib
+import uuid
+from pathlib import Path
+
+from conftest import DUE_DATE
+from app.models.exams import Exam
+from app.models.files import Blob
+from app.utils.blobstore import acquire_blob, collect_garbage, get_backend, recount_references, release_blob
+from app.utils.uploads import StoredUpload
+
+def _stored(content: bytes) -> StoredUpload:
+    return StoredUpload(Path("unused"), len(content), hashlib.sha256(content).hexdigest())
+
+def _ref_count(db, sha256):
+    db.expire_all()
+    blob = db.get(Blob, sha256)
+    return None if blob is None else blob.ref_count
+
+def test_acquire_and_release_count_references(db):
+    stored = _stored(uuid.uuid4().bytes)
+    acquire_blob(db, stored, "application/pdf")
+    acquire_blob(db, stored)
+    db.commit()
+    assert _ref_count(db, stored.sha256) == 2
+
+    release_blob(db, stored.sha256)
+    release_blob(db, stored.sha256)
+    # Never below zero
+    release_blob(db, stored.sha256)
+    release_blob(db, None)
+    db.commit()
+    assert _ref_count(db, stored.sha256) == 0
+
+def test_recount_references_fixes_wrong_counts(db):
+    stored = _stored(uuid.uuid4().bytes)
+    acquire_blob(db, stored)
+    acquire_blob(db, stored)
+    db.commit()
+    # Nothing actually points at the blob
+    assert recount_references(db, dry_run=True) >= 1
+    assert _ref_count(db, stored.sha256) == 2
+    assert recount_references(db) >= 1
+    assert _ref_count(db, stored.sha256) == 0
+
+def _upload(client, lecturer, exam_id, content: bytes):
+    response = client.post(
+        f"/exams/{exam_id}/upload", files={"file": ("exam.pdf", content, "application/pdf")}, headers=lecturer
+    )
+    assert response.status_code == 201, response.text
+    return response.json()["sha256"]
+
+def test_garbage_collection_deletes_replaced_files(client, db, course, lecturer):
+    backend = get_backend()
+    first = _upload(client, lecturer, course["exam_id"], b"first " + uuid.uuid4().bytes)
+    # The same content again is stored once and counted twice
+    other_exam = client.post("/exams/", json={
+        "title": "Exam 2", "description": "d", "course_name": course["title"], "exam_url": "u", "due_date": DUE_DATE
+    }, headers=lecturer).json()
+    assert _upload(client, lecturer, other_exam["id"], backend.path(first).read_bytes()) == first
+    assert _ref_count(db, first) == 2
+
+    second = _upload(client, lecturer, course["exam_id"], b"second " + uuid.uuid4().bytes)
+    assert _ref_count(db, first) == 1
+    assert _ref_count(db, second) == 1
+
+    # Replacing the last reference leaves the old file unreferenced
+    _upload(client, lecturer, other_exam["id"], b"third " + uuid.uuid4().bytes)
+    assert _ref_count(db, first) == 0
+    assert backend.exists(first)
+
+    assert collect_garbage(db, grace_seconds=3600, dry_run=True)["unreferenced"] == 0
+    result = collect_garbage(db, grace_seconds=0)
+    assert result["unreferenced"] >= 1
+    assert db.get(Blob, first) is None
+    assert not backend.exists(first)
+    assert backend.exists(second)
+    assert db.get(Exam, course["exam_id"]).exam_url.endswith(second)
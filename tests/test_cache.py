@@ -0,0 +1,65 @@
+import sys
+import threading
+import time
+
+from app.utils.cache import TTLCache
+from app.utils.metrics import CACHE_REQUESTS, Counter
+
+def _run_in_threads(target, count=8):
+    # Switch threads as often as possible, so unlocked read-modify-writes interleave
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+def test_entries_expire_and_are_evicted_least_recently_used():
+    cache = TTLCache("test_lru", ttl=60, maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    # "b" was the least recently used
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+    cache.set("short", 4, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("short", "gone") == "gone"
+
+def test_get_or_load_does_not_cache_none():
+    cache = TTLCache("test_load", ttl=60)
+    calls = []
+    assert cache.get_or_load("k", lambda: calls.append(1)) is None
+    assert cache.get_or_load("k", lambda: calls.append(1) or "v") == "v"
+    assert cache.get_or_load("k", lambda: calls.append(1) or "other") == "v"
+    assert len(calls) == 2
+
+def test_lookups_from_threads_are_all_counted():
+    cache = TTLCache("test_threads", ttl=60)
+    cache.set("hit", 1)
+    before_hits, before_misses = CACHE_REQUESTS.value("test_threads", "hit"), CACHE_REQUESTS.value("test_threads", "miss")
+
+    def lookups():
+        for _ in range(5000):
+            cache.get("hit")
+            cache.get("miss")
+
+    _run_in_threads(lookups)
+    assert CACHE_REQUESTS.value("test_threads", "hit") - before_hits == 40000
+    assert CACHE_REQUESTS.value("test_threads", "miss") - before_misses == 40000
+
+def test_threadsafe_counter():
+    counter = Counter("test_total", "test", ("label",), threadsafe=True)
+
+    def increments():
+        for _ in range(10000):
+            counter.inc("x")
+
+    _run_in_threads(increments)
+    assert counter.value("x") == 80000
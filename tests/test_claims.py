@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+from conftest import _register
+from app.models.users import AssignmentSubmission
+from app.utils.grading import claim_submissions, release_claims
+
+def _submit(client, course, count):
+    return [
+        client.post("/assignments/submit", json={"assignment_id": course["assignment_id"], "submission_url": "a"},
+                    headers=_register(client, "student")).json()["id"]
+        for _ in range(count)
+    ]
+
+def _claim(client, course, lecturer, limit):
+    response = client.post(f"/assignments/material/{course['assignment_id']}/claims?limit={limit}", headers=lecturer)
+    assert response.status_code == 200, response.text
+    return [row["id"] for row in response.json()["submissions"]]
+
+def test_claims_hand_out_different_submissions(client, course, lecturer):
+    ids = _submit(client, course, 3)
+    first = _claim(client, course, lecturer, 2)
+    second = _claim(client, course, lecturer, 2)
+    assert first == ids[:2]
+    assert second == ids[2:]
+    assert _claim(client, course, lecturer, 2) == []
+
+    # Released claims can be taken again
+    assert client.delete(f"/assignments/material/{course['assignment_id']}/claims", headers=lecturer).status_code == 204
+    assert _claim(client, course, lecturer, 5) == ids
+
+def test_graded_submissions_are_not_claimed(client, course, lecturer):
+    graded, ungraded = _submit(client, course, 2)
+    client.put(f"/assignments/submissions/{graded}", json={"grade": "80"}, headers=lecturer)
+    assert _claim(client, course, lecturer, 5) == [ungraded]
+
+def test_expired_leases_go_to_the_next_grader(client, db, course):
+    ids = _submit(client, course, 2)
+    claimed, expires_at = claim_submissions(db, AssignmentSubmission, AssignmentSubmission.assignment_id, course["assignment_id"], 1, 10)
+    assert [row.id for row in claimed] == ids
+    assert expires_at > datetime.utcnow()
+    # Another grader gets nothing while the lease holds
+    assert claim_submissions(db, AssignmentSubmission, AssignmentSubmission.assignment_id, course["assignment_id"], 2, 10)[0] == []
+
+    db.query(AssignmentSubmission).filter(AssignmentSubmission.id == ids[0]).update(
+        {"claim_expires_at": datetime.utcnow() - timedelta(seconds=1)}, synchronize_session=False
+    )
+    db.commit()
+    claimed, _ = claim_submissions(db, AssignmentSubmission, AssignmentSubmission.assignment_id, course["assignment_id"], 2, 10)
+    assert [(row.id, row.claimed_by) for row in claimed] == [(ids[0], 2)]
+
+    # Releasing only gives back the grader's own claims
+    assert release_claims(db, AssignmentSubmission, AssignmentSubmission.assignment_id, course["assignment_id"], 2) == 1
+
+def test_exam_claims(client, course, lecturer, student):
+    client.post(f"/exams/{course['exam_id']}/submit", json={"submission_url": "e"}, headers=student)
+    response = client.post(f"/exams/{course['exam_id']}/claims", headers=lecturer)
+    assert response.status_code == 200, response.text
+    assert len(response.json()["submissions"]) == 1
+    assert client.delete(f"/exams/{course['exam_id']}/claims", headers=lecturer).status_code == 204
+
+def test_only_the_course_lecturer_claims(client, course):
+    other = _register(client, "lecturer")
+    assert client.post(f"/assignments/material/{course['assignment_id']}/claims", headers=other).status_code == 403
+    assert client.post("/assignments/material/999999999/claims", headers=other).status_code == 404
@@ -0,0 +1,75 @@
+from sqlalchemy import event
+
+from app.database.database import engine
+from app.models.exams import Exam
+from app.models.users import CourseMaterial
+from app.utils.counters import reconcile_counters
+
+def _counters(db, course):
+    db.expire_all()
+    assignment = db.get(CourseMaterial, course["assignment_id"])
+    exam = db.get(Exam, course["exam_id"])
+    return {
+        "assignment": (assignment.submission_count, assignment.graded_count),
+        "exam": (exam.submission_count, exam.graded_count),
+    }
+
+def test_counter_deltas_match_reconcile(client, db, course, lecturer, student, other_student):
+    assignment_ids = []
+    exam_ids = []
+    for headers in (student, other_student):
+        response = client.post("/assignments/submit", json={"assignment_id": course["assignment_id"], "submission_url": "a"}, headers=headers)
+        assert response.status_code == 201, response.text
+        assignment_ids.append(response.json()["id"])
+        response = client.post(f"/exams/{course['exam_id']}/submit", json={"submission_url": "e"}, headers=headers)
+        assert response.status_code == 200, response.text
+        exam_ids.append(response.json()["id"])
+
+    assert client.put(f"/assignments/submissions/{assignment_ids[0]}", json={"grade": "80"}, headers=lecturer).status_code == 200
+    assert client.put(f"/assignments/submissions/{assignment_ids[1]}", json={"grade": "B"}, headers=lecturer).status_code == 200
+    response = client.patch("/exams/submissions", json={"grades": [{"submission_id": exam_ids[0], "grade": "17/20"}]}, headers=lecturer)
+    assert response.status_code == 200, response.text
+    # Resubmitting a graded assignment makes it ungraded again
+    client.post("/assignments/submit", json={"assignment_id": course["assignment_id"], "submission_url": "a2"}, headers=student)
+
+    counted = _counters(db, course)
+    assert counted == {"assignment": (2, 1), "exam": (2, 1)}
+    reconcile_counters(db)
+    assert _counters(db, course) == counted
+
+def test_reconcile_repairs_drift(client, db, course, student):
+    client.post("/assignments/submit", json={"assignment_id": course["assignment_id"], "submission_url": "a"}, headers=student)
+    db.query(CourseMaterial).filter(CourseMaterial.id == course["assignment_id"]).update(
+        {"submission_count": 99, "graded_count": 5}, synchronize_session=False
+    )
+    db.commit()
+    repaired = reconcile_counters(db)
+    assert repaired["course_materials"] >= 1
+    assert _counters(db, course)["assignment"] == (1, 0)
+
+def test_reconcile_keeps_a_count_added_meanwhile(client, db, course, student):
+    client.post("/assignments/submit", json={"assignment_id": course["assignment_id"], "submission_url": "a"}, headers=student)
+    db.query(CourseMaterial).filter(CourseMaterial.id == course["assignment_id"]).update(
+        {"submission_count": 99, "graded_count": 5}, synchronize_session=False
+    )
+    db.commit()
+
+    def concurrent_submit(conn, cursor, statement, parameters, context, executemany):
+        # Another request bumps the counter after it was read, just before the repair is written
+        if statement.startswith("UPDATE course_materials") and not bumped:
+            bumped.append(1)
+            cursor.connection.execute(
+                "UPDATE course_materials SET submission_count = submission_count + 1 WHERE id = ?", (course["assignment_id"],)
+            )
+
+    bumped = []
+    event.listen(engine, "before_cursor_execute", concurrent_submit)
+    try:
+        reconcile_counters(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", concurrent_submit)
+    assert bumped
+    # The stale repair didn't overwrite the increment
+    assert _counters(db, course)["assignment"] == (100, 5)
+    reconcile_counters(db)
+    assert _counters(db, course)["assignment"] == (1, 0)
@@ -0,0 +1,72 @@
+import pytest
+
+from conftest import DUE_DATE, _register
+from app.utils import dashboard
+
+@pytest.fixture(autouse=True)
+def every_item(monkeypatch):
+    # Exams and assignments of earlier tests are listed too
+    monkeypatch.setattr(dashboard, "DASHBOARD_ITEMS", 10 ** 6)
+
+def _by_id(rows, item_id):
+    return next(row for row in rows if row["id"] == item_id)
+
+def test_student_dashboard(client, course, lecturer):
+    student = _register(client, "student")
+    board = client.get("/me/dashboard", headers=student).json()
+    assert _by_id(board["upcoming_exams"], course["exam_id"])["submission_status"] is None
+    assignment = _by_id(board["outstanding_assignments"], course["assignment_id"])
+    assert (assignment["course_id"], assignment["course_title"], assignment["submission_status"]) == (course["id"], course["title"], None)
+    assert board["recent_grades"] == []
+
+    # Submitting drops the cached dashboard
+    client.post(f"/exams/{course['exam_id']}/submit", json={"submission_url": "e"}, headers=student)
+    submission = client.post(
+        "/assignments/submit", json={"assignment_id": course["assignment_id"], "submission_url": "a"}, headers=student
+    ).json()
+    board = client.get("/me/dashboard", headers=student).json()
+    assert _by_id(board["upcoming_exams"], course["exam_id"])["submission_status"] == "submitted"
+    assert _by_id(board["outstanding_assignments"], course["assignment_id"])["submission_status"] == "submitted"
+
+    client.put(f"/assignments/submissions/{submission['id']}", json={"grade": "17/20", "feedback": "good"}, headers=lecturer)
+    board = client.get("/me/dashboard", headers=student).json()
+    assert course["assignment_id"] not in [row["id"] for row in board["outstanding_assignments"]]
+    (grade,) = board["recent_grades"]
+    assert (grade["kind"], grade["id"], grade["grade"], grade["score"], grade["feedback"]) == (
+        "assignment", course["assignment_id"], "17/20", 85.0, "good"
+    )
+
+def test_new_coursework_shows_up_at_once(client, course, lecturer, student):
+    client.get("/me/dashboard", headers=student)
+    exam = client.post("/exams/", json={
+        "title": "Resit", "description": "d", "course_name": course["title"], "exam_url": "u", "due_date": DUE_DATE
+    }, headers=lecturer).json()
+    board = client.get("/me/dashboard", headers=student).json()
+    assert _by_id(board["upcoming_exams"], exam["id"])["title"] == "Resit"
+
+def test_student_dashboard_is_for_students(client, lecturer):
+    assert client.get("/me/dashboard", headers=lecturer).status_code == 403
+    assert client.get("/me/dashboard").status_code == 401
+
+def test_lecturer_dashboard(client, course, lecturer, student, other_student):
+    submissions = [
+        client.post("/assignments/submit", json={"assignment_id": course["assignment_id"], "submission_url": "a"}, headers=headers).json()
+        for headers in (student, other_student)
+    ]
+    client.post(f"/exams/{course['exam_id']}/submit", json={"submission_url": "e"}, headers=student)
+    client.put(f"/assignments/submissions/{submissions[0]['id']}", json={"grade": "80"}, headers=lecturer)
+    # Only cached for a while, never invalidated
+    dashboard.lecturer_dashboards.clear()
+
+    board = client.get("/me/lecturer-dashboard", headers=lecturer).json()
+    entry = _by_id(board["courses"], course["id"])
+    assert (entry["ungraded_assignment_submissions"], entry["ungraded_exam_submissions"]) == (1, 1)
+    latest = entry["latest_submissions"]
+    assert sorted((row["kind"], row["status"]) for row in latest) == [("assignment", "graded"), ("assignment", "submitted"), ("exam", "submitted")]
+    assert {row["student_id"] for row in latest} == {row["student_id"] for row in submissions}
+    (exam,) = entry["upcoming_exams"]
+    assert (exam["id"], exam["submission_count"], exam["graded_count"]) == (course["exam_id"], 1, 0)
+
+def test_lecturer_dashboard_without_courses(client, student):
+    assert client.get("/me/lecturer-dashboard", headers=_register(client, "lecturer")).json()["courses"] == []
+    assert client.get("/me/lecturer-dashboard", headers=student).status_code == 403
@@ -0,0 +1,71 @@
+import hashlib
+import uuid
+
+def _slot(client, headers, course, content: bytes, target="assignment"):
+    target_id = course["assignment_id"] if target == "assignment" else course["exam_id"]
+    response = client.post("/uploads/slots", json={
+        "target": target, "target_id": target_id, "sha256": hashlib.sha256(content).hexdigest(),
+        "size": len(content), "content_type": "application/pdf"
+    }, headers=headers)
+    assert response.status_code == 201, response.text
+    return response.json()
+
+def _put(client, slot, content: bytes):
+    return client.put(slot["upload_url"], content=content, headers=slot["headers"])
+
+def _confirm(client, headers, slot):
+    return client.post("/uploads/confirm", json={"token": slot["token"]}, headers=headers)
+
+def test_slot_put_confirm(client, course, lecturer, student):
+    content = b"answers " + uuid.uuid4().bytes
+    slot = _slot(client, student, course, content, "exam")
+    assert slot["upload_url"].startswith("/uploads/blobs/")
+    assert _confirm(client, student, slot).status_code == 409
+
+    response = _put(client, slot, content)
+    assert response.status_code == 201, response.text
+    response = _confirm(client, student, slot)
+    assert response.status_code == 201, response.text
+    confirmation = response.json()
+    assert confirmation["sha256"] == hashlib.sha256(content).hexdigest()
+    assert client.get(confirmation["submission_url"], headers=student).content == content
+
+    # The same exam can't be submitted twice
+    assert client.post("/uploads/slots", json={
+        "target": "exam", "target_id": course["exam_id"], "sha256": confirmation["sha256"], "size": len(content)
+    }, headers=student).status_code == 400
+
+def test_someone_elses_upload_of_the_same_content_does_not_count(client, course, student, other_student):
+    content = b"shared " + uuid.uuid4().bytes
+    mine = _slot(client, student, course, content)
+    theirs = _slot(client, other_student, course, content)
+    assert _put(client, theirs, content).status_code == 201
+    # Stored after my slot was issued, but not through it
+    assert _confirm(client, student, mine).status_code == 409
+    assert _confirm(client, other_student, theirs).status_code == 201
+
+    assert _put(client, mine, content).status_code == 201
+    assert _confirm(client, student, mine).status_code == 201
+
+def test_resubmitting_a_file_already_held_needs_no_upload(client, course, student):
+    content = b"again " + uuid.uuid4().bytes
+    slot = _slot(client, student, course, content)
+    _put(client, slot, content)
+    first = _confirm(client, student, slot).json()
+
+    again = _slot(client, student, course, content)
+    assert again["upload_url"] is None
+    response = _confirm(client, student, again)
+    assert response.status_code == 201
+    assert response.json()["submission_id"] == first["submission_id"]
+
+def test_put_is_checked_against_the_slot(client, course, student, other_student):
+    content = b"checked " + uuid.uuid4().bytes
+    slot = _slot(client, student, course, content)
+    assert _put(client, slot, b"other " + uuid.uuid4().bytes[:len(content) - 6]).status_code == 400
+    assert _put(client, slot, content + b"more").status_code == 413
+    wrong_token = slot["upload_url"].split("?")[0] + "?token=" + slot["token"][:-2] + "xx"
+    assert client.put(wrong_token, content=content).status_code == 403
+    # Only the student the slot was issued to can confirm it
+    _put(client, slot, content)
+    assert _confirm(client, other_student, slot).status_code == 403
@@ -0,0 +1,85 @@
+import uuid
+
+from conftest import DUE_DATE, _register
+
+def _exam_file(client, course, lecturer, content: bytes, content_type="application/pdf"):
+    response = client.post(
+        f"/exams/{course['exam_id']}/upload", files={"file": ("exam.pdf", content, content_type)}, headers=lecturer
+    )
+    assert response.status_code == 201, response.text
+    return response.json()["sha256"]
+
+def test_download_whole_file_with_cache_headers(client, course, lecturer, student):
+    content = b"exam " + uuid.uuid4().bytes
+    sha256 = _exam_file(client, course, lecturer, content)
+    response = client.get(f"/files/{sha256}", headers=student)
+    assert response.status_code == 200
+    assert response.content == content
+    assert response.headers["etag"] == f'"{sha256}"'
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["x-content-type-options"] == "nosniff"
+    assert "immutable" in response.headers["cache-control"]
+
+    head = client.head(f"/files/{sha256}", headers=student)
+    assert head.status_code == 200
+    assert head.content == b""
+
+def test_download_ranges(client, course, lecturer, student):
+    content = bytes(range(100))
+    sha256 = _exam_file(client, course, lecturer, content + uuid.uuid4().bytes)
+    url = f"/files/{sha256}"
+
+    response = client.get(url, headers={**student, "Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == content[10:20]
+    assert response.headers["content-range"] == "bytes 10-19/116"
+
+    response = client.get(url, headers={**student, "Range": "bytes=-6"})
+    assert response.status_code == 206
+    assert len(response.content) == 6
+
+    response = client.get(url, headers={**student, "Range": "bytes=500-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */116"
+
+    # A range against another version of the file gets the whole file
+    response = client.get(url, headers={**student, "Range": "bytes=0-9", "If-Range": '"other"'})
+    assert response.status_code == 200
+    assert len(response.content) == 116
+
+    # Several ranges aren't supported and get the whole file too
+    assert client.get(url, headers={**student, "Range": "bytes=0-1,5-6"}).status_code == 200
+
+def test_if_none_match_gets_304(client, course, lecturer, student):
+    sha256 = _exam_file(client, course, lecturer, uuid.uuid4().bytes)
+    response = client.get(f"/files/{sha256}", headers={**student, "If-None-Match": f'"{sha256}"'})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == f'"{sha256}"'
+
+def test_html_is_sent_as_an_attachment(client, course, lecturer, student):
+    sha256 = _exam_file(client, course, lecturer, b"<script>" + uuid.uuid4().bytes, "text/html")
+    response = client.get(f"/files/{sha256}", headers=student)
+    assert response.headers["content-disposition"] == "attachment"
+
+def test_other_peoples_files_are_not_found(client, lecturer, student, other_student):
+    announcement = client.post("/finance/announcements/", json={
+        "title": "Fees", "description": "d", "amount": "10", "payment_details": "p", "due_date": DUE_DATE
+    }, headers=lecturer).json()
+    submission = client.post("/finance/submissions/", json={
+        "announcement_id": announcement["id"], "payment_slip_url": "s", "amount_paid": "10", "payment_date": DUE_DATE
+    }, headers=student).json()
+    response = client.post(
+        f"/finance/submissions/{submission['id']}/slip",
+        files={"file": ("slip.png", b"slip " + uuid.uuid4().bytes, "image/png")}, headers=student
+    )
+    assert response.status_code == 200, response.text
+    sha256 = response.json()["payment_slip_url"].rsplit("/", 1)[1]
+
+    assert client.get(f"/files/{sha256}", headers=student).status_code == 200
+    assert client.get(f"/files/{sha256}", headers=lecturer).status_code == 200
+    # The same 404 as for a file that doesn't exist
+    assert client.get(f"/files/{sha256}", headers=other_student).status_code == 404
+    assert client.get(f"/files/{'0' * 64}", headers=student).status_code == 404
+    assert client.get("/files/not-a-hash", headers=student).status_code == 404
+    assert client.get(f"/files/{sha256}").status_code == 401
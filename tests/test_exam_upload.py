@@ -0,0 +1,35 @@
+import hashlib
+
+from app.utils.blobstore import BLOB_TMP_DIR, get_backend
+from app.utils.uploads import MAX_REQUEST_BYTES, MAX_UPLOAD_BYTES
+
+def _upload(client, lecturer, exam_id, content: bytes):
+    return client.post(f"/exams/{exam_id}/upload", files={"file": ("exam.pdf", content, "application/pdf")}, headers=lecturer)
+
+def _temp_files():
+    return list(BLOB_TMP_DIR.glob(".upload-*")) if BLOB_TMP_DIR.exists() else []
+
+def test_upload_is_stored_in_chunks_up_to_the_limit(client, course, lecturer):
+    content = bytes(range(256)) * (MAX_UPLOAD_BYTES // 256)
+    response = _upload(client, lecturer, course["exam_id"], content)
+    assert response.status_code == 201, response.text
+    assert response.json()["size"] == MAX_UPLOAD_BYTES
+    assert response.json()["sha256"] == hashlib.sha256(content).hexdigest()
+    assert get_backend().path(response.json()["sha256"]).read_bytes() == content
+    assert _temp_files() == []
+
+def test_upload_over_the_limit_is_refused(client, course, lecturer):
+    response = _upload(client, lecturer, course["exam_id"], b"x" * (MAX_UPLOAD_BYTES + 1))
+    assert response.status_code == 413
+    # Nothing half-written is left behind
+    assert _temp_files() == []
+    exam = client.get(f"/exams/{course['exam_id']}", headers=lecturer).json()
+    assert exam["exam_url"] == "u"
+
+def test_request_over_the_body_limit_is_refused_up_front(client, course, lecturer):
+    response = _upload(client, lecturer, course["exam_id"], b"x" * (MAX_REQUEST_BYTES + 1))
+    assert response.status_code == 413
+    assert str(MAX_REQUEST_BYTES) in response.json()["detail"]
+
+def test_only_lecturers_upload(client, course, student):
+    assert _upload(client, student, course["exam_id"], b"x").status_code in (401, 403)
@@ -0,0 +1,61 @@
+import csv
+import io
+
+import pandas as pd
+
+from conftest import _register
+
+def _fill(client, course, lecturer, student, other_student):
+    for headers in (student, other_student):
+        client.post("/assignments/submit", json={"assignment_id": course["assignment_id"], "submission_url": "a"}, headers=headers)
+    # Only one student sat the exam
+    client.post(f"/exams/{course['exam_id']}/submit", json={"submission_url": "e"}, headers=student)
+    rows = client.get(f"/assignments/material/{course['assignment_id']}/submissions", headers=lecturer).json()
+    client.put(f"/assignments/submissions/{rows[0]['id']}", json={"grade": "17/20"}, headers=lecturer)
+    return rows[0]["student_id"]
+
+def test_json_gradebook_has_a_row_per_student(client, course, lecturer, student, other_student):
+    graded_student = _fill(client, course, lecturer, student, other_student)
+    response = client.get(f"/courses/{course['id']}/gradebook", headers=lecturer)
+    assert response.status_code == 200, response.text
+    book = response.json()
+    assignment_key, exam_key = f"assignment:{course['assignment_id']}", f"exam:{course['exam_id']}"
+    assert [item["key"] for item in book["items"]] == [assignment_key, exam_key]
+    assert book["columns"][:4] == ["student_id", "enrollment_number", "first_name", "last_name"]
+    assert len(book["rows"]) == 2
+
+    rows = [dict(zip(book["columns"], row)) for row in book["rows"]]
+    by_student = {row["student_id"]: row for row in rows}
+    assert by_student[graded_student][f"{assignment_key} grade"] == "17/20"
+    assert by_student[graded_student][f"{assignment_key} status"] == "graded"
+    other = next(row for student_id, row in by_student.items() if student_id != graded_student)
+    assert other[f"{assignment_key} status"] == "submitted"
+    assert sum(row[f"{exam_key} status"] == "submitted" for row in rows) == 1
+    assert sum(row[f"{exam_key} status"] is None for row in rows) == 1
+
+def test_csv_and_parquet_exports(client, course, lecturer, student, other_student):
+    _fill(client, course, lecturer, student, other_student)
+    response = client.get(f"/courses/{course['id']}/gradebook?format=csv", headers=lecturer)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert f"gradebook-course-{course['id']}.csv" in response.headers["content-disposition"]
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0][:2] == ["student_id", "enrollment_number"]
+    assert len(rows) == 3
+
+    response = client.get(f"/courses/{course['id']}/gradebook?format=parquet", headers=lecturer)
+    assert response.status_code == 200
+    frame = pd.read_parquet(io.BytesIO(response.content))
+    assert len(frame) == 2
+    assert f"assignment:{course['assignment_id']} grade" in frame.columns
+
+def test_gradebook_of_a_course_without_submissions(client, course, lecturer):
+    book = client.get(f"/courses/{course['id']}/gradebook", headers=lecturer).json()
+    assert book["rows"] == []
+    assert len(book["items"]) == 2
+    assert client.get(f"/courses/{course['id']}/gradebook?format=csv", headers=lecturer).text.startswith("student_id,")
+
+def test_gradebook_errors(client, course, lecturer):
+    assert client.get(f"/courses/{course['id']}/gradebook?format=xml", headers=lecturer).status_code == 400
+    assert client.get(f"/courses/{course['id']}/gradebook", headers=_register(client, "lecturer")).status_code == 403
+    assert client.get("/courses/999999999/gradebook", headers=lecturer).status_code == 404
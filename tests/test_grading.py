@@ -0,0 +1,57 @@
+import pytest
+
+from conftest import _register
+from app.utils.grading import parse_score
+
+@pytest.mark.parametrize("grade, score", [
+    ("85", 85.0),
+    (" 85.5% ", 85.5),
+    ("100%", 100.0),
+    ("0", 0.0),
+    ("150", 150.0),
+    ("-3", -3.0),
+    ("17/20", 85.0),
+    ("7 / 10", 70.0),
+])
+def test_parse_score_numbers(grade, score):
+    assert parse_score(grade) == pytest.approx(score)
+
+@pytest.mark.parametrize("grade", [None, "", "A+", "B", "0/0", "3/0", "1e3", "nan", "inf"])
+def test_parse_score_not_a_number(grade):
+    assert parse_score(grade) is None
+
+def test_grade_stats(client, course, lecturer, student, other_student):
+    submissions = [
+        client.post("/assignments/submit", json={"assignment_id": course["assignment_id"], "submission_url": "a"}, headers=headers).json()
+        for headers in (student, other_student)
+    ]
+    client.patch("/assignments/submissions", json={"grades": [
+        {"submission_id": submissions[0]["id"], "grade": "17/20"},
+        {"submission_id": submissions[1]["id"], "grade": "100"},
+    ]}, headers=lecturer)
+    response = client.get(f"/courses/{course['id']}/grade-stats", headers=lecturer)
+    assert response.status_code == 200, response.text
+    items = {item["key"]: item for item in response.json()["items"]}
+
+    assignment = items[f"assignment:{course['assignment_id']}"]
+    assert (assignment["submissions"], assignment["graded"], assignment["progress"], assignment["scored"]) == (2, 2, 1.0, 2)
+    assert (assignment["min"], assignment["max"], assignment["mean"]) == (85.0, 100.0, pytest.approx(92.5))
+    counts = {bucket["from"]: bucket["count"] for bucket in assignment["histogram"]}
+    # 100 falls in the last bucket
+    assert (counts[80], counts[90], sum(counts.values())) == (1, 1, 2)
+
+    exam = items[f"exam:{course['exam_id']}"]
+    assert (exam["submissions"], exam["progress"], exam["mean"]) == (0, None, None)
+
+def test_grade_stats_ignore_ungraded_and_unparsable_grades(client, course, lecturer, student, other_student):
+    first, second = [
+        client.post("/assignments/submit", json={"assignment_id": course["assignment_id"], "submission_url": "a"}, headers=headers).json()
+        for headers in (student, other_student)
+    ]
+    client.patch("/assignments/submissions", json={"grades": [{"submission_id": first["id"], "grade": "A+"}]}, headers=lecturer)
+    assignment = client.get(f"/courses/{course['id']}/grade-stats", headers=lecturer).json()["items"][0]
+    assert (assignment["submissions"], assignment["graded"], assignment["progress"]) == (2, 1, 0.5)
+    assert (assignment["scored"], assignment["median"]) == (0, None)
+
+def test_grade_stats_of_another_lecturer(client, course):
+    assert client.get(f"/courses/{course['id']}/grade-stats", headers=_register(client, "lecturer")).status_code == 403
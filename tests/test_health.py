@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+from app.utils.health import DatabaseProbe
+
+def test_liveness(client):
+    response = client.get("/api/health/live")
+    assert response.status_code == 200
+    assert response.json() == {"status": "alive"}
+
+def test_readiness_reports_checks(client):
+    response = client.get("/api/health/ready")
+    assert response.status_code in (200, 503)
+    assert "pool" in response.json()["checks"]
+
+def test_first_concurrent_checks_wait_for_the_probe(monkeypatch):
+    probe = DatabaseProbe()
+    runs = []
+
+    def slow_probe():
+        runs.append(1)
+        time.sleep(0.05)
+        return 1.5
+
+    monkeypatch.setattr(probe, "_run", slow_probe)
+
+    async def check_concurrently():
+        return await asyncio.gather(*(probe.result() for _ in range(5)))
+
+    results = asyncio.run(check_concurrently())
+    # Nobody is told the database is unreachable while the first probe runs
+    assert results == [{"latency_ms": 1.5, "error": None}] * 5
+    assert len(runs) == 1
+
+def test_failed_probe_is_reported(monkeypatch):
+    probe = DatabaseProbe()
+
+    def failing_probe():
+        raise RuntimeError("down")
+
+    monkeypatch.setattr(probe, "_run", failing_probe)
+    assert asyncio.run(probe.result()) == {"latency_ms": None, "error": "down"}
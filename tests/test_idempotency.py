@@ -0,0 +1,72 @@
+import uuid
+from datetime import datetime, timedelta
+
+from conftest import DUE_DATE, _register
+from app.models.idempotency import IdempotencyRecord
+from app.utils.auth import decode_access_token
+from app.utils.idempotency import stored_responses
+
+ANNOUNCEMENT = {"title": "Fees", "description": "d", "amount": "10", "payment_details": "p", "due_date": DUE_DATE}
+
+def _with_key(headers, key=None):
+    return {**headers, "Idempotency-Key": key or uuid.uuid4().hex}
+
+def test_retry_replays_the_stored_response(client, lecturer):
+    headers = _with_key(lecturer)
+    first = client.post("/finance/announcements/", json=ANNOUNCEMENT, headers=headers)
+    assert first.status_code == 201
+    assert "idempotent-replayed" not in first.headers
+
+    retry = client.post("/finance/announcements/", json=ANNOUNCEMENT, headers=headers)
+    assert retry.status_code == 201
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+
+    # Another worker, without the response in memory, replays it from the database
+    stored_responses.clear()
+    retry = client.post("/finance/announcements/", json=ANNOUNCEMENT, headers=headers)
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json()["id"] == first.json()["id"]
+
+    # Without a key the same request runs again
+    assert client.post("/finance/announcements/", json=ANNOUNCEMENT, headers=lecturer).json()["id"] != first.json()["id"]
+
+def test_key_reused_for_a_different_request(client, lecturer):
+    headers = _with_key(lecturer)
+    assert client.post("/finance/announcements/", json=ANNOUNCEMENT, headers=headers).status_code == 201
+    response = client.post("/finance/announcements/", json={**ANNOUNCEMENT, "amount": "20"}, headers=headers)
+    assert response.status_code == 422
+    assert "different request" in response.json()["detail"]
+
+def test_keys_are_per_user(client, lecturer):
+    key = uuid.uuid4().hex
+    first = client.post("/finance/announcements/", json=ANNOUNCEMENT, headers=_with_key(lecturer, key))
+    second = client.post("/finance/announcements/", json=ANNOUNCEMENT, headers=_with_key(_register(client, "lecturer"), key))
+    assert second.status_code == 201
+    assert "idempotent-replayed" not in second.headers
+    assert second.json()["id"] != first.json()["id"]
+
+def test_retry_while_the_first_request_runs(client, db, lecturer):
+    key = uuid.uuid4().hex
+    username = decode_access_token(lecturer["Authorization"].split(" ", 1)[1])
+    now = datetime.utcnow()
+    db.add(IdempotencyRecord(
+        username=username, key=key, method="POST", path="/finance/announcements/",
+        created_at=now, expires_at=now + timedelta(hours=1)
+    ))
+    db.commit()
+    response = client.post("/finance/announcements/", json=ANNOUNCEMENT, headers=_with_key(lecturer, key))
+    assert response.status_code == 409
+    assert response.headers["retry-after"] == "1"
+
+def test_early_answer_without_reading_the_body_is_replayed(client, lecturer):
+    headers = _with_key(lecturer)
+    first = client.put("/finance/announcements/999999999", json={"title": "x"}, headers=headers)
+    assert first.status_code == 404
+    retry = client.put("/finance/announcements/999999999", json={"title": "x"}, headers=headers)
+    assert retry.status_code == 404
+    assert retry.headers["idempotent-replayed"] == "true"
+
+def test_invalid_key(client, lecturer):
+    response = client.post("/finance/announcements/", json=ANNOUNCEMENT, headers=_with_key(lecturer, "k" * 256))
+    assert response.status_code == 400
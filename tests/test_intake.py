@@ -0,0 +1,70 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+
+from app.routers.exams import _write_exam_submissions
+from app.utils.intake import GroupCommitQueue
+
+def _run_together(queue, items):
+    async def submit_all():
+        return await asyncio.gather(*(queue.submit(item) for item in items), return_exceptions=True)
+    return asyncio.run(submit_all())
+
+def test_failed_batch_is_retried_row_by_row():
+    batches = []
+
+    def write_batch(db, items):
+        batches.append(list(items))
+        if "bad" in items:
+            raise ValueError("bad row")
+        return [item.upper() for item in items]
+
+    results = _run_together(GroupCommitQueue("test", write_batch, window_ms=50), ["a", "bad", "b"])
+    assert results[0] == "A" and results[2] == "B"
+    assert isinstance(results[1], ValueError)
+    # One batch, then each row on its own
+    assert batches == [["a", "bad", "b"], ["a"], ["bad"], ["b"]]
+
+def test_full_batch_is_written_without_waiting_for_the_window():
+    def write_batch(db, items):
+        return list(items)
+
+    started = time.monotonic()
+    results = _run_together(GroupCommitQueue("test", write_batch, max_batch=2, window_ms=10000), [1, 2])
+    assert results == [1, 2]
+    assert time.monotonic() - started < 5
+
+def test_exam_batch_with_an_earlier_submission_is_retried(client, course, lecturer, student, other_student):
+    first = client.post(f"/exams/{course['exam_id']}/submit", json={"submission_url": "e"}, headers=student)
+    assert first.status_code == 200, first.text
+    assignment = client.post(
+        "/assignments/submit", json={"assignment_id": course["assignment_id"], "submission_url": "a"}, headers=other_student
+    ).json()
+    now = datetime.utcnow()
+    item = {"exam_id": course["exam_id"], "submission_url": "e", "submitted_at": now}
+
+    results = _run_together(GroupCommitQueue("exam_submissions_test", _write_exam_submissions, window_ms=50), [
+        {**item, "student_id": first.json()["student_id"]},
+        {**item, "student_id": assignment["student_id"]},
+        {**item, "student_id": assignment["student_id"]},
+        {**item, "student_id": assignment["student_id"], "exam_id": 10 ** 9},
+    ])
+    assert isinstance(results[0], HTTPException) and results[0].status_code == 400
+    assert results[1].student_id == assignment["student_id"]
+    assert isinstance(results[2], HTTPException) and results[2].detail == "You have already submitted this exam"
+    assert isinstance(results[3], HTTPException) and results[3].status_code == 404
+    submissions = client.get(f"/exams/{course['exam_id']}/submissions", headers=lecturer).json()
+    assert len(submissions) == 2
+
+def test_exam_deadline_is_checked_on_the_exam_row(client, course, student):
+    assignment = client.post(
+        "/assignments/submit", json={"assignment_id": course["assignment_id"], "submission_url": "a"}, headers=student
+    ).json()
+    late = datetime.utcnow() + timedelta(days=400)
+    (result,) = _run_together(GroupCommitQueue("exam_submissions_test", _write_exam_submissions), [{
+        "exam_id": course["exam_id"], "student_id": assignment["student_id"], "submission_url": "e", "submitted_at": late
+    }])
+    assert isinstance(result, HTTPException)
+    assert result.detail == "Exam submission deadline has passed"
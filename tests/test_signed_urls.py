@@ -0,0 +1,54 @@
+import time
+import uuid
+from urllib.parse import parse_qs, urlsplit
+
+from app.utils.signing import FILE_URL_EXPIRY_STEP, sign_blob_url, sign_token, verify_blob_signature, verify_token
+
+SHA256 = "a" * 64
+
+def test_signed_exam_file_url_works_without_a_token(client, course, lecturer, student):
+    content = b"exam " + uuid.uuid4().bytes
+    client.post(f"/exams/{course['exam_id']}/upload", files={"file": ("exam.pdf", content, "application/pdf")}, headers=lecturer)
+    response = client.get(f"/exams/{course['exam_id']}/file-url", headers=student)
+    assert response.status_code == 200, response.text
+    url = response.json()["url"]
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == content
+
+    # Changing any signed part of the URL breaks the signature
+    assert client.get(url.replace("application%2Fpdf", "text%2Fhtml")).status_code == 403
+    assert client.get(url.replace("expires=", "expires=1")).status_code == 403
+
+def test_exam_without_a_file_has_no_url(client, course, student):
+    assert client.get(f"/exams/{course['exam_id']}/file-url", headers=student).status_code == 404
+
+def test_signature_expires():
+    now = time.time()
+    url, expires = sign_blob_url(SHA256, "application/pdf", ttl=60, now=now)
+    signature = parse_qs(urlsplit(url).query)["sig"][0]
+    assert expires >= now + 60
+    assert expires % FILE_URL_EXPIRY_STEP == 0
+    assert verify_blob_signature(SHA256, expires, "application/pdf", signature, now=now)
+    assert not verify_blob_signature(SHA256, expires, "application/pdf", signature, now=expires + 1)
+    assert not verify_blob_signature(SHA256, expires + FILE_URL_EXPIRY_STEP, "application/pdf", signature, now=now)
+
+def test_expired_link_is_refused(client):
+    url, expires = sign_blob_url(SHA256, "application/pdf", ttl=-2 * FILE_URL_EXPIRY_STEP)
+    assert expires < time.time()
+    response = client.get(url)
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Invalid or expired download link"
+
+def test_repeated_mints_give_the_same_url():
+    now = FILE_URL_EXPIRY_STEP * 1000 + 1
+    assert sign_blob_url(SHA256, ttl=60, now=now) == sign_blob_url(SHA256, ttl=60, now=now + 5)
+
+def test_tokens_are_bound_to_their_purpose_and_expiry():
+    token, _ = sign_token("direct-upload", {"sha256": SHA256}, ttl=60)
+    assert verify_token("direct-upload", token)["sha256"] == SHA256
+    assert verify_token("other", token) is None
+    assert verify_token("direct-upload", token[:-1] + ("A" if token[-1] != "A" else "B")) is None
+    expired, _ = sign_token("direct-upload", {"sha256": SHA256}, ttl=-1)
+    assert verify_token("direct-upload", expired) is None
@@ -0,0 +1,67 @@
+from conftest import _register
+from app.models.users import AssignmentSubmission, StudentGradeSummary, StudentProfile
+from app.utils.transcript import SUMMARY_COLUMNS, record_grade_changes, rebuild_grade_summary
+
+def _summary(db, course_id):
+    db.expire_all()
+    return {
+        row.student_id: tuple(getattr(row, column) for column in SUMMARY_COLUMNS)
+        for row in db.query(StudentGradeSummary).filter(StudentGradeSummary.course_id == course_id)
+    }
+
+def _submit_and_grade(client, course, lecturer, student, other_student):
+    submissions = {}
+    for name, headers in (("student", student), ("other", other_student)):
+        submissions[name] = client.post(
+            "/assignments/submit", json={"assignment_id": course["assignment_id"], "submission_url": "a"}, headers=headers
+        ).json()
+        client.post(f"/exams/{course['exam_id']}/submit", json={"submission_url": "e"}, headers=headers)
+    exams = client.get(f"/exams/{course['exam_id']}/submissions", headers=lecturer).json()
+    client.patch("/exams/submissions", json={"grades": [{"submission_id": row["id"], "grade": "90"} for row in exams]}, headers=lecturer)
+    client.patch("/assignments/submissions", json={"grades": [
+        {"submission_id": submissions["student"]["id"], "grade": "60"},
+        {"submission_id": submissions["other"]["id"], "grade": "A"},
+    ]}, headers=lecturer)
+    return submissions
+
+def test_incremental_summary_matches_rebuild(client, db, course, lecturer, student, other_student):
+    submissions = _submit_and_grade(client, course, lecturer, student, other_student)
+    # Regrade, change feedback only, and resubmit a graded assignment
+    client.put(f"/assignments/submissions/{submissions['student']['id']}", json={"grade": "70"}, headers=lecturer)
+    client.put(f"/assignments/submissions/{submissions['other']['id']}", json={"feedback": "good"}, headers=lecturer)
+    client.post("/assignments/submit", json={"assignment_id": course["assignment_id"], "submission_url": "a2"}, headers=other_student)
+
+    incremental = _summary(db, course["id"])
+    assert sorted(incremental.values()) == [(0, 1, 1, 90.0), (1, 1, 2, 160.0)]
+    rebuild_grade_summary(db)
+    assert _summary(db, course["id"]) == incremental
+
+def test_decrement_without_a_row_recomputes_it(client, db, course, lecturer, student, other_student):
+    submissions = _submit_and_grade(client, course, lecturer, student, other_student)
+    db.query(StudentGradeSummary).filter(StudentGradeSummary.course_id == course["id"]).delete(synchronize_session=False)
+    db.commit()
+
+    client.put(f"/assignments/submissions/{submissions['student']['id']}", json={"grade": "50"}, headers=lecturer)
+    student_id = submissions["student"]["student_id"]
+    assert _summary(db, course["id"])[student_id] == (1, 1, 2, 140.0)
+    rebuild_grade_summary(db)
+    assert _summary(db, course["id"])[student_id] == (1, 1, 2, 140.0)
+
+def test_record_grade_changes_ignores_unchanged_states(db, course):
+    before = _summary(db, course["id"])
+    record_grade_changes(db, AssignmentSubmission, [(1, course["assignment_id"], ("graded", 80.0), ("graded", 80.0))])
+    db.commit()
+    assert _summary(db, course["id"]) == before
+
+def test_transcript_access(client, db, course, lecturer, student, other_student):
+    submissions = _submit_and_grade(client, course, lecturer, student, other_student)
+    student_user_id = db.get(StudentProfile, submissions["student"]["student_id"]).user_id
+    response = client.get(f"/users/{student_user_id}/transcript", headers=student)
+    assert response.status_code == 200, response.text
+    entry = next(entry for entry in response.json()["courses"] if entry["course_id"] == course["id"])
+    assert entry["course_title"] == course["title"]
+    assert (entry["assignments_graded"], entry["exams_graded"], entry["scored_count"], entry["average_score"]) == (1, 1, 2, 75.0)
+    assert client.get(f"/users/{student_user_id}/transcript", headers=lecturer).status_code == 200
+    assert client.get(f"/users/{student_user_id}/transcript", headers=other_student).status_code == 403
+    # A lecturer who doesn't teach the student
+    assert client.get(f"/users/{student_user_id}/transcript", headers=_register(client, "lecturer")).status_code == 403
@@ -0,0 +1,50 @@
+from conftest import _register
+from app.utils.auth import decode_access_token
+
+def _me(client, headers):
+    username = decode_access_token(headers["Authorization"].split(" ", 1)[1])
+    return next(user for user in client.get("/users/", headers=headers).json() if user["username"] == username)
+
+def test_update_own_user_and_profile(client):
+    headers = _register(client, "student")
+    me = _me(client, headers)
+    response = client.put(f"/users/{me['id']}", json={"first_name": "Ada", "student_profile": {"program": "Maths"}}, headers=headers)
+    assert response.status_code == 200, response.text
+    user = response.json()
+    assert user["first_name"] == "Ada"
+    assert user["student_profile"]["program"] == "Maths"
+    assert response.headers["etag"] == '"2"'
+
+    # A profile-only edit bumps the user's version too
+    response = client.put(f"/users/{me['id']}", json={"student_profile": {"semester": 3}}, headers=headers)
+    assert response.headers["etag"] == '"3"'
+    assert response.json()["student_profile"]["program"] == "Maths"
+    assert response.json()["student_profile"]["semester"] == 3
+
+def test_update_user_if_match(client):
+    headers = _register(client, "lecturer")
+    me = _me(client, headers)
+    response = client.put(f"/users/{me['id']}", json={"last_name": "A"}, headers={**headers, "If-Match": '"1"'})
+    assert response.status_code == 200
+    response = client.put(f"/users/{me['id']}", json={"last_name": "B"}, headers={**headers, "If-Match": '"1"'})
+    assert response.status_code == 409
+    assert response.headers["etag"] == '"2"'
+
+def test_update_missing_or_someone_else(client, lecturer, student):
+    assert client.put("/users/999999999", json={"first_name": "x"}, headers=lecturer).status_code == 404
+    other = _me(client, _register(client, "student"))
+    assert client.put(f"/users/{other['id']}", json={"first_name": "x"}, headers=student).status_code == 403
+
+def test_admin_update_user(client):
+    admin = _register(client, "admin")
+    target = _me(client, _register(client, "lecturer"))
+    taken = _me(client, _register(client, "student"))
+    url = f"/admin/users/{target['id']}"
+    response = client.put(url, json={"username": taken["username"]}, headers=admin)
+    assert response.status_code == 400
+    # Keeping one's own email is not a clash
+    response = client.put(url, json={"email": target["email"], "lecturer_profile": {"department": "CS"}}, headers=admin)
+    assert response.status_code == 200, response.text
+    assert response.json()["lecturer_profile"]["department"] == "CS"
+    assert client.put(url, json={"first_name": "x"}, headers={**admin, "If-Match": '"1"'}).status_code == 409
+    assert client.put("/admin/users/999999999", json={"first_name": "x"}, headers=admin).status_code == 404
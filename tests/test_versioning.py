@@ -0,0 +1,48 @@
+from conftest import DUE_DATE
+from app.database.writes import update_row
+from app.models.finance import PaymentAnnouncement
+from app.utils.versioning import if_match_versions
+
+ANNOUNCEMENT = {"title": "Fees", "description": "d", "amount": "10", "payment_details": "p", "due_date": DUE_DATE}
+
+def test_if_match_versions():
+    assert if_match_versions(None) is None
+    assert if_match_versions("*") is None
+    assert if_match_versions('"3"') == [3]
+    assert if_match_versions('"3", W/"x", "5"') == [3, 5]
+
+def test_update_row_checks_and_bumps_the_version(client, db, lecturer):
+    row = client.post("/finance/announcements/", json=ANNOUNCEMENT, headers=lecturer).json()
+    updated = update_row(db, PaymentAnnouncement, row["id"], {"title": "First"}, versions=[1])
+    db.commit()
+    assert updated["version"] == 2
+    assert update_row(db, PaymentAnnouncement, row["id"], {"title": "Second"}, versions=[1]) is None
+    db.rollback()
+    db.expire_all()
+    assert db.get(PaymentAnnouncement, row["id"]).title == "First"
+
+def test_stale_if_match_gets_409_with_the_current_etag(client, lecturer):
+    created = client.post("/finance/announcements/", json=ANNOUNCEMENT, headers=lecturer).json()
+    url = f"/finance/announcements/{created['id']}"
+    etag = client.get(url, headers=lecturer).headers["etag"]
+    assert etag == '"1"'
+
+    response = client.put(url, json={"title": "Mine"}, headers={**lecturer, "If-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] == '"2"'
+
+    # Someone still holding version 1 must reload first
+    response = client.put(url, json={"title": "Theirs"}, headers={**lecturer, "If-Match": etag})
+    assert response.status_code == 409
+    assert response.headers["etag"] == '"2"'
+    assert client.get(url, headers=lecturer).json()["title"] == "Mine"
+
+    # Without If-Match the write goes through
+    assert client.put(url, json={"title": "Any"}, headers=lecturer).headers["etag"] == '"3"'
+
+def test_orm_updates_check_if_match(client, course, lecturer):
+    url = f"/courses/{course['id']}"
+    assert client.put(url, json={"description": "new"}, headers={**lecturer, "If-Match": '"1"'}).status_code == 200
+    response = client.put(url, json={"description": "newer"}, headers={**lecturer, "If-Match": '"1"'})
+    assert response.status_code == 409
+    assert response.headers["etag"] == '"2"'
@@ -0,0 +1,82 @@
+from datetime import datetime
+
+import pytest
+
+from app.database.database import engine
+from app.database.writes import insert_row, update_many, update_row
+from app.models.finance import PaymentAnnouncement
+
+def _announcement(db, title="Fees"):
+    row = insert_row(db, PaymentAnnouncement, {
+        "title": title,
+        "description": "d",
+        "amount": "10",
+        "payment_details": "p",
+        "due_date": datetime(2030, 1, 1),
+    })
+    db.commit()
+    return row
+
+@pytest.fixture(params=[True, False], ids=["returning", "select"])
+def update_returning(request, monkeypatch):
+    """
+    Run a test with RETURNING and with the read-back used where the dialect has none (MySQL).
+    """
+    monkeypatch.setattr(engine.dialect, "update_returning", request.param)
+    return request.param
+
+def test_update_row_returns_the_written_row(db, update_returning):
+    row = _announcement(db)
+    updated = update_row(db, PaymentAnnouncement, row["id"], {"title": "New"})
+    db.commit()
+    assert (updated["id"], updated["title"], updated["amount"]) == (row["id"], "New", "10")
+
+def test_update_row_missing_row(db, update_returning):
+    assert update_row(db, PaymentAnnouncement, -1, {"title": "x"}) is None
+
+def test_update_row_where_limits_the_rows(db, update_returning):
+    row = _announcement(db)
+    assert update_row(db, PaymentAnnouncement, row["id"], {"title": "x"}, where=[PaymentAnnouncement.amount == "20"]) is None
+    db.rollback()
+    assert db.get(PaymentAnnouncement, row["id"]).title == "Fees"
+
+def test_update_row_changing_a_filtered_column(db, update_returning):
+    row = _announcement(db, "Old title")
+    updated = update_row(
+        db, PaymentAnnouncement, row["id"], {"title": "New title"}, expect=[PaymentAnnouncement.title == "Old title"]
+    )
+    db.commit()
+    assert updated is not None
+    assert updated["title"] == "New title"
+
+def test_update_row_expect_guards_the_write(db, update_returning):
+    row = _announcement(db)
+    assert update_row(db, PaymentAnnouncement, row["id"], {"amount": "30"}, expect=[PaymentAnnouncement.amount == "20"]) is None
+    db.rollback()
+
+def test_update_many_applies_matching_versions(db):
+    first, second = _announcement(db, "A"), _announcement(db, "B")
+    matched = update_many(db, PaymentAnnouncement, [
+        {"id": first["id"], "title": "A2", "amount": None, "version": 1},
+        {"id": second["id"], "title": None, "amount": "99", "version": 1},
+    ], ("title", "amount"))
+    db.commit()
+    assert matched in (2, None)
+    first_row, second_row = db.get(PaymentAnnouncement, first["id"]), db.get(PaymentAnnouncement, second["id"])
+    # None leaves the column as it was
+    assert (first_row.title, first_row.amount, first_row.version) == ("A2", "10", 2)
+    assert (second_row.title, second_row.amount, second_row.version) == ("B", "99", 2)
+
+def test_update_many_skips_stale_versions(db):
+    fresh, stale = _announcement(db, "Fresh"), _announcement(db, "Stale")
+    update_row(db, PaymentAnnouncement, stale["id"], {"title": "Changed"})
+    db.commit()
+    matched = update_many(db, PaymentAnnouncement, [
+        {"id": fresh["id"], "title": "Fresh2", "version": 1},
+        {"id": stale["id"], "title": "Stale2", "version": 1},
+    ], ("title",))
+    db.commit()
+    assert matched in (1, None)
+    db.expire_all()
+    assert db.get(PaymentAnnouncement, fresh["id"]).title == "Fresh2"
+    assert db.get(PaymentAnnouncement, stale["id"]).title == "Changed"